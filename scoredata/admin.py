@@ -1,13 +1,36 @@
 from django.contrib import admin
 
 # Register your models here.
-from .models import Gymnast, Country, Meet, Event, Score, Post, Author, Tag
+from .models import Gymnast, Country, Meet, Event, Score, GymnastEventStats, SiteCounters, SourceRow, Post, Author, Tag
+from .generation import deferred_bump
+from .counters import refresh_counters
 
-admin.site.register(Gymnast)
+
+class ScoreDataAdmin(admin.ModelAdmin):
+	'''
+	Deleting a gymnast or meet also deletes all of their scores, and each deleted score would update the home page
+	counters and bump the data generation on its own. Deletes here bump the generation once and recount at the end.
+	'''
+
+	def delete_model(self, request, obj):
+		with deferred_bump():
+			super().delete_model(request, obj)
+		refresh_counters()
+
+	def delete_queryset(self, request, queryset):
+		with deferred_bump():
+			super().delete_queryset(request, queryset)
+		refresh_counters()
+
+
+admin.site.register(Gymnast, ScoreDataAdmin)
 admin.site.register(Country)
-admin.site.register(Meet)
+admin.site.register(Meet, ScoreDataAdmin)
 admin.site.register(Event)
-admin.site.register(Score)
+admin.site.register(Score, ScoreDataAdmin)
+admin.site.register(GymnastEventStats)
+admin.site.register(SiteCounters)
+admin.site.register(SourceRow)
 
 admin.site.register(Post)
 admin.site.register(Author)
@@ -1,5 +1,17 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+def search_index_after_migrate(sender, using, **kwargs):
+    from .search import create_search_index
+    create_search_index(using)
 
 
 class ScoredataConfig(AppConfig):
     name = 'scoredata'
+
+    def ready(self):
+        # Connect the signal handlers
+        from . import signals
+        # The search table and indexes depend on the scoredata tables, so they're created once migrate has run
+        post_migrate.connect(search_index_after_migrate, sender=self)
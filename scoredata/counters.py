@@ -0,0 +1,40 @@
+from django.core.cache import cache
+from django.db.models import F
+from django.utils import timezone
+from .models import Gymnast, Meet, Score, SiteCounters
+
+# **************************
+# Counts of scores, gymnasts and meets for the home page
+# **************************
+
+COUNTERS_CACHE_KEY = "scoredata:site_counters"
+COUNTERS_CACHE_SECONDS = 60
+
+
+def refresh_counters():
+	''' Recounts the scores, gymnasts and meets. Called by the management commands once they have loaded new data.'''
+	counters, _ = SiteCounters.objects.get_or_create(pk=1)
+	counters.num_scores = Score.objects.count()
+	counters.num_gymnasts = Gymnast.objects.count()
+	counters.num_meets = Meet.objects.count()
+	counters.updated = timezone.now()
+	counters.save()
+	cache.delete(COUNTERS_CACHE_KEY)
+	return counters
+
+
+def get_counters():
+	''' Returns the SiteCounters row, from the cache if possible'''
+	counters = cache.get(COUNTERS_CACHE_KEY)
+	if counters is None:
+		counters = SiteCounters.objects.filter(pk=1).first()
+		if counters is None:
+			counters = refresh_counters()
+		cache.set(COUNTERS_CACHE_KEY, counters, COUNTERS_CACHE_SECONDS)
+	return counters
+
+
+def adjust_counter(field, change):
+	''' Adds change (1 or -1) to one of the counters, e.g. when a score is added or deleted in the admin site'''
+	SiteCounters.objects.filter(pk=1).update(**{field: F(field) + change, 'updated': timezone.now()})
+	cache.delete(COUNTERS_CACHE_KEY)
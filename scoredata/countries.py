@@ -0,0 +1,78 @@
+import os
+import json
+from functools import lru_cache
+import pandas as pd
+import countrynames
+from .models import Country
+
+# **************************
+# Resolving the country names in the score sheets to countries
+# **************************
+# Spreadsheet names are mapped to the names countries are stored under with data/country_aliases.json (e.g. Chinese
+# Taipei is stored as Taiwan). A CountryResolver reads the Country table once, and after that every lookup is a dict
+# lookup: the countries a season needs that don't exist yet are created with one bulk_create, and the ids of the new
+# rows are added to the same dict.
+
+COUNTRY_ALIASES_PATH = os.path.join(os.path.dirname(__file__), "data", "country_aliases.json")
+COUNTRY_ALIASES_VERSION = 1
+
+
+@lru_cache(maxsize=None)
+def read_country_aliases(path=COUNTRY_ALIASES_PATH):
+	''' Returns ({spreadsheet name: stored name}, {stored name: ISO3c code}) from the alias file'''
+	with open(path, encoding="utf-8") as alias_file:
+		data = json.load(alias_file)
+	if data.get("version") != COUNTRY_ALIASES_VERSION:
+		raise ValueError("{} has version {}, but version {} is expected".format(path, data.get("version"), COUNTRY_ALIASES_VERSION))
+	return data["aliases"], data["codes"]
+
+
+def country_name(name, path=COUNTRY_ALIASES_PATH):
+	''' The name a country from the spreadsheets is stored under'''
+	aliases, _ = read_country_aliases(path)
+	name = name.strip()
+	return aliases.get(name, name)
+
+
+@lru_cache(maxsize=None)
+def country_code(name, path=COUNTRY_ALIASES_PATH):
+	''' The ISO3c code of a country from the spreadsheets, or None if it isn't a country'''
+	_, codes = read_country_aliases(path)
+	name = country_name(name, path)
+	if name in codes:
+		return codes[name]
+	try:
+		return countrynames.to_code_3(name)
+	except Exception:
+		return None
+
+
+class CountryResolver:
+	''' Maps country names from the spreadsheets to Country ids, creating the countries that don't exist yet'''
+
+	def __init__(self, path=COUNTRY_ALIASES_PATH):
+		self.path = path
+		self.ids = dict(Country.objects.values_list('name', 'id'))
+
+	def add(self, names):
+		''' Creates the countries in names that don't exist yet. Names that aren't countries are skipped.'''
+		new_countries = {}
+		for name in names:
+			if pd.isnull(name):
+				continue
+			stored_name = country_name(name, self.path)
+			if stored_name in self.ids or stored_name in new_countries:
+				continue
+			code = country_code(name, self.path)
+			if code is not None:
+				new_countries[stored_name] = Country(name=stored_name, iso3c=code)
+		if len(new_countries) > 0:
+			Country.objects.bulk_create(new_countries.values())
+			# Read them back, since not every database sets the primary keys on bulk_create
+			self.ids.update(Country.objects.filter(name__in=list(new_countries)).values_list('name', 'id'))
+
+	def get_id(self, name):
+		''' The id of a country from the spreadsheets (added with add()), or None'''
+		if pd.isnull(name):
+			return None
+		return self.ids.get(country_name(name, self.path))
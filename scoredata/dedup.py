@@ -0,0 +1,157 @@
+import re
+import unicodedata
+from collections import defaultdict, namedtuple
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef
+from .models import Gymnast, Score
+
+# **************************
+# Finding gymnasts that were loaded more than once, under slightly different names
+# **************************
+# Every name is normalized once: accents are dropped, a few letters are transliterated, "iia" becomes "ia", and case,
+# punctuation and whitespace are folded. Gymnasts with the same normalized name are candidates. Other pairs are only
+# compared if they share a blocking key (the first name plus the start of the last name, or the other way round), so
+# the number of comparisons grows with the size of the blocks rather than with the square of the number of
+# gymnasts, and are candidates if the edit distance between the normalized names is small and the names aren't too
+# short. Either way, two candidates are only combined if they are from the same country and never scored on the same
+# event on the same day of a meet (two records with a score there are two different gymnasts, while a typo on one day
+# of a meet is common). That is checked for the whole group each of them is already in, so that two records with
+# scores on the same day and event can't end up combined through a third.
+
+DEDUP_MAX_DISTANCE = 1
+# Names shorter than this (once normalized) are only merged if they normalize to the same name
+DEDUP_MIN_LENGTH = 8
+
+# Letters that don't decompose into a base letter and an accent
+TRANSLITERATIONS = str.maketrans({"ø": "o", "æ": "ae", "œ": "oe", "ł": "l", "đ": "d", "ð": "d", "þ": "th", "ı": "i"})
+
+GymnastRecord = namedtuple('GymnastRecord', ['id', 'name', 'country', 'num_scores', 'normalized'])
+DuplicateGroup = namedtuple('DuplicateGroup', ['keep', 'duplicates'])
+
+
+def normalize_gymnast_name(name):
+	''' Folds a gymnast's name for comparison, e.g. "Anastasiia  Iliankova" and "Anastasia Iliánkova" both become "anastasia iliankova"'''
+	name = name.casefold().translate(TRANSLITERATIONS)
+	name = "".join(character for character in unicodedata.normalize("NFKD", name) if not unicodedata.combining(character))
+	name = re.sub(r"[-‐_.]", " ", name)
+	name = re.sub(r"['’‘`]", "", name)
+	name = re.sub(r"iia\b", "ia", name)
+	return re.sub(r"\s+", " ", name).strip()
+
+
+def edit_distance(a, b, limit):
+	''' Levenshtein distance between a and b, or limit + 1 if it's more than limit'''
+	if abs(len(a) - len(b)) > limit:
+		return limit + 1
+	previous = list(range(len(b) + 1))
+	for i, character_a in enumerate(a, 1):
+		current = [i]
+		for j, character_b in enumerate(b, 1):
+			current.append(min(previous[j] + 1, current[j-1] + 1, previous[j-1] + (character_a != character_b)))
+		# Stop as soon as every path is already over the limit
+		if min(current) > limit:
+			return limit + 1
+		previous = current
+	return previous[-1]
+
+
+def _blocking_keys(normalized):
+	tokens = normalized.split(" ")
+	if len(tokens) < 2:
+		return [("name", normalized[:3])]
+	return [("first", tokens[0], tokens[-1][:2]), ("last", tokens[-1], tokens[0][:2])]
+
+
+def read_gymnasts():
+	''' Returns a GymnastRecord for every gymnast, with one query'''
+	gymnasts = Gymnast.objects.annotate(num_scores=Count('score')).values_list('id', 'name', 'country__iso3c', 'num_scores')
+	return [GymnastRecord(gymnast_id, name, country, num_scores, normalize_gymnast_name(name)) for gymnast_id, name, country, num_scores in gymnasts]
+
+
+def read_gymnast_scores():
+	''' Returns {gymnast id: set of the (meet id, meet day, event id, score num) of their scores}'''
+	scores = defaultdict(set)
+	for gymnast_id, meet_id, meet_day, event_id, score_num in Score.objects.values_list('gymnast_id', 'meet_id', 'meet_day', 'event_id', 'score_num').iterator():
+		scores[gymnast_id].add((meet_id, meet_day, event_id, score_num))
+	return scores
+
+
+def find_duplicates(gymnasts, scores=None, max_distance=DEDUP_MAX_DISTANCE, min_length=DEDUP_MIN_LENGTH):
+	'''
+	Groups the GymnastRecords that are the same gymnast. scores (from read_gymnast_scores) is used to rule out
+	names that competed against each other. Returns a DuplicateGroup for each group with more than one record: the
+	record to keep (the one with the most scores) and the records to merge into it.
+	'''
+	scores = scores if scores is not None else {}
+	# Pairs of matching records are joined into groups with a union-find, which keeps the country and the score keys
+	# of each group at its root
+	parent = {gymnast.id: gymnast.id for gymnast in gymnasts}
+	group_country = {gymnast.id: gymnast.country for gymnast in gymnasts}
+	group_scores = {gymnast.id: scores.get(gymnast.id, frozenset()) for gymnast in gymnasts}
+
+	def find(gymnast_id):
+		while parent[gymnast_id] != gymnast_id:
+			parent[gymnast_id] = parent[parent[gymnast_id]]
+			gymnast_id = parent[gymnast_id]
+		return gymnast_id
+
+	def join(a, b):
+		# Combines the groups of a and b, unless they are from different countries or both scored on the same event on
+		# the same day of a meet
+		root_a, root_b = find(a), find(b)
+		if root_a == root_b or group_country[root_a] != group_country[root_b] or group_scores[root_a] & group_scores[root_b]:
+			return
+		parent[root_a] = root_b
+		group_scores[root_b] = group_scores.pop(root_a) | group_scores[root_b]
+
+	# Same name once normalized (checked against every earlier record with the name, since the guards may keep it out
+	# of some of their groups)
+	by_name = defaultdict(list)
+	for gymnast in gymnasts:
+		for other in by_name[gymnast.normalized]:
+			join(gymnast.id, other.id)
+		by_name[gymnast.normalized].append(gymnast)
+
+	# Close names within each block
+	blocks = defaultdict(list)
+	for gymnast in gymnasts:
+		if len(gymnast.normalized) >= min_length:
+			for key in _blocking_keys(gymnast.normalized):
+				blocks[key].append(gymnast)
+	for block in blocks.values():
+		for i, gymnast in enumerate(block):
+			for other in block[i+1:]:
+				if gymnast.country != other.country or gymnast.normalized == other.normalized or find(gymnast.id) == find(other.id):
+					continue
+				if edit_distance(gymnast.normalized, other.normalized, max_distance) <= max_distance:
+					join(gymnast.id, other.id)
+
+	groups = defaultdict(list)
+	for gymnast in gymnasts:
+		groups[find(gymnast.id)].append(gymnast)
+	duplicate_groups = []
+	for group in groups.values():
+		if len(group) > 1:
+			group.sort(key=lambda gymnast: (-gymnast.num_scores, gymnast.name))
+			duplicate_groups.append(DuplicateGroup(group[0], group[1:]))
+	return sorted(duplicate_groups, key=lambda group: group.keep.name)
+
+
+def move_scores(gymnast, duplicate_gymnast):
+	'''
+	Moves all of gymnast's scores to duplicate_gymnast. Scores that duplicate_gymnast already has (same meet, day,
+	event and score num) are dropped, since they'd break the unique constraint on Score.
+	'''
+	already_loaded = Score.objects.filter(gymnast=duplicate_gymnast, meet=OuterRef('meet'), meet_day=OuterRef('meet_day'), event=OuterRef('event'), score_num=OuterRef('score_num'))
+	duplicate_ids = Score.objects.filter(gymnast=gymnast).annotate(already_loaded=Exists(already_loaded)).filter(already_loaded=True).values_list('id', flat=True)
+	Score.objects.filter(id__in=list(duplicate_ids)).delete()
+	Score.objects.filter(gymnast=gymnast).update(gymnast=duplicate_gymnast)
+
+
+def merge_duplicates(groups):
+	''' Moves the scores of each group's duplicates to the record that is kept, and deletes the duplicates'''
+	with transaction.atomic():
+		for group in groups:
+			for duplicate in group.duplicates:
+				move_scores(duplicate.id, group.keep.id)
+		Gymnast.objects.filter(id__in=[duplicate.id for group in groups for duplicate in group.duplicates]).delete()
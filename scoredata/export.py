@@ -0,0 +1,91 @@
+import csv
+import datetime
+import json
+from .models import Score
+
+# **************************
+# Streaming export of the score database
+# **************************
+# Rows are read with iterator(), which uses a server-side cursor on Postgres, and written out one at a time, so
+# memory use doesn't grow with the size of the export and the first rows go out straight away.
+
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_FORMATS = ["csv", "ndjson"]
+
+# (column name, field lookup from Score)
+EXPORT_COLUMNS = [
+	("gymnast", "gymnast__name"),
+	("gymnast_id", "gymnast_id"),
+	("country", "gymnast__country__name"),
+	("country_code", "gymnast__country__iso3c"),
+	("meet", "meet__name"),
+	("meet_id", "meet_id"),
+	("start_date", "meet__start_date"),
+	("end_date", "meet__end_date"),
+	("meet_day", "meet_day"),
+	("event", "event__name"),
+	("score_num", "score_num"),
+	("score", "score"),
+	("d_score", "d_score"),
+]
+
+
+def export_queryset(season=None, meet=None, country=None):
+	'''
+	Returns the scores to export. season is a year (meets that started that year), meet is a meet id and country is
+	an ISO3c code. Any of them can be left out.
+	'''
+	scores = Score.objects.all()
+	if season is not None:
+		scores = scores.filter(meet__start_date__gte=datetime.date(season, 1, 1), meet__start_date__lt=datetime.date(season+1, 1, 1))
+	if meet is not None:
+		scores = scores.filter(meet_id=meet)
+	if country is not None:
+		scores = scores.filter(gymnast__country__iso3c=country.upper())
+	# Ordering by primary key means the database can start returning rows without sorting the whole table first
+	return scores.order_by('id').values_list(*[lookup for _, lookup in EXPORT_COLUMNS])
+
+
+def _as_text(value):
+	if value is None:
+		return ""
+	if isinstance(value, datetime.date):
+		return value.isoformat()
+	return str(value)
+
+
+def _as_json(value):
+	# Dates and gymnast UUIDs are written as strings
+	if value is None or isinstance(value, (int, float, str)):
+		return value
+	return _as_text(value)
+
+
+class _Echo:
+	''' File-like object whose write() just returns the line, so that csv.writer can be used with a generator'''
+
+	def write(self, value):
+		return value
+
+
+def csv_lines(rows):
+	''' Yields the header and then one CSV line per row'''
+	writer = csv.writer(_Echo())
+	yield writer.writerow([name for name, _ in EXPORT_COLUMNS])
+	for row in rows:
+		yield writer.writerow([_as_text(value) for value in row])
+
+
+def ndjson_lines(rows):
+	''' Yields one JSON object per line for each row'''
+	names = [name for name, _ in EXPORT_COLUMNS]
+	for row in rows:
+		yield json.dumps(dict(zip(names, [_as_json(value) for value in row]))) + "\n"
+
+
+def export_lines(export_format, season=None, meet=None, country=None, chunk_size=EXPORT_CHUNK_SIZE):
+	''' Generator of output lines for the scores matching the filters, in "csv" or "ndjson" format'''
+	rows = export_queryset(season=season, meet=meet, country=country).iterator(chunk_size=chunk_size)
+	if export_format == "ndjson":
+		return ndjson_lines(rows)
+	return csv_lines(rows)
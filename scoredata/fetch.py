@@ -0,0 +1,121 @@
+import io
+import os
+import json
+import hashlib
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import requests
+from django.conf import settings
+
+# **************************
+# Downloading and caching the source spreadsheets and calendar pages
+# **************************
+# Each download is stored once under its sha256 in the cache directory, with an index.json that maps each URL to the
+# hash of its latest download. With offline=True, everything is read back from the cache and nothing is downloaded,
+# so an ingest can be re-run (or debugged) without the network.
+
+FETCH_WORKERS = 8
+FETCH_TIMEOUT = 60
+
+
+def get_cache_dir():
+	return getattr(settings, 'SOURCE_CACHE_DIR', os.path.join(settings.BASE_DIR, 'source_cache'))
+
+
+class SourceNotCached(Exception):
+	pass
+
+
+class FetchedSources:
+	'''
+	Read-only view of files that have already been downloaded (url -> bytes). It can be pickled, so it's what gets
+	handed to worker processes.
+	'''
+
+	def __init__(self, contents):
+		self.contents = contents
+
+	def get(self, url):
+		return self.contents[url]
+
+	def get_text(self, url):
+		return self.get(url).decode("utf-8", errors="replace")
+
+	def read_csv(self, url, **kwargs):
+		return pd.read_csv(io.BytesIO(self.get(url)), **kwargs)
+
+
+class SourceFetcher(FetchedSources):
+	'''
+	Downloads source files on a thread pool and keeps their raw bytes in a content-addressed cache.
+	'''
+
+	def __init__(self, cache_dir=None, offline=False, workers=FETCH_WORKERS):
+		super().__init__({})
+		self.cache_dir = cache_dir or get_cache_dir()
+		self.offline = offline
+		self.workers = workers
+		self._lock = threading.Lock()
+		os.makedirs(os.path.join(self.cache_dir, "objects"), exist_ok=True)
+		self.index = self._read_index()
+
+	def _index_path(self):
+		return os.path.join(self.cache_dir, "index.json")
+
+	def _object_path(self, digest):
+		return os.path.join(self.cache_dir, "objects", digest)
+
+	def _read_index(self):
+		try:
+			with open(self._index_path()) as index_file:
+				return json.load(index_file)
+		except FileNotFoundError:
+			return {}
+
+	def _write_file(self, path, data, mode="wb"):
+		# Write to a temporary file and move it into place, so that an interrupted run never leaves a partial file
+		temp_path = "{}.{}.tmp".format(path, threading.get_ident())
+		with open(temp_path, mode) as temp_file:
+			temp_file.write(data)
+		os.replace(temp_path, path)
+
+	def _store(self, url, data):
+		digest = hashlib.sha256(data).hexdigest()
+		if not os.path.exists(self._object_path(digest)):
+			self._write_file(self._object_path(digest), data)
+		with self._lock:
+			self.index[url] = {'sha256': digest, 'fetched': datetime.datetime.now().isoformat(), 'size': len(data)}
+			self._write_file(self._index_path(), json.dumps(self.index, indent=1, sort_keys=True), mode="w")
+
+	def _load_cached(self, url):
+		entry = self.index.get(url)
+		if entry is None:
+			raise SourceNotCached("{} has not been downloaded yet, so it can't be read offline".format(url))
+		with open(self._object_path(entry['sha256']), "rb") as cached_file:
+			return cached_file.read()
+
+	def _download(self, url):
+		response = requests.get(url, timeout=FETCH_TIMEOUT)
+		response.raise_for_status()
+		self._store(url, response.content)
+		return response.content
+
+	def _fetch(self, url):
+		if self.offline:
+			return self._load_cached(url)
+		return self._download(url)
+
+	def fetch_all(self, urls):
+		''' Downloads (or, offline, reads from the cache) all of the urls at once'''
+		urls = [url for url in dict.fromkeys(urls) if url not in self.contents]
+		with ThreadPoolExecutor(max_workers=self.workers) as executor:
+			for url, data in zip(urls, executor.map(self._fetch, urls)):
+				self.contents[url] = data
+
+	def get(self, url):
+		''' Returns the raw bytes of url, fetching it if fetch_all() didn't'''
+		if url not in self.contents:
+			self.contents[url] = self._fetch(url)
+		return self.contents[url]
@@ -0,0 +1,95 @@
+import resource
+import tracemalloc
+from contextlib import contextmanager
+import pandas as pd
+from pandas.api.types import union_categoricals
+from .ingest import SCORE_COLUMNS
+
+# **************************
+# Keeping the ingest data frames small
+# **************************
+# The score sheets are read in chunks, and every chunk is shrunk before the next one is read: scores become float32
+# and the columns that repeat the same few strings (countries, meets, meet days, dates) become categories, which
+# store each distinct string once. The cleaned seasons are shrunk the same way before they're loaded (or sent back
+# from a worker process). float32 only keeps about 7 significant digits, so the loader rounds scores back to 3
+# decimals, which is all the sheets have.
+
+INGEST_CHUNK_SIZE = 5000
+
+FLOAT_COLUMNS = [column for spec in SCORE_COLUMNS for column in spec[:2]]
+CATEGORY_COLUMNS = ["country", "meet_name", "meet_day", "meet_loc", "start_date", "end_date"]
+
+
+def shrink_frame(frame, floats=FLOAT_COLUMNS, categories=CATEGORY_COLUMNS):
+	''' Converts the float columns to float32 (blanking anything that isn't a number) and the others to categories'''
+	for column in floats:
+		if column in frame.columns:
+			frame[column] = pd.to_numeric(frame[column], errors='coerce').astype('float32')
+	for column in categories:
+		if column in frame.columns and frame[column].dtype.name != 'category':
+			frame[column] = frame[column].astype('category')
+	return frame
+
+
+def _concat_chunks(chunks, categories):
+	# Chunks only have the categories they use, and pd.concat falls back to plain strings unless they all match
+	for column in categories:
+		if column in chunks[0].columns:
+			all_categories = union_categoricals([chunk[column] for chunk in chunks]).categories
+			for chunk in chunks:
+				chunk[column] = chunk[column].cat.set_categories(all_categories)
+	return pd.concat(chunks, ignore_index=True)
+
+
+def read_csv_chunks(sources, url, columns=None, floats=FLOAT_COLUMNS, categories=CATEGORY_COLUMNS, chunksize=INGEST_CHUNK_SIZE):
+	'''
+	Reads a csv from sources (a SourceFetcher) chunksize rows at a time, renaming the columns to columns and
+	shrinking each chunk as it's read. Only columns that aren't cleaned any further should be listed in floats and
+	categories.
+	'''
+	chunks = []
+	for chunk in sources.read_csv(url, chunksize=chunksize):
+		if columns is not None:
+			chunk.columns = columns
+		chunks.append(shrink_frame(chunk, floats=floats, categories=categories))
+	return _concat_chunks(chunks, categories)
+
+
+def frame_size(frame):
+	''' Memory used by a data frame, strings included, in MB'''
+	return frame.memory_usage(deep=True).sum() / 1024 / 1024
+
+
+class MemoryReport:
+	'''
+	Measures the peak memory of each stage of an ingest with tracemalloc (which numpy and pandas report their arrays
+	to). Only memory allocated in this process is counted. When disabled, stage() does nothing.
+	'''
+
+	def __init__(self, enabled=True):
+		self.enabled = enabled
+		self.stages = []
+
+	@contextmanager
+	def stage(self, name):
+		if not self.enabled:
+			yield
+			return
+		if not tracemalloc.is_tracing():
+			tracemalloc.start()
+		tracemalloc.reset_peak()
+		before = tracemalloc.get_traced_memory()[0]
+		try:
+			yield
+		finally:
+			after, peak = tracemalloc.get_traced_memory()
+			self.stages.append((name, peak / 1024 / 1024, (after - before) / 1024 / 1024))
+
+	def print_report(self):
+		if not self.enabled:
+			return
+		print("Memory by stage (peak, and change once the stage was done):")
+		for name, peak, change in self.stages:
+			print("  {}: {:.1f} MB peak, {:+.1f} MB".format(name, peak, change))
+		# ru_maxrss is in KB on Linux
+		print("Peak resident memory of the process: {:.1f} MB".format(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
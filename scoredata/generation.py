@@ -0,0 +1,59 @@
+import threading
+import time
+from contextlib import contextmanager
+from django.db.models import F
+from django.utils import timezone
+from .models import DataGeneration
+
+# **************************
+# Data generation counter
+# **************************
+
+# How long each process trusts its copy of the generation before checking the database again
+GENERATION_CHECK_SECONDS = 5
+
+_local = threading.local()
+_cached = {'generation': None, 'checked': 0.0}
+
+
+def get_generation():
+	'''
+	Returns the current (generation number, last updated time) of the score data. The database is checked at most
+	once every GENERATION_CHECK_SECONDS per process.
+	'''
+	now = time.monotonic()
+	if _cached['generation'] is None or now - _cached['checked'] > GENERATION_CHECK_SECONDS:
+		row = DataGeneration.objects.filter(pk=1).values_list('generation', 'updated').first()
+		_cached['generation'] = row if row is not None else (0, None)
+		_cached['checked'] = now
+	return _cached['generation']
+
+
+def bump_generation():
+	''' Marks the score data as changed. Calls inside a deferred_bump() block are combined into one bump at the end.'''
+	if bumps_deferred():
+		_local.pending = True
+		return
+	updated = DataGeneration.objects.filter(pk=1).update(generation=F('generation') + 1, updated=timezone.now())
+	if updated == 0:
+		DataGeneration.objects.create(pk=1, generation=1)
+	# Make sure this process sees the new generation straight away
+	_cached['generation'] = None
+
+
+def bumps_deferred():
+	''' Returns True inside a deferred_bump() block, where per-row bookkeeping can wait until the end'''
+	return getattr(_local, 'deferred', 0) > 0
+
+
+@contextmanager
+def deferred_bump():
+	''' Used by the management commands so that loading thousands of rows only bumps the generation once'''
+	_local.deferred = getattr(_local, 'deferred', 0) + 1
+	try:
+		yield
+	finally:
+		_local.deferred -= 1
+		if _local.deferred == 0 and getattr(_local, 'pending', False):
+			_local.pending = False
+			bump_generation()
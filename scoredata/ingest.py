@@ -0,0 +1,269 @@
+import hashlib
+import pandas as pd
+from django.db import transaction
+from django.utils import timezone
+from .models import Gymnast, Meet, Event, Score, SourceRow
+from .countries import CountryResolver
+
+# **************************
+# Loading cleaned score spreadsheets into the database
+# **************************
+# The populate_scores commands clean each season's spreadsheet into a data frame with one row per gymnast per meet
+# day, then hand it to a ScoreLoader. The loader reads the existing countries, meets, gymnasts and events into dicts
+# once, so that each row doesn't need its own lookups, and writes new rows with bulk_create.
+#
+# In incremental mode, the loader also keeps a fingerprint of every row it has seen (SourceRow). Rows that haven't
+# changed since the last run are skipped, and rows that have changed are applied to the existing scores in place.
+
+INGEST_BATCH_SIZE = 1000
+
+# (score column, d score column, event, score num) for each score in a row
+SCORE_COLUMNS = [
+	("vt1", "vt1_d", "VT", 1),
+	("ub", "ub_d", "UB", 1),
+	("bb", "bb_d", "BB", 1),
+	("fx", "fx_d", "FX", 1),
+	("vt2", "vt2_d", "VT", 2),
+]
+
+# The columns that identify a row, and the columns whose contents are fingerprinted
+ROW_KEY_COLUMNS = ["gymnast", "meet_name", "meet_day"]
+FINGERPRINT_COLUMNS = ["gymnast", "country", "meet_name", "meet_day", "start_date", "end_date"] + [column for spec in SCORE_COLUMNS for column in spec[:2]]
+
+
+def _normalize(value):
+	# Blank cells, numbers and text are written out the same way however pandas happened to parse them
+	if pd.isnull(value):
+		return ""
+	if isinstance(value, (bool,)) or type(value).__name__ == "bool_":
+		return str(bool(value))
+	if isinstance(value, (int, float)) or hasattr(value, 'dtype'):
+		return repr(round(float(value), 3))
+	return str(value).strip()
+
+
+def _hash_columns(scores, columns):
+	joined = scores[columns].apply(lambda row: "\x1f".join(_normalize(value) for value in row), axis=1)
+	return joined.map(lambda text: hashlib.sha256(text.encode("utf-8")).hexdigest())
+
+
+def _score_value(value):
+	# Scores may come in as float32, which can't hold e.g. 13.466 exactly, so they're rounded back to the 3 decimals
+	# in the sheets (and made Python floats, which every database driver can handle). Blanks are stored as NULL.
+	if pd.isnull(value):
+		return None
+	return round(float(value), 3)
+
+
+def _same_value(old, new):
+	if pd.isnull(old) and pd.isnull(new):
+		return True
+	if pd.isnull(old) or pd.isnull(new):
+		return False
+	return round(float(old), 3) == round(float(new), 3)
+
+
+class ScoreLoader:
+	'''
+	Loads cleaned score data frames into the database. Existing countries, meets and gymnasts are matched by name
+	and new ones are created. A gymnast's scores from a meet day are skipped if they already have any scores from that
+	day (which is how the commands have always avoided loading a meet twice).
+
+	Every score that gets created is kept in new_scores, so that the precomputed stats can be updated at the end.
+	'''
+
+	def __init__(self, incremental=False):
+		self.incremental = incremental
+		# Rows inserted, updated and unchanged (incremental mode), and gymnasts whose existing scores were changed
+		self.counts = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+		self.changed_gymnasts = set()
+		self.countries = CountryResolver()
+		self.meets = {}
+		for meet in Meet.objects.only('id', 'name').order_by('id'):
+			self.meets.setdefault(meet.name, meet)
+		self.gymnasts = {}
+		for gymnast in Gymnast.objects.only('id', 'name').order_by('name', 'id'):
+			self.gymnasts.setdefault(gymnast.name, gymnast)
+		self.events = {(event.name, event.junior): event for event in Event.objects.all()}
+		self.event_names = {event.id: event.name for event in self.events.values()}
+		self.new_scores = []
+
+	def load_countries(self, countries):
+		''' Creates any countries that don't exist yet (under the names in data/country_aliases.json)'''
+		self.countries.add(countries)
+
+	def load_meets(self, meets_df):
+		''' Creates any meets that don't exist yet from a data frame of meet_name, start_date_fmt and end_date_fmt'''
+		new_meets = {}
+		for meet in meets_df.itertuples():
+			if meet.meet_name in self.meets or meet.meet_name in new_meets:
+				continue
+			if pd.isnull(meet.start_date_fmt)==False:
+				meet_instance = Meet(name = meet.meet_name, start_date=meet.start_date_fmt, end_date = meet.end_date_fmt)
+			else:
+				meet_instance = Meet(name = meet.meet_name)
+			new_meets[meet.meet_name] = meet_instance
+			print(meet_instance)
+		if len(new_meets) > 0:
+			Meet.objects.bulk_create(new_meets.values(), batch_size=INGEST_BATCH_SIZE)
+			for meet in Meet.objects.filter(name__in=list(new_meets)).only('id', 'name').order_by('id'):
+				self.meets.setdefault(meet.name, meet)
+
+	def load_gymnasts(self, gymnasts_df):
+		''' Creates any gymnasts that don't exist yet from a data frame of gymnast and country'''
+		new_gymnasts = []
+		for person in gymnasts_df.itertuples():
+			if person.gymnast not in self.gymnasts:
+				gymnast_instance = Gymnast(name = person.gymnast, country_id = self.countries.get_id(person.country))
+				self.gymnasts[person.gymnast] = gymnast_instance
+				new_gymnasts.append(gymnast_instance)
+		# Gymnast ids are UUIDs made in Python, so the new gymnasts can be used straight away
+		Gymnast.objects.bulk_create(new_gymnasts, batch_size=INGEST_BATCH_SIZE)
+
+	def _loaded_days(self, meet_ids):
+		# (gymnast id, meet id, meet day) for every gymnast that already has scores from each of these meets
+		loaded = set()
+		meet_ids = list(meet_ids)
+		for i in range(0, len(meet_ids), 500):
+			loaded.update(Score.objects.filter(meet_id__in=meet_ids[i:i+500]).values_list('gymnast_id', 'meet_id', 'meet_day').distinct())
+		return loaded
+
+	def load_scores(self, scores, junior):
+		''' Creates the scores in each row of scores. junior is the name of the column that marks junior gymnasts.'''
+		loaded = self._loaded_days(set(self.meets[name].id for name in scores.meet_name.drop_duplicates()))
+		new_scores = []
+		for row in scores.itertuples():
+			gymnast = self.gymnasts[row.gymnast]
+			meet = self.meets[row.meet_name]
+			if (gymnast.id, meet.id, row.meet_day) in loaded:
+				self.counts['unchanged'] += 1
+				continue
+			is_junior = bool(getattr(row, junior))
+			for column, d_column, event, score_num in SCORE_COLUMNS:
+				score = getattr(row, column)
+				if pd.isnull(score)==False:
+					new_scores.append(Score(gymnast = gymnast, meet = meet, meet_day = row.meet_day, event=self.events[(event, is_junior)],
+						score=_score_value(score), d_score=_score_value(getattr(row, d_column)), score_num=score_num))
+					# Later rows for the same gymnast and meet day are skipped, as if this one were already saved
+					loaded.add((gymnast.id, meet.id, row.meet_day))
+			if (gymnast.id, meet.id, row.meet_day) in loaded:
+				self.counts['inserted'] += 1
+			else:
+				self.counts['unchanged'] += 1
+		with transaction.atomic():
+			Score.objects.bulk_create(new_scores, batch_size=INGEST_BATCH_SIZE)
+		self.new_scores += new_scores
+
+	def update_scores(self, scores, junior):
+		'''
+		Applies rows of scores to gymnasts who already have scores from that meet day: changed scores are updated,
+		new ones are created and ones that have been blanked out are deleted.
+		'''
+		meet_ids = set(self.meets[name].id for name in scores.meet_name.drop_duplicates())
+		existing = {}
+		meet_ids = list(meet_ids)
+		for i in range(0, len(meet_ids), 500):
+			for score in Score.objects.filter(meet_id__in=meet_ids[i:i+500]):
+				existing[(score.gymnast_id, score.meet_id, score.meet_day, self.event_names[score.event_id], score.score_num)] = score
+
+		to_create, to_update, to_delete = [], [], []
+		for row in scores.itertuples():
+			gymnast = self.gymnasts[row.gymnast]
+			meet = self.meets[row.meet_name]
+			is_junior = bool(getattr(row, junior))
+			changed = False
+			for column, d_column, event, score_num in SCORE_COLUMNS:
+				score, d_score = getattr(row, column), getattr(row, d_column)
+				event_instance = self.events[(event, is_junior)]
+				score_instance = existing.get((gymnast.id, meet.id, row.meet_day, event, score_num))
+				if score_instance is None:
+					if pd.isnull(score)==False:
+						to_create.append(Score(gymnast = gymnast, meet = meet, meet_day = row.meet_day, event=event_instance,
+							score=_score_value(score), d_score=_score_value(d_score), score_num=score_num))
+						changed = True
+				elif pd.isnull(score):
+					to_delete.append(score_instance.id)
+					changed = True
+				elif not (_same_value(score_instance.score, score) and _same_value(score_instance.d_score, d_score) and score_instance.event_id == event_instance.id):
+					score_instance.score = _score_value(score)
+					score_instance.d_score = _score_value(d_score)
+					score_instance.event = event_instance
+					to_update.append(score_instance)
+					changed = True
+			if changed:
+				self.counts['updated'] += 1
+				self.changed_gymnasts.add(gymnast.id)
+			else:
+				self.counts['unchanged'] += 1
+
+		with transaction.atomic():
+			Score.objects.bulk_create(to_create, batch_size=INGEST_BATCH_SIZE)
+			Score.objects.bulk_update(to_update, ['score', 'd_score', 'event'], batch_size=INGEST_BATCH_SIZE)
+			Score.objects.filter(id__in=to_delete).delete()
+
+	def _changed_rows(self, scores, source):
+		# Returns (rows that are new or changed since the last run, their row keys, their fingerprints)
+		row_keys = _hash_columns(scores, ROW_KEY_COLUMNS)
+		fingerprints = _hash_columns(scores, FINGERPRINT_COLUMNS)
+		seen = dict(SourceRow.objects.filter(source=source).values_list('row_key', 'fingerprint'))
+		# As in a full load, only the first row for a gymnast and meet day counts
+		duplicate = row_keys.duplicated().tolist()
+		unchanged = [is_duplicate or seen.get(key) == fingerprint for key, fingerprint, is_duplicate in zip(row_keys, fingerprints, duplicate)]
+		changed = [not flag for flag in unchanged]
+		self.counts['unchanged'] += sum(unchanged)
+		return scores.loc[changed], row_keys[changed], fingerprints[changed]
+
+	def _save_fingerprints(self, source, row_keys, fingerprints):
+		existing = {}
+		row_keys = list(row_keys)
+		for i in range(0, len(row_keys), 500):
+			for row in SourceRow.objects.filter(source=source, row_key__in=row_keys[i:i+500]):
+				existing[row.row_key] = row
+		new_rows, updated_rows = [], []
+		for key, fingerprint in dict(zip(row_keys, fingerprints)).items():
+			if key in existing:
+				existing[key].fingerprint = fingerprint
+				existing[key].last_updated = timezone.now()
+				updated_rows.append(existing[key])
+			else:
+				new_rows.append(SourceRow(source=source, row_key=key, fingerprint=fingerprint))
+		SourceRow.objects.bulk_create(new_rows, batch_size=INGEST_BATCH_SIZE)
+		SourceRow.objects.bulk_update(updated_rows, ['fingerprint', 'last_updated'], batch_size=INGEST_BATCH_SIZE)
+
+	def load(self, scores, junior, source=None):
+		'''
+		Loads the countries, meets, gymnasts and scores from a cleaned season of scores, in one transaction. source
+		names the spreadsheet (e.g. the season) for incremental mode.
+		'''
+		with transaction.atomic():
+			if self.incremental:
+				self._load_incremental(scores, junior, source)
+			else:
+				self._load(scores, junior)
+
+	def _load_incremental(self, scores, junior, source):
+		scores, row_keys, fingerprints = self._changed_rows(scores, source)
+		if len(scores) > 0:
+			self._load_reference_data(scores)
+			# Rows for gymnasts who already have scores from that meet day are updated in place, the rest are inserted
+			loaded = self._loaded_days(set(self.meets[name].id for name in scores.meet_name.drop_duplicates()))
+			is_loaded = [(self.gymnasts[row.gymnast].id, self.meets[row.meet_name].id, row.meet_day) in loaded for row in scores.itertuples()]
+			is_new = [not flag for flag in is_loaded]
+			self.update_scores(scores.loc[is_loaded], junior)
+			self.load_scores(scores.loc[is_new], junior)
+		self._save_fingerprints(source, row_keys, fingerprints)
+
+	def _load(self, scores, junior):
+		self._load_reference_data(scores)
+		self.load_scores(scores, junior)
+
+	def _load_reference_data(self, scores):
+		self.load_countries(scores.country.drop_duplicates())
+
+		meets_df = scores[["meet_name", "start_date", "end_date", "meet_loc"]].drop_duplicates()
+		meets_df["start_date_fmt"] = pd.to_datetime(meets_df.start_date, format="%b %d %Y")
+		meets_df["end_date_fmt"] = pd.to_datetime(meets_df.end_date, format="%b %d %Y")
+		self.load_meets(meets_df)
+
+		gymnasts_df = scores[["gymnast", "country"]].drop_duplicates()
+		self.load_gymnasts(gymnasts_df)
@@ -0,0 +1,122 @@
+import datetime
+from collections import namedtuple
+from functools import reduce
+import numpy as np
+from django.db.models import Avg, Max
+from .models import Gymnast, Country, Score
+from .score_summaries import get_date_range
+from .snapshot import get_snapshot
+
+# **************************
+# Apparatus leaderboards
+# **************************
+# A leaderboard ranks every gymnast by their average or best score over a time window. As on the score selector, the
+# vault score is the average of the two vaults and the all around is VT1 + UB + BB + FX, so a gymnast needs every
+# part to be ranked. Each part is worked out for all gymnasts at once: from the score snapshot (one pass over its
+# sorted arrays), or, when that's out of date, with one grouped query per part on the (event, score num, score)
+# index. Only the gymnasts in the top ranks are then looked up.
+
+# The (event, score num) parts of each leaderboard, and whether the score is their total or their average
+LEADERBOARDS = {
+	"AA": ([("VT", 1), ("UB", 1), ("BB", 1), ("FX", 1)], "total"),
+	"VT": ([("VT", 1), ("VT", 2)], "average"),
+	"UB": ([("UB", 1)], "total"),
+	"BB": ([("BB", 1)], "total"),
+	"FX": ([("FX", 1)], "total"),
+}
+LEADERBOARD_SIZE = 50
+MAX_LEADERBOARD_SIZE = 500
+# Which scores count for each level (the junior flag of their event, or None for both)
+LEVELS = {"senior": False, "junior": True, "all": None}
+
+LeaderboardEntry = namedtuple('LeaderboardEntry', ['rank', 'gymnast', 'score', 'parts'])
+
+
+def _as_date(value):
+	if isinstance(value, datetime.datetime):
+		return value.date()
+	return value
+
+
+def _parts_from_snapshot(snapshot, parts, start, end, sumstat, junior, countries):
+	# Returns (gymnast positions, array of their part scores), for the gymnasts with every part
+	rows = snapshot.select(events=sorted(set(event for event, _ in parts)), start=start, end=end, junior=junior, countries=countries)
+	gymnasts, events, score_nums, results = snapshot.reduce(rows, sumstat)
+	part_gymnasts, part_results = [], []
+	for event, score_num in parts:
+		found = (events == snapshot.events.index(event)) & (score_nums == score_num)
+		part_gymnasts.append(gymnasts[found])
+		part_results.append(results[found])
+	# reduce() returns the gymnasts in order, so each part can be matched up with searchsorted
+	ranked = reduce(np.intersect1d, part_gymnasts)
+	scores = np.column_stack([part_result[np.searchsorted(part_gymnast, ranked)] for part_gymnast, part_result in zip(part_gymnasts, part_results)])
+	return ranked, scores
+
+
+def _parts_from_database(parts, start, end, sumstat, junior, countries):
+	# Same as _parts_from_snapshot, with one grouped query per part
+	statistic = Max('score') if sumstat == "max" else Avg('score')
+	part_scores = []
+	for event, score_num in parts:
+		scores = Score.objects.filter(event__name=event, score_num=score_num, score__isnull=False, meet__start_date__gte=start, meet__start_date__lte=end)
+		if junior is not None:
+			scores = scores.filter(event__junior=junior)
+		if countries is not None:
+			scores = scores.filter(gymnast__country__in=countries)
+		part_scores.append(dict(scores.values('gymnast_id').annotate(value=statistic).values_list('gymnast_id', 'value')))
+	ranked = list(reduce(set.intersection, (set(scores) for scores in part_scores)))
+	scores = np.array([[scores[gymnast_id] for scores in part_scores] for gymnast_id in ranked], dtype=np.float64).reshape(len(ranked), len(parts))
+	# Older loads stored some missing scores as NaN rather than null
+	complete = ~np.isnan(scores).any(axis=1)
+	return np.array(ranked, dtype=object)[complete], scores[complete]
+
+
+def get_part_names(apparatus):
+	''' Column names for the parts of a leaderboard, e.g. ["VT1", "VT2"] for vault'''
+	parts, _ = LEADERBOARDS[apparatus]
+	if apparatus == "VT":
+		return [event + str(score_num) for event, score_num in parts]
+	return [event for event, _ in parts]
+
+
+def get_country_ids(iso3c):
+	''' The ids of the countries with an ISO3c code (some codes have more than one name in the table)'''
+	return list(Country.objects.filter(iso3c=iso3c.upper()).values_list('id', flat=True))
+
+
+def get_leaderboard(apparatus, time, sumstat, level="senior", country=None, size=LEADERBOARD_SIZE):
+	'''
+	Returns the top size gymnasts on apparatus (VT, UB, BB, FX or AA) as LeaderboardEntries, best first. time and
+	sumstat are the score selector options ("year", "season" or "quad"; "avg" or "max"), level is "senior", "junior"
+	or "all", and country is an ISO3c code. Gymnasts with the same score share a rank.
+	'''
+	parts, combine = LEADERBOARDS[apparatus]
+	start, end = [_as_date(value) for value in get_date_range(time)]
+	sumstat = "max" if sumstat == "max" else "avg"
+	countries = get_country_ids(country) if country else None
+
+	snapshot = get_snapshot()
+	if snapshot is not None:
+		ranked, scores = _parts_from_snapshot(snapshot, parts, start, end, sumstat, LEVELS[level], countries)
+	else:
+		ranked, scores = _parts_from_database(parts, start, end, sumstat, LEVELS[level], countries)
+	totals = scores.sum(axis=1) if combine == "total" else scores.mean(axis=1)
+
+	# Pick the top gymnasts without sorting all of them
+	size = min(size, len(totals))
+	if size == 0:
+		return []
+	best = np.argpartition(-totals, size - 1)[:size]
+	best = best[np.argsort(-totals[best], kind="stable")]
+	gymnast_ids = snapshot.gymnast_ids_at(ranked[best]) if snapshot is not None else list(ranked[best])
+	gymnasts = Gymnast.objects.select_related('country').in_bulk(gymnast_ids)
+
+	entries = []
+	for gymnast_id, position in zip(gymnast_ids, best):
+		# (A gymnast deleted since the snapshot was checked is left out, and the ranks are counted without them)
+		if gymnast_id not in gymnasts:
+			continue
+		total = float(totals[position])
+		rank = entries[-1].rank if len(entries) > 0 and entries[-1].score == total else len(entries) + 1
+		entries.append(LeaderboardEntry(rank, gymnasts[gymnast_id], total, [float(score) for score in scores[position]]))
+	return entries
@@ -0,0 +1,69 @@
+import itertools
+from math import comb
+import numpy as np
+
+# **************************
+# Line-up search for the team tester
+# **************************
+
+APPARATUS = ["VT", "UB", "BB", "FX"]
+
+# Upper limit on the number of line-ups scored in one search (C(25, 5) is about 53,000). Each line-up takes about
+# 200 bytes while it's scored, so this keeps a search to around 20 MB.
+MAX_LINEUPS = 100000
+# Upper limit on the number of line-ups shown
+MAX_TOP_LINEUPS = 50
+# Upper limit on the team size (each member gets a search box when a line-up is entered by hand)
+MAX_TEAM_SIZE = 10
+
+
+def unique_gymnasts(gymnasts):
+	''' Drops repeats of the same gymnast (e.g. a name pasted into the pool twice), keeping the first'''
+	unique = {}
+	for gymnast in gymnasts:
+		unique.setdefault(gymnast.id, gymnast)
+	return list(unique.values())
+
+
+def pool_score_matrix(pool, sumstats):
+	'''
+	Builds an (n gymnasts x 4 apparatus) array of scores from the output of summarize_scores.
+	Missing scores are NaN.
+	'''
+	scores = np.full((len(pool), len(APPARATUS)), np.nan)
+	for i, gymnast in enumerate(pool):
+		for j, event in enumerate(APPARATUS):
+			score = sumstats.get((gymnast.id, event, 1))
+			if score is not None:
+				scores[i, j] = score
+	return scores
+
+
+def best_lineups(scores, team_size, scores_count, top_n=10):
+	'''
+	Scores every possible line-up of team_size gymnasts from the pool and returns the top_n as
+	(member indices, apparatus totals, team total), best first.
+
+	On each apparatus the best scores_count scores of the line-up count towards the total, and a
+	missing score counts as zero.
+	'''
+	num_gymnasts = scores.shape[0]
+	if team_size < 1 or team_size > num_gymnasts:
+		return []
+	if comb(num_gymnasts, team_size) > MAX_LINEUPS:
+		raise ValueError("Too many possible line-ups to search. Try a smaller pool.")
+
+	# All line-ups as an (n line-ups x team size) array of indices into the pool
+	members = np.array(list(itertools.combinations(range(num_gymnasts), team_size)), dtype=np.intp)
+
+	# Gather each line-up's scores, sort each apparatus in ascending order and add up the best scores_count
+	lineup_scores = np.nan_to_num(scores)[members]
+	lineup_scores.sort(axis=1)
+	apparatus_totals = lineup_scores[:, team_size - min(scores_count, team_size):, :].sum(axis=1)
+	totals = apparatus_totals.sum(axis=1)
+
+	# Pick the top_n line-ups without sorting all of them
+	top_n = min(top_n, len(totals))
+	best = np.argpartition(-totals, top_n - 1)[:top_n]
+	best = best[np.argsort(-totals[best], kind="stable")]
+	return [(members[i].tolist(), apparatus_totals[i].tolist(), float(totals[i])) for i in best]
@@ -0,0 +1,56 @@
+import random
+import time
+import pandas as pd
+from django.core.management.base import BaseCommand
+from scoredata.meet_names import read_meet_aliases, normalize_meet_names
+
+
+class Command(BaseCommand):
+
+	help = 'This times the meet name aliases (one pass over the distinct names) against chaining one str.replace per alias over the whole column, which is how the names used to be cleaned, on a synthetic column of meet names. It also lists the names that come out differently.'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--season', default="2017", help="Season whose aliases are used")
+		parser.add_argument('--rows', type=int, default=100000, help="Number of synthetic score rows")
+		parser.add_argument('--repeat', type=int, default=5, help="Number of times each version is timed")
+		parser.add_argument('--seed', type=int, default=1)
+
+	def _chained(self, names, aliases):
+		# The old way: one pass over the column per alias, each pass working on the output of the one before
+		for alias, name, exact in aliases:
+			if exact:
+				names = names.where(names.str.strip() != alias, name)
+			else:
+				names = names.str.replace(alias, name, regex=False)
+		return names
+
+	def _names(self, aliases, options):
+		# Short names, full names and unrelated names, some with a meet day left over
+		rng = random.Random(options['seed'])
+		distinct = [alias for alias, _, _ in aliases] + [name for _, name, _ in aliases] + ["Meet {}".format(i) for i in range(200)]
+		distinct += [name + " " + day for name in distinct[:40] for day in ["Champs", "Qualifier"]]
+		return pd.Series([rng.choice(distinct) for _ in range(options['rows'])])
+
+	def _time(self, function, options):
+		started = time.perf_counter()
+		for _ in range(options['repeat']):
+			result = function()
+		return result, (time.perf_counter() - started) / options['repeat'] * 1000
+
+	def handle(self, *args, **options):
+		aliases = read_meet_aliases().get(options['season'], ())
+		if len(aliases) == 0:
+			print("There are no aliases for {}".format(options['season']))
+			return
+		names = self._names(aliases, options)
+		chained, chained_ms = self._time(lambda: self._chained(names, aliases), options)
+		table, table_ms = self._time(lambda: normalize_meet_names(names, options['season']), options)
+		print("{} rows, {} distinct names, {} aliases".format(len(names), names.nunique(), len(aliases)))
+		print("chained str.replace: {:.1f} ms".format(chained_ms))
+		print("alias table:         {:.1f} ms".format(table_ms))
+
+		differences = pd.DataFrame({'name': names, 'chained': chained, 'table': table}).drop_duplicates()
+		differences = differences.loc[differences.chained != differences.table]
+		print("\n{} distinct names come out differently:".format(len(differences)))
+		for row in differences.sort_values('name').itertuples():
+			print("  {!r}: {!r} (chained) -> {!r} (table)".format(row.name, row.chained, row.table))
@@ -0,0 +1,125 @@
+import random
+import time
+import uuid
+import datetime
+from django.core.management.base import BaseCommand
+from django.db.utils import ConnectionHandler
+from scoredata.models import Gymnast, Country, Meet, Event, Score
+from scoredata.meet_pages import meet_page_querysets, MEETS_PER_PAGE
+
+
+class Command(BaseCommand):
+
+	help = 'This builds a large synthetic score database in memory (SQLite) and compares the query plans and timings of the main score queries with and without the Score/Meet indexes and unique constraint. It does not touch the real database.'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--gymnasts', type=int, default=20000, help="Number of synthetic gymnasts")
+		parser.add_argument('--meets', type=int, default=2000, help="Number of synthetic meets")
+		parser.add_argument('--scores', type=int, default=500000, help="Approximate number of synthetic scores")
+		parser.add_argument('--repeat', type=int, default=200, help="Number of times each query is timed")
+		parser.add_argument('--seed', type=int, default=1)
+
+	def _connect(self):
+		# A separate in-memory database, so that the benchmark never touches the real one
+		handler = ConnectionHandler({'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'}})
+		return handler['default']
+
+	def _create_schema(self, connection, with_indexes):
+		# For the "before" schema, hide the new indexes and constraints while the tables are created. (Removing them
+		# afterwards doesn't work on SQLite, which rebuilds the table from the model, indexes and all.)
+		saved = {model: (model._meta.indexes, model._meta.constraints) for model in [Meet, Score]}
+		try:
+			if not with_indexes:
+				for model in saved:
+					model._meta.indexes, model._meta.constraints = [], []
+			with connection.schema_editor() as editor:
+				for model in [Country, Gymnast, Meet, Event, Score]:
+					editor.create_model(model)
+		finally:
+			for model, (indexes, constraints) in saved.items():
+				model._meta.indexes, model._meta.constraints = indexes, constraints
+
+	def _fill(self, connection, options):
+		rng = random.Random(options['seed'])
+		cursor = connection.cursor()
+		cursor.executemany("INSERT INTO scoredata_country (id, name, iso3c) VALUES (%s, %s, %s)", [(i, "Country {}".format(i), "C{:02d}".format(i)) for i in range(1, 61)])
+		cursor.executemany("INSERT INTO scoredata_event (id, name, junior) VALUES (%s, %s, %s)", [(i, name, False) for i, (name, _) in enumerate(Event.event_names, 1)])
+		gymnast_ids = [uuid.UUID(int=rng.getrandbits(128)).hex for _ in range(options['gymnasts'])]
+		cursor.executemany("INSERT INTO scoredata_gymnast (id, name, country_id, summary) VALUES (%s, %s, %s, NULL)", [(gymnast_id, "Gymnast {}".format(i), rng.randint(1, 60)) for i, gymnast_id in enumerate(gymnast_ids)])
+		start = datetime.date(2010, 1, 1)
+		meets = []
+		for i in range(1, options['meets']+1):
+			start_date = start + datetime.timedelta(days=rng.randint(0, 4000))
+			meets.append((i, "Meet {}".format(i), start_date.isoformat(), (start_date + datetime.timedelta(days=2)).isoformat()))
+		cursor.executemany("INSERT INTO scoredata_meet (id, name, start_date, end_date) VALUES (%s, %s, %s, %s)", meets)
+
+		# Each meet has a field of gymnasts, who each get a score on every event on one or more days
+		scores = []
+		per_meet = max(1, options['scores'] // (options['meets'] * 5))
+		score_id = 1
+		for meet_id in range(1, options['meets']+1):
+			field = rng.sample(gymnast_ids, min(len(gymnast_ids), per_meet))
+			for gymnast_id in field:
+				for meet_day in rng.choice([["QF"], ["QF", "AA"], ["QF", "EF"]]):
+					for event_id in range(1, 5):
+						scores.append((score_id, meet_id, meet_day, gymnast_id, event_id, round(rng.uniform(10, 15), 3), round(rng.uniform(4, 6.5), 1), 1))
+						score_id += 1
+			if len(scores) > 50000:
+				cursor.executemany("INSERT INTO scoredata_score (id, meet_id, meet_day, gymnast_id, event_id, score, d_score, score_num) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)", scores)
+				scores = []
+		cursor.executemany("INSERT INTO scoredata_score (id, meet_id, meet_day, gymnast_id, event_id, score, d_score, score_num) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)", scores)
+		cursor.execute("ANALYZE")
+		return gymnast_ids
+
+	def _queries(self, gymnast_ids, options):
+		# The main Score/Meet access patterns of the views and the ingest commands
+		rng = random.Random(options['seed'] + 1)
+		return [
+			("Gymnast page", lambda: Score.objects.filter(gymnast_id=rng.choice(gymnast_ids)).select_related('meet', 'event').order_by('id')),
+			("Meet page", lambda: Score.objects.filter(meet_id=rng.randint(1, options['meets'])).select_related('gymnast__country', 'event').order_by('id')),
+			("Meet day/event", lambda: Score.objects.filter(meet_id=rng.randint(1, options['meets']), meet_day="QF", event_id=rng.randint(1, 4))),
+			("Ingest duplicate check", lambda: Score.objects.filter(gymnast_id=rng.choice(gymnast_ids), meet_id=rng.randint(1, options['meets']), meet_day="QF")[:1]),
+			("Event top scores", lambda: Score.objects.filter(event_id=rng.randint(1, 4), score_num=1).order_by('-score')[:50]),
+			# The first query that the meet list runs for a page deep into the list
+			("Meet list page", lambda: self._meet_page_query(rng, options)),
+		]
+
+	def _meet_page_query(self, rng, options):
+		cursor = (datetime.date(2010, 1, 1) + datetime.timedelta(days=rng.randint(0, 4000)), rng.randint(1, options['meets']))
+		querysets, _ = meet_page_querysets(Meet.objects.only('id', 'name', 'start_date', 'end_date'), after=cursor)
+		return querysets[0][:MEETS_PER_PAGE+1]
+
+	def _run(self, connection, gymnast_ids, options):
+		results = {}
+		cursor = connection.cursor()
+		for name, make_queryset in self._queries(gymnast_ids, options):
+			sql, params = make_queryset().query.get_compiler(connection=connection).as_sql()
+			cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+			plan = [row[-1] for row in cursor.fetchall()]
+			started = time.perf_counter()
+			for _ in range(options['repeat']):
+				sql, params = make_queryset().query.get_compiler(connection=connection).as_sql()
+				cursor.execute(sql, params)
+				cursor.fetchall()
+			results[name] = (plan, (time.perf_counter() - started) / options['repeat'] * 1000)
+		return results
+
+	def handle(self, *args, **options):
+		runs = {}
+		for label, with_indexes in [("before", False), ("after", True)]:
+			connection = self._connect()
+			self._create_schema(connection, with_indexes)
+			started = time.perf_counter()
+			gymnast_ids = self._fill(connection, options)
+			load_time = time.perf_counter() - started
+			runs[label] = self._run(connection, gymnast_ids, options)
+			count = connection.cursor().execute("SELECT count(*) FROM scoredata_score").fetchone()[0]
+			print("{}: loaded {} scores in {:.1f}s".format(label, count, load_time))
+			connection.close()
+
+		for name in runs["before"]:
+			before_plan, before_ms = runs["before"][name]
+			after_plan, after_ms = runs["after"][name]
+			print("\n{}: {:.3f} ms -> {:.3f} ms".format(name, before_ms, after_ms))
+			print("  before: " + "; ".join(before_plan))
+			print("  after:  " + "; ".join(after_plan))
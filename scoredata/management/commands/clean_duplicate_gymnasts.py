@@ -1,96 +1,49 @@
 from django.core.management.base import BaseCommand
-from scoredata.models import Gymnast, Country, Meet, Event, Score
+from scoredata.generation import bump_generation, deferred_bump
+from scoredata.search import rebuild_search_index
+from scoredata.counters import refresh_counters
+from scoredata.snapshot import write_snapshot
+from scoredata.score_stats import rebuild_stats
+from scoredata.dedup import read_gymnasts, read_gymnast_scores, find_duplicates, merge_duplicates, edit_distance, DEDUP_MAX_DISTANCE, DEDUP_MIN_LENGTH
 
-import pandas as pd
-import numpy as np
-import math
-from bs4 import BeautifulSoup
-from requests import get
-import regex as re 
-import countrynames
-import datetime
-
-pd.options.mode.chained_assignment = None 
 
 class Command(BaseCommand):
 
-	help = 'This combines records for gymnasts with multiple records for similar versions of their name.'
-
-	
-
-
-	def _clean_dups(self):
-
-		# **************************
-		# Cases where one version has iia and the other has ia
-		# **************************
-		gymnasts_to_clean = Gymnast.objects.filter(name__contains='iia ')
-		for gymnast in gymnasts_to_clean:
-
-			# Get name of duplicate gymnast
-			duplicate_name = gymnast.name.replace('iia ', 'ia ')
-
-			try:
-				# Find the duplicate gymnast object
-				duplicate_gymnast = Gymnast.objects.get(name=duplicate_name)
-				print("Combining {} and {}".format(gymnast.name, duplicate_name))
-				# Add all scores from the 'iia' copy to the 'ia' copy
-				scores = gymnast.score_set.all()
-				scores.update(gymnast=duplicate_gymnast)
-				# Remove duplicate
-				gymnast.delete()
-
-			except Gymnast.DoesNotExist:
-				pass
-
-		# **************************
-		# Cases where one version has é and the other has e
-		# **************************
-		gymnasts_to_clean = Gymnast.objects.filter(name__contains='é')
-		for gymnast in gymnasts_to_clean:
-
-			# Get name of duplicate gymnast
-			duplicate_name = gymnast.name.replace('é', 'e')
-
-			try:
-				# Find the duplicate gymnast object
-				duplicate_gymnast = Gymnast.objects.get(name=duplicate_name)
-				print("Combining {} and {}".format(gymnast.name, duplicate_name))
-				# Add all scores from the 'iia' copy to the 'ia' copy
-				scores = gymnast.score_set.all()
-				scores.update(gymnast=duplicate_gymnast)
-				# Remove duplicate
-				gymnast.delete()
-
-			except Gymnast.DoesNotExist:
-				pass
+	help = 'This combines records for gymnasts with multiple records for similar versions of their name (e.g. "Anastasiia"/"Anastasia", "é"/"e", different case or spacing, or a one letter typo within the same country, if they never both scored on the same event on the same day of a meet).'
 
-				try:
-						gymnast = Gymnast.objects.get(name="Jade Carey ")
-						duplicate_gymnast = Gymnast.objects.get(name="Jade Carey")
-						scores = gymnast.score_set.all()
-						scores.update(gymnast=duplicate_gymnast)
-						gymnast.delete()
-				except Gymnast.DoesNotExist:
-						pass
+	def add_arguments(self, parser):
+		parser.add_argument('--dry-run', action='store_true', help="List the gymnasts that would be combined, without changing anything")
+		parser.add_argument('--max-distance', type=int, default=DEDUP_MAX_DISTANCE, help="Largest edit distance between two names from the same country for them to be combined")
+		parser.add_argument('--min-length', type=int, default=DEDUP_MIN_LENGTH, help="Names shorter than this are only combined if they are the same once normalized")
 
-				try:
-						gymnast = Gymnast.objects.get(name="Morgan Jewel")
-						duplicate_gymnast = Gymnast.objects.get(name="Morgan Jewell")
-						scores = gymnast.score_set.all()
-						scores.update(gymnast=duplicate_gymnast)
-						gymnast.delete()
-				except Gymnast.DoesNotExist:
-						pass
+	def _describe(self, gymnast):
+		return "{} ({}, {} scores)".format(gymnast.name, gymnast.country, gymnast.num_scores)
 
-				try:
-						gymnast = Gymnast.objects.get(name="Yeo Seo-jeong")
-						duplicate_gymnast = Gymnast.objects.get(name="Yeo Seo-Jeong")
-						scores = gymnast.score_set.all()
-						scores.update(gymnast=duplicate_gymnast)
-						gymnast.delete()
-				except Gymnast.DoesNotExist:
-						pass				
+	def _report(self, groups):
+		for group in groups:
+			print("Keeping {}".format(self._describe(group.keep)))
+			for duplicate in group.duplicates:
+				if duplicate.normalized == group.keep.normalized:
+					reason = "same name once normalized"
+				else:
+					reason = "edit distance {}".format(edit_distance(duplicate.normalized, group.keep.normalized, len(duplicate.normalized) + len(group.keep.normalized)))
+				print("  combining {}: {}".format(self._describe(duplicate), reason))
+		print("{} gymnasts to combine into {}".format(sum(len(group.duplicates) for group in groups), len(groups)))
 
 	def handle(self, *args, **options):
-		self._clean_dups()
+		groups = find_duplicates(read_gymnasts(), scores=read_gymnast_scores(), max_distance=options['max_distance'], min_length=options['min_length'])
+		self._report(groups)
+		if options['dry_run'] or len(groups) == 0:
+			return
+		# Bump the data generation once when the load is done, rather than once per row
+		with deferred_bump():
+			merge_duplicates(groups)
+			bump_generation()
+		# Make sure the search index matches the new data
+		rebuild_search_index()
+		# Recount the scores, gymnasts and meets for the home page
+		refresh_counters()
+		# Scores may have moved between gymnasts, so regenerate the precomputed stats
+		rebuild_stats()
+		# Write the score snapshot for the analytics pages
+		write_snapshot()
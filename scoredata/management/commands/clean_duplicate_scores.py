@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from scoredata.models import Score, DataGeneration
+from scoredata.generation import bump_generation
+from scoredata.counters import refresh_counters
+from scoredata.score_stats import rebuild_stats
+from scoredata.snapshot import write_snapshot
+
+# The fields of the unique_score constraint on Score
+SCORE_KEY = ['gymnast', 'meet', 'meet_day', 'event', 'score_num']
+
+
+class Command(BaseCommand):
+
+	help = 'This lists scores that are loaded more than once for the same gymnast, meet, day, event and vault number, which the unique_score constraint doesn\'t allow. Run it before the migration that adds the constraint (which fails while there are any), and again with --delete to keep the first loaded copy of each score and delete the rest. Then run migrate. Without --delete, it exits with an error if there are any duplicates.'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--delete', action='store_true', help="Delete every copy of a duplicated score except the first one loaded")
+
+	def _find_duplicates(self):
+		# Returns {score key: [scores, first loaded first]} for every key with more than one score
+		keys = Score.objects.values(*SCORE_KEY).annotate(copies=Count('id')).filter(copies__gt=1)
+		duplicates = {}
+		for key in keys:
+			scores = Score.objects.filter(**{field: key[field] for field in SCORE_KEY}).select_related('gymnast', 'meet', 'event').order_by('id')
+			duplicates[tuple(key[field] for field in SCORE_KEY)] = list(scores)
+		return duplicates
+
+	def _report(self, duplicates):
+		for scores in duplicates.values():
+			first = scores[0]
+			# Copies with a different score (or D score) are worth a look, since only the first one is kept
+			differs = any((score.score, score.d_score) != (first.score, first.d_score) for score in scores[1:])
+			print("{}, {} {} {}{}: {} copies{} (scores {})".format(first.gymnast.name, first.meet.name, first.meet_day, first.event.name,
+				first.score_num if first.event.name == "VT" else "", len(scores), ", which differ" if differs else "",
+				", ".join(str(score.score) for score in scores)))
+		print("{} duplicated scores, {} copies to delete".format(len(duplicates), sum(len(scores) - 1 for scores in duplicates.values())))
+
+	def handle(self, *args, **options):
+		duplicates = self._find_duplicates()
+		self._report(duplicates)
+		if len(duplicates) == 0:
+			return
+		if not options['delete']:
+			raise CommandError("There are duplicate scores, so the unique_score constraint can't be added yet. Run this again with --delete to remove them.")
+
+		# Deleted with SQL rather than through the ORM, so that the post_delete signals don't run: on a database that
+		# hasn't been migrated yet, the tables they update may not exist
+		extra_ids = [score.id for scores in duplicates.values() for score in scores[1:]]
+		with transaction.atomic(), connection.cursor() as cursor:
+			for i in range(0, len(extra_ids), 500):
+				batch = extra_ids[i:i+500]
+				cursor.execute("DELETE FROM {} WHERE id IN ({})".format(connection.ops.quote_name(Score._meta.db_table), ", ".join(["%s"] * len(batch))), batch)
+		print("Deleted {} scores".format(len(extra_ids)))
+
+		# If the database is already migrated, bring everything that is worked out from the scores up to date
+		if DataGeneration._meta.db_table in connection.introspection.table_names():
+			bump_generation()
+			refresh_counters()
+			rebuild_stats()
+			write_snapshot()
@@ -0,0 +1,24 @@
+import sys
+from django.core.management.base import BaseCommand
+from scoredata.export import EXPORT_CHUNK_SIZE, EXPORT_FORMATS, export_lines
+
+
+class Command(BaseCommand):
+
+	help = 'This writes the score database (joined to gymnasts, countries, meets and events) out as CSV or NDJSON, optionally filtered by season, meet or country'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--format', choices=EXPORT_FORMATS, default="csv", help="Output format")
+		parser.add_argument('--season', type=int, help="Only export meets that started in this year")
+		parser.add_argument('--meet', type=int, help="Only export this meet (by id)")
+		parser.add_argument('--country', help="Only export gymnasts from this country (ISO3c code)")
+		parser.add_argument('--output', help="File to write to (defaults to standard output)")
+		parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE, help="Number of rows fetched from the database at a time")
+
+	def handle(self, *args, **options):
+		lines = export_lines(options['format'], season=options['season'], meet=options['meet'], country=options['country'], chunk_size=options['chunk_size'])
+		if options['output']:
+			with open(options['output'], "w", newline="", encoding="utf-8") as output:
+				output.writelines(lines)
+		else:
+			sys.stdout.writelines(lines)
@@ -1,5 +1,15 @@
 from django.core.management.base import BaseCommand
 from scoredata.models import Gymnast, Country, Meet, Event, Score
+from scoredata.generation import bump_generation, deferred_bump
+from scoredata.search import rebuild_search_index
+from scoredata.counters import refresh_counters
+from scoredata.snapshot import write_snapshot
+from scoredata.score_stats import update_stats, rebuild_gymnast_stats
+from scoredata.ingest import ScoreLoader
+from scoredata.fetch import SourceFetcher
+from scoredata.meet_names import normalize_meet_names
+from scoredata.frames import read_csv_chunks, shrink_frame, MemoryReport, frame_size
+from scoredata.validation import validate_scores
 
 import pandas as pd
 import numpy as np
@@ -12,6 +22,11 @@ import datetime
 
 pd.options.mode.chained_assignment = None 
 
+# Every source file that the command reads, so that they can all be downloaded at once
+SOURCES = [
+	"https://docs.google.com/spreadsheets/d/1GDR4Bqtl5t8Ran-6M7_r8Ht5SD-8F9V5F3Fhp10xkWU/export?format=csv",
+]
+
 class Command(BaseCommand):
 
 	help = 'This reads in the current year\'s score data and loads it into the database.'
@@ -22,7 +37,22 @@ class Command(BaseCommand):
 	# **************************
 
 
-	def _create_db(self):
+	def add_arguments(self, parser):
+		parser.add_argument('--offline', action='store_true', help="Read the source files from the local cache instead of downloading them")
+		parser.add_argument('--cache-dir', help="Directory for the cached source files (defaults to SOURCE_CACHE_DIR)")
+		parser.add_argument('--incremental', action='store_true', help="Only load rows that are new or changed since the last incremental run, and apply corrections to existing scores")
+		parser.add_argument('--memory-report', action='store_true', help="Print the peak memory of each stage of the load")
+
+	def _create_db(self, sources):
+
+		# **************************
+		# Download the source files, all at once
+		# **************************
+		with self.memory.stage("download"):
+			sources.fetch_all(SOURCES)
+
+		# Reads the existing countries, meets, gymnasts and events once, and keeps track of every new score
+		loader = ScoreLoader(incremental=self.incremental)
 
 		# **************************
 		# Read in The Gymternet's score spreadsheet
@@ -30,9 +60,10 @@ class Command(BaseCommand):
 
 		# Totals
 		#scores = pd.read_csv("https://docs.google.com/spreadsheets/d/1mAZlBhTIPOSZND4Z90ZmHJgobSqU8jv5dGpl54DHWSw/export?gid=0&format=csv") # used to need gid=0, now it causes 400 error
-		scores = pd.read_csv("https://docs.google.com/spreadsheets/d/1GDR4Bqtl5t8Ran-6M7_r8Ht5SD-8F9V5F3Fhp10xkWU/export?format=csv")
-		scores.head()
-		scores.columns = ["gymnast", "country", "meet_name", "meet_day", "vt1", "vt2", "ub", "bb", "fx", "vt1_d", "vt2_d", "ub_d", "bb_d", "fx_d", "meet_loc", "start_date", "end_date", "junior2021"]
+		with self.memory.stage("read"):
+			# Read in chunks, with the repeated text as categories (meet names get the year added below). Scores are
+			# converted by validate_scores, which reports any that aren't numbers.
+			scores = read_csv_chunks(sources, "https://docs.google.com/spreadsheets/d/1GDR4Bqtl5t8Ran-6M7_r8Ht5SD-8F9V5F3Fhp10xkWU/export?format=csv", columns=["gymnast", "country", "meet_name", "meet_day", "vt1", "vt2", "ub", "bb", "fx", "vt1_d", "vt2_d", "ub_d", "bb_d", "fx_d", "meet_loc", "start_date", "end_date", "junior2021"], floats=[], categories=["country", "meet_day", "meet_loc", "start_date", "end_date"])
 
 		# **************************
 		# Clean the scores data
@@ -42,6 +73,9 @@ class Command(BaseCommand):
 		# Clean the meet type
 		# **************************
 
+		# Expand short meet names, with the 2021 aliases in data/meet_aliases.json
+		scores["meet_name"] = normalize_meet_names(scores.meet_name, "2021")
+
 		# **************************
 		# Mark juniors
 		# **************************
@@ -55,92 +89,42 @@ class Command(BaseCommand):
 		scores['meet_name'] = scores['meet_name'].astype(str) + " (2021)"
 
 		# **************************
-		# Load countries in
-		# **************************
-
-		countries_df = scores.country.drop_duplicates()
-		for country in countries_df:
-			try:
-				country_test = Country.objects.get(name=country)
-			except Country.DoesNotExist:
-				if country != "Chinese Taipei" and country != "Taiwan":
-					country_instance = Country(name = country, iso3c = countrynames.to_code_3(country))
-					country_instance.save()
-				else:
-					try:
-						country_test = Country.objects.get(name="Taiwan")
-					except Country.DoesNotExist:
-						country_instance = Country(name = "Taiwan", iso3c = "TWN")
-						country_instance.save()
-
-		# **************************
-		# Load meets in 
-		# **************************
-
-		meets_df = scores[["meet_name", "start_date", "end_date", "meet_loc"]].drop_duplicates()
-		meets_df["start_date_fmt"] = pd.to_datetime(meets_df.start_date, format="%b %d %Y")
-		meets_df["end_date_fmt"] = pd.to_datetime(meets_df.end_date, format="%b %d %Y")
-		for meet in meets_df.itertuples():
-			try:
-				meet_test = Meet.objects.get(name=meet.meet_name)
-			except Meet.DoesNotExist:
-				if pd.isnull(meet.start_date_fmt)==False:
-					meet_instance = Meet(name = meet.meet_name, start_date=meet.start_date_fmt, end_date = meet.end_date_fmt)
-				else:
-					meet_instance = Meet(name = meet.meet_name)
-				meet_instance.save()
-				print(meet_instance)
-
-		# **************************
-		# Load gymnasts in 
-		# **************************
-
-		gymnasts_df = scores[["gymnast", "country"]].drop_duplicates()
-		gymnasts_df.country.replace("Chinese Taipei", "Taiwan", inplace=True)
-		for person in gymnasts_df.itertuples():
-			try:
-				gymnast_test = Gymnast.objects.get(name=person.gymnast)
-			except Gymnast.DoesNotExist:
-				gymnast_instance = Gymnast(name = person.gymnast, country = Country.objects.get(name=person.country))
-				gymnast_instance.save()
-		
-		# **************************
-		# Load scores in 
-		# **************************
-
-		for row in scores.itertuples():
-			score_test = Score.objects.filter(gymnast=Gymnast.objects.get(name=row.gymnast), meet=Meet.objects.get(name=row.meet_name), meet_day=row.meet_day)
-			if score_test.count() == 0:
-				# Vault 1
-				if pd.isnull(row.vt1)==False:
-					score_instance = Score(gymnast = Gymnast.objects.get(name=row.gymnast), 
-						meet = Meet.objects.get(name=row.meet_name),
-						meet_day = row.meet_day, event=Event.objects.get(name="VT", junior=row.junior2021), score=row.vt1, d_score=row.vt1_d, score_num=1)
-					score_instance.save()
-				# Bars
-				if pd.isnull(row.ub)==False:
-					score_instance = Score(gymnast = Gymnast.objects.get(name=row.gymnast), 
-						meet = Meet.objects.get(name=row.meet_name),
-						meet_day = row.meet_day, event=Event.objects.get(name="UB", junior=row.junior2021), score=row.ub, d_score=row.ub_d, score_num=1)
-					score_instance.save()
-				# Balance beam
-				if pd.isnull(row.bb)==False:
-					score_instance = Score(gymnast = Gymnast.objects.get(name=row.gymnast), 
-						meet = Meet.objects.get(name=row.meet_name),
-						meet_day = row.meet_day, event=Event.objects.get(name="BB", junior=row.junior2021), score=row.bb, d_score=row.bb_d, score_num=1)
-					score_instance.save()
-				# Floor
-				if pd.isnull(row.fx)==False:
-					score_instance = Score(gymnast = Gymnast.objects.get(name=row.gymnast), 
-						meet = Meet.objects.get(name=row.meet_name),
-						meet_day = row.meet_day, event=Event.objects.get(name="FX", junior=row.junior2021), score=row.fx, d_score=row.fx_d, score_num=1)
-					score_instance.save()
-				# Vault 2
-				if pd.isnull(row.vt2)==False:
-					score_instance = Score(gymnast = Gymnast.objects.get(name=row.gymnast), 
-						meet = Meet.objects.get(name=row.meet_name),
-						meet_day = row.meet_day, event=Event.objects.get(name="VT", junior=row.junior2021), score=row.vt2, d_score=row.vt2_d, score_num=2)
-					score_instance.save()
+		# Take out (and report) the rows that can't be loaded
+		# **************************
+		scores = shrink_frame(validate_scores(scores, "2021"))
+
+		# **************************
+		# Load countries, meets, gymnasts and scores in
+		# **************************
+
+		print("Loading {} rows ({:.1f} MB)".format(len(scores), frame_size(scores)))
+		with self.memory.stage("load"):
+			loader.load(scores, junior="junior2021", source="2021")
+		del scores
+
+		# **************************
+		# Update the precomputed stats with the new scores
+		# **************************
+
+		with self.memory.stage("stats"):
+			update_stats(loader.new_scores)
+			# Scores that were corrected or removed can't be folded in, so recompute those gymnasts' stats
+			rebuild_gymnast_stats(loader.changed_gymnasts)
+
+		print("Inserted {inserted} rows, updated {updated}, unchanged {unchanged}".format(**loader.counts))
 
 	def handle(self, *args, **options):
-		self._create_db()
+		sources = SourceFetcher(cache_dir=options['cache_dir'], offline=options['offline'])
+		self.incremental = options['incremental']
+		self.memory = MemoryReport(enabled=options['memory_report'])
+		# Bump the data generation once when the load is done, rather than once per row
+		with deferred_bump():
+			self._create_db(sources)
+			bump_generation()
+		self.memory.print_report()
+		# Make sure the search index matches the new data
+		rebuild_search_index()
+		# Recount the scores, gymnasts and meets for the home page
+		refresh_counters()
+		# Write the score snapshot for the analytics pages
+		write_snapshot()
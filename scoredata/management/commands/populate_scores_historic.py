@@ -1,5 +1,18 @@
+import django
+from concurrent.futures import ProcessPoolExecutor
 from django.core.management.base import BaseCommand
+from django.db import transaction
 from scoredata.models import Gymnast, Country, Meet, Event, Score
+from scoredata.generation import bump_generation, deferred_bump
+from scoredata.search import rebuild_search_index
+from scoredata.counters import refresh_counters
+from scoredata.snapshot import write_snapshot
+from scoredata.score_stats import update_stats, rebuild_gymnast_stats
+from scoredata.ingest import ScoreLoader
+from scoredata.fetch import SourceFetcher, FetchedSources
+from scoredata.meet_names import normalize_meet_names
+from scoredata.frames import read_csv_chunks, shrink_frame, MemoryReport, frame_size
+from scoredata.validation import validate_scores
 
 import pandas as pd
 import numpy as np
@@ -12,838 +25,613 @@ import datetime
 
 pd.options.mode.chained_assignment = None 
 
-class Command(BaseCommand):
-
-	help = 'This reads in the 2017, 2018, 2019 score data and loads it into the database.'
-
+# The source files that each season is cleaned from
+SEASON_SOURCES = {
+	"2017": [
+		"https://docs.google.com/spreadsheets/d/1fg3pFV1KGUCfUH7lHq_8UHdS0uH4O0yHHk4qtCV_QH4/export?gid=0&format=csv",
+		"https://docs.google.com/spreadsheets/d/1fg3pFV1KGUCfUH7lHq_8UHdS0uH4O0yHHk4qtCV_QH4/export?gid=1144828878&format=csv",
+		"https://thegymter.net/2017-gymnastics-calendar/",
+	],
+	"2018": [
+		"https://docs.google.com/spreadsheets/d/1HI0tOSgjIS8rFjbTwCTlhG1LxP6sttzDMN3-4u0B0u4/export?gid=0&format=csv",
+		"https://docs.google.com/spreadsheets/d/1HI0tOSgjIS8rFjbTwCTlhG1LxP6sttzDMN3-4u0B0u4/export?gid=1212101599&format=csv",
+		"https://thegymter.net/2018-gymnastics-calendar/",
+	],
+	"2019": ["https://docs.google.com/spreadsheets/d/1213cgQJaKzzpwoO46m5ihT7F6poyhAzimpsu7VEgTWA/export?gid=1358682386&format=csv"],
+	"2020": ["https://docs.google.com/spreadsheets/d/1mAZlBhTIPOSZND4Z90ZmHJgobSqU8jv5dGpl54DHWSw/export?format=csv"],
+}
+# Every source file that the command reads, so that they can all be downloaded at once
+HISTORIC_SOURCES = [url for urls in SEASON_SOURCES.values() for url in urls]
+
+# The columns of the one-sheet seasons that can be categories as soon as they're read (meet names get the year added).
+# Scores are read as they are, so that validate_scores can report any that aren't numbers.
+SHEET_CATEGORY_COLUMNS = ["country", "meet_day", "meet_loc", "start_date", "end_date"]
+
+
+# ****************************************************
+# ****************************************************
+# 2017 scores
+# ****************************************************
+# ****************************************************
+
+# The meet days that are part of the meet names in the 2017 sheets
+MEET_DAYS_2017 = ["QF", "TF", "AA", "EF"]
+
+
+def read_2017_meet_names(sources):
+	''' Returns the meet names in the 2017 totals sheet as clean_2017 has them just before the aliases are applied'''
+	totals = read_csv_chunks(sources, SEASON_SOURCES["2017"][0], columns=["gymnast", "country", "meet_name", "vt1", "ub", "bb", "fx", "aa", "vt_avg"], floats=[], categories=["country"])
+	names = totals.meet_name
+	for day in MEET_DAYS_2017:
+		names = names.str.replace(day, "")
+	return set(names.dropna().unique())
+
+
+def clean_2017(sources):
+	''' Reads the 2017 totals and D score sheets, cleans them and merges in the meet dates from the 2017 calendar'''
 
 	# **************************
-	# Load this data into the database
+	# Read in The Gymternet's score spreadsheet
 	# **************************
 
-
-	def _create_db(self):
-
-		# ****************************************************
-		# ****************************************************
-		# Create all event instances if they don't exist already
-		# ****************************************************
-		# ****************************************************
-
-		for event in ["VT", "UB", "BB", "FX"]:
-			for junior in [True, False]:
-				try:
-					event_test = Event.objects.get(name=event, junior=junior)
-				except Event.DoesNotExist:
-					event_instance = Event(name=event, junior=junior)
-					event_instance.save()
-
-		# ****************************************************
-		# ****************************************************
-		# 2017 scores
-		# ****************************************************
-		# ****************************************************
-
-		# **************************
-		# Read in The Gymternet's score spreadsheet
-		# **************************
-
-		# Totals
-		
-		totals = pd.read_csv("https://docs.google.com/spreadsheets/d/1fg3pFV1KGUCfUH7lHq_8UHdS0uH4O0yHHk4qtCV_QH4/export?gid=0&format=csv")
-		totals.head()
-		totals.columns = ["gymnast", "country", "meet_name", "vt1", "ub", "bb", "fx", "aa", "vt_avg"]
-		totals.vt_avg = pd.to_numeric(totals.vt_avg, errors='coerce')
-		# D scores
-		dscore = pd.read_csv("https://docs.google.com/spreadsheets/d/1fg3pFV1KGUCfUH7lHq_8UHdS0uH4O0yHHk4qtCV_QH4/export?gid=1144828878&format=csv")
-		dscore.head()
-		dscore.columns = ["gymnast", "country", "meet_name", "vt1_d", "ub_d", "bb_d", "fx_d", "vt_total_d"]
+	# Totals
+	
+	totals = read_csv_chunks(sources, "https://docs.google.com/spreadsheets/d/1fg3pFV1KGUCfUH7lHq_8UHdS0uH4O0yHHk4qtCV_QH4/export?gid=0&format=csv", columns=["gymnast", "country", "meet_name", "vt1", "ub", "bb", "fx", "aa", "vt_avg"], floats=[], categories=["country"])
+	# D scores
+	dscore = read_csv_chunks(sources, "https://docs.google.com/spreadsheets/d/1fg3pFV1KGUCfUH7lHq_8UHdS0uH4O0yHHk4qtCV_QH4/export?gid=1144828878&format=csv", columns=["gymnast", "country", "meet_name", "vt1_d", "ub_d", "bb_d", "fx_d", "vt_total_d"], floats=[], categories=["country"])
 
 
-		# **************************
-		# Clean the scores data
-		# **************************
+	# **************************
+	# Clean the scores data
+	# **************************
 
-		# Get Vault 2 scores from Vault 1 and Vault Average
-		totals["vt2"] = totals.vt_avg * 2 - totals.vt1
-
-		# Get Vault 2 d score from Vault 1 d score and total
-		dscore["vt2_d"] = dscore.vt_total_d - dscore.vt1_d
-
-		# Change some meet names for merging
-		dscore.meet_name.replace("Brestyan's Qualifier", "Brestyan's National Qualifier", inplace=True)
-
-		# Merge totals and d scores
-		scores = pd.merge(totals, dscore, how="outer", on=["gymnast", "meet_name"], indicator=True)
-		scores._merge.value_counts()
-		# Check cases that didn't merge - where we have d scores but no totals
-		print(scores.loc[scores._merge == "right_only", ["gymnast", "meet_name", "_merge"]])
-		print(scores.loc[scores._merge == "right_only", ].meet_name.value_counts())
-		# Delete these cases
-		scores = scores.loc[scores._merge != "right_only", scores.columns[:-1]]
-		# Drop country names from the D score sheet
-		scores["country_x"] = np.where(scores.country_x=="", scores.country_y, scores.country_x)
-		scores.drop(["country_y"], axis=1)
-		scores=scores.rename(columns = {'country_x':'country'})
-		# Drop vault averages and totals
-		scores.drop(["vt_total_d", "vt_avg"], axis=1)
-
-		# Clean historic data
-		scores["gymnast"] = scores.gymnast.str.replace("De Jesus dos Santos", "de Jesus dos Santos")
-		scores["gymnast"] = scores.gymnast.str.replace("De Jesus Dos Santos", "de Jesus dos Santos")
-		scores["gymnast"] = scores.gymnast.str.replace("Laurie Denommee", "Laurie Dénommée")
+	# Get Vault 2 scores from Vault 1 and Vault Average
+	# (validate_scores checks that the two vaults match the average)
+	totals["vt2"] = pd.to_numeric(totals.vt_avg, errors='coerce') * 2 - pd.to_numeric(totals.vt1, errors='coerce')
+
+	# Get Vault 2 d score from Vault 1 d score and total
+	dscore["vt2_d"] = pd.to_numeric(dscore.vt_total_d, errors='coerce') - pd.to_numeric(dscore.vt1_d, errors='coerce')
+
+	# Change some meet names for merging
+	dscore["meet_name"] = dscore.meet_name.replace("Brestyan's Qualifier", "Brestyan's National Qualifier")
+
+	# Merge totals and d scores
+	scores = pd.merge(totals, dscore, how="outer", on=["gymnast", "meet_name"], indicator=True)
+	del totals, dscore
+	scores._merge.value_counts()
+	# Check cases that didn't merge - where we have d scores but no totals
+	print(scores.loc[scores._merge == "right_only", ["gymnast", "meet_name", "_merge"]])
+	print(scores.loc[scores._merge == "right_only", ].meet_name.value_counts())
+	# Delete these cases
+	scores = scores.loc[scores._merge != "right_only", scores.columns[:-1]]
+	# Drop country names from the D score sheet
+	scores["country_x"] = np.where(scores.country_x=="", scores.country_y, scores.country_x)
+	scores = scores.drop(["country_y"], axis=1)
+	scores=scores.rename(columns = {'country_x':'country'})
+	# Drop the vault D score totals and all around scores (the vault averages are dropped once they've been checked)
+	scores = scores.drop(["vt_total_d", "aa"], axis=1)
+
+	# Clean historic data
+	scores["gymnast"] = scores.gymnast.str.replace("De Jesus dos Santos", "de Jesus dos Santos")
+	scores["gymnast"] = scores.gymnast.str.replace("De Jesus Dos Santos", "de Jesus dos Santos")
+	scores["gymnast"] = scores.gymnast.str.replace("Laurie Denommee", "Laurie Dénommée")
 
-		# **************************
-		# Clean the meet type
-		# **************************
-		scores["meet_day"] = ""
-		day_types = ["QF", "TF", "AA", "EF"]
-		for day in day_types:
-			scores["meet_day"] = np.where(scores.meet_name.str.contains(day), day, scores.meet_day)
-		scores.meet_day.value_counts()
-		# Clean meet names to remove the type
-		for day in day_types:
-			scores["meet_name"] = scores.meet_name.str.replace(day, "")
-
-		scores["meet_name"] = scores.meet_name.str.replace("Champs", "Championships")
-		scores["meet_name"] = scores.meet_name.str.replace("FIT", "Flanders International Team")
-		scores["meet_name"] = scores.meet_name.str.replace("Euros", "European Championships")
-		scores["meet_name"] = scores.meet_name.str.replace("Euro Youth Olympic Festival", "European Youth Olympic Festival")
-		scores["meet_name"] = scores.meet_name.str.replace("Gymnix", "International Gymnix")
-		scores["meet_name"] = scores.meet_name.str.replace("Universiade", "Summer Universiade")
-		scores["meet_name"] = scores.meet_name.str.replace("Jesolo", "City of Jesolo Trophy")
-		scores["meet_name"] = scores.meet_name.str.replace("Top Gym", "Top Gym Tournament")
-		scores["meet_name"] = scores.meet_name.str.replace("DTB Pokal", "DTB Pokal Team Challenge")
-		scores["meet_name"] = scores.meet_name.str.replace("Gymnova", "Gymnova Cup")
-		scores["meet_name"] = scores.meet_name.str.replace("Unni & Haralds", "Unni & Haralds Trophy")
-		scores["meet_name"] = scores.meet_name.str.replace("Hungarian Masters", "Hungarian Master Championships")
-		scores["meet_name"] = scores.meet_name.str.replace("Austrian Open", "Austrian Team Open")
-		scores["meet_name"] = scores.meet_name.str.replace("2nd Norwegian FIG", "2nd Norwegian FIG Meet")
-		scores["meet_name"] = scores.meet_name.str.replace("Brestyan's National Qualifier", "Brestyan’s National Qualifier")
-		scores["meet_name"] = scores.meet_name.str.replace("Mediterranean", "Mediterranean Junior Championships")
-		scores["meet_name"] = scores.meet_name.str.replace("Stella Zakharova", "Stella Zakharova Cup")
-		scores["meet_name"] = scores.meet_name.str.replace("Pan Am Championships", "Pan American Championships")
-		scores["meet_name"] = scores.meet_name.str.replace("Reykjavik International", "Reykjavik International Games")
-		scores["meet_name"] = scores.meet_name.str.replace("Dutch Invitational", "Dutch Women’s Invitational")
-		scores["meet_name"] = scores.meet_name.str.replace("Junior Japan", "Junior Japan International")
-		for city in ["Melbourne", "Baku", "Cottbus",  "Doha"]:
-			scores["meet_name"] = scores.meet_name.str.replace(city, city + " World Cup")
-		for city in ["Paris", "Osijek", "Koper", "Szombathely", "Varna"]:
-			scores["meet_name"] = scores.meet_name.str.replace(city, city + " Challenge Cup")
-		for meet in ["South American Junior", "France Top 12"]:
-			scores["meet_name"] = scores.meet_name.str.replace(meet, meet + " Championships")
-		# **************************
-		# Mark juniors
-		# **************************
-		scores["junior2017"] = False
-		scores["junior2017"] = np.where(scores.gymnast.str.contains("\*"), True, scores.junior2017)
-		scores["gymnast"] = scores.gymnast.str.replace("\*", "")
+	# **************************
+	# Clean the meet type
+	# **************************
+	scores["meet_day"] = ""
+	for day in MEET_DAYS_2017:
+		scores["meet_day"] = np.where(scores.meet_name.str.contains(day), day, scores.meet_day)
+	scores.meet_day.value_counts()
+	# Clean meet names to remove the type
+	for day in MEET_DAYS_2017:
+		scores["meet_name"] = scores.meet_name.str.replace(day, "")
+
+	# Expand short meet names (e.g. "Euros"), with the 2017 aliases in data/meet_aliases.json
+	scores["meet_name"] = normalize_meet_names(scores.meet_name, "2017")
+	# **************************
+	# Mark juniors
+	# **************************
+	scores["junior2017"] = False
+	scores["junior2017"] = np.where(scores.gymnast.str.contains("\*"), True, scores.junior2017)
+	scores["gymnast"] = scores.gymnast.str.replace("\*", "")
 
-		# **************************
-		# Get meet start and end dates
-		# **************************
+	# **************************
+	# Get meet start and end dates
+	# **************************
 
-		# Download the HTML from TheGymternet's list of meets
-		response = get("https://thegymter.net/2017-gymnastics-calendar/")
-		soup = BeautifulSoup(response.text, 'html.parser')
-		meets = soup.find("table").findAll("tr")
+	# Download the HTML from TheGymternet's list of meets
+	soup = BeautifulSoup(sources.get_text("https://thegymter.net/2017-gymnastics-calendar/"), 'html.parser')
+	meets = soup.find("table").findAll("tr")
 
-		# Set up arrays to store the meet data
-		start_date=[]
-		end_date=[]
-		meet_name=[]
-		meet_loc=[]
+	# Set up arrays to store the meet data
+	start_date=[]
+	end_date=[]
+	meet_name=[]
+	meet_loc=[]
 
-		# Definte a regular expression to get alphabetic characters from a string - we will use this to spearate months from days
-		regex = re.compile('[^a-zA-Z]')
+	# Definte a regular expression to get alphabetic characters from a string - we will use this to spearate months from days
+	regex = re.compile('[^a-zA-Z]')
 
-		# Loop through the meets (skipping the first row which has headings)
-		for meet in meets[1:]:
+	# Loop through the meets (skipping the first row which has headings)
+	for meet in meets[1:]:
+		
+		# Clean start and end date 
+		date = meet.findAll("td")[0].text
+		date = date.split("-")
+		start_date.append(date[0] + " 2017")
+		# Cases where the meet is only one day
+		if len(date) == 1:
+			end_date.append(date[0] + " 2017")
+		# Cases where the meet is many days, but the dates are in the same month
+		elif regex.sub('', date[1]) == "":
+			month = regex.sub('', date[0])
+			end_date.append(month + " " + date[1] + " 2017")
+		# Cases where the meet is many days, but they dates are in different months
+		else:
+			end_date.append(date[1] + " 2017")
+		# Clean month formats
+
+
+		# Pull meet name
+		meet_name.append(meet.findAll("td")[1].find("a").contents[0])
+
+		# Pull meet location
+		meet_loc_try = meet.findAll("td")[1].text.split(",", maxsplit=1)
+		if len(meet_loc_try) > 1:
+			meet_loc.append(meet_loc_try[1])
+		else:
+			meet_loc.append("")
 			
-			# Clean start and end date 
-			date = meet.findAll("td")[0].text
-			date = date.split("-")
-			start_date.append(date[0] + " 2017")
-			# Cases where the meet is only one day
-			if len(date) == 1:
-				end_date.append(date[0] + " 2017")
-			# Cases where the meet is many days, but the dates are in the same month
-			elif regex.sub('', date[1]) == "":
-				month = regex.sub('', date[0])
-				end_date.append(month + " " + date[1] + " 2017")
-			# Cases where the meet is many days, but they dates are in different months
-			else:
-				end_date.append(date[1] + " 2017")
-			# Clean month formats
-
-
-			# Pull meet name
-			meet_name.append(meet.findAll("td")[1].find("a").contents[0])
-
-			# Pull meet location
-			meet_loc_try = meet.findAll("td")[1].text.split(",", maxsplit=1)
-			if len(meet_loc_try) > 1:
-				meet_loc.append(meet_loc_try[1])
-			else:
-				meet_loc.append("")
-				
-		# Combine results in data frame
-		meets = pd.DataFrame({
-				'meet_name': meet_name,
-				'start_date': start_date, 
-				'end_date': end_date,
-				'meet_loc': meet_loc})
-
-		# Clean some dates
-		meets.start_date = meets.start_date.str.replace("June", "Jun")
-		meets.start_date = meets.start_date.str.replace("July", "Jul")
-		meets.end_date = meets.end_date.str.replace("July", "Jul")
-		meets.end_date = meets.end_date.str.replace("June", "Jun")
-
-		# Merge in the meets
-		scores["meet_name"] = scores.meet_name.str.strip()
-		meets["meet_name"] = meets.meet_name.str.strip()
-		scores = pd.merge(scores, meets, how="outer", on=["meet_name"], indicator=True)
-		print(scores._merge.value_counts())
-		# Check cases that didn't merge - not that many. Fine for now.
-		scores = scores.loc[scores._merge != "right_only", scores.columns[:-1]]
-
-		scores['meet_name'] = scores['meet_name'].astype(str) + " (2017)"
-
-		# **************************
-		# Load countries in
-		# **************************
-
-		# Clean some countries with typoes
-		scores.country.replace("Chia", "China", inplace=True)
-
-		# Load countries in
-		countries_df = scores.country.drop_duplicates()
-		for country in countries_df:
-			try:
-				country_test = Country.objects.get(name=country)
-			except Country.DoesNotExist:
-				if country != "Chinese Taipei" and country != "Taiwan":
-					country_instance = Country(name = country, iso3c = countrynames.to_code_3(country))
-					country_instance.save()
-				else:
-					try:
-						country_test = Country.objects.get(name="Taiwan")
-					except Country.DoesNotExist:
-						country_instance = Country(name = "Taiwan", iso3c = "TWN")
-						country_instance.save()
+	# Combine results in data frame
+	meets = pd.DataFrame({
+			'meet_name': meet_name,
+			'start_date': start_date, 
+			'end_date': end_date,
+			'meet_loc': meet_loc})
+
+	# Clean some dates
+	meets.start_date = meets.start_date.str.replace("June", "Jun")
+	meets.start_date = meets.start_date.str.replace("July", "Jul")
+	meets.end_date = meets.end_date.str.replace("July", "Jul")
+	meets.end_date = meets.end_date.str.replace("June", "Jun")
+
+	# Merge in the meets
+	scores["meet_name"] = scores.meet_name.str.strip()
+	meets["meet_name"] = meets.meet_name.str.strip()
+	scores = pd.merge(scores, meets, how="outer", on=["meet_name"], indicator=True)
+	del meets, soup
+	print(scores._merge.value_counts())
+	# Check cases that didn't merge - not that many. Fine for now.
+	scores = scores.loc[scores._merge != "right_only", scores.columns[:-1]]
+
+	scores['meet_name'] = scores['meet_name'].astype(str) + " (2017)"
+
+	# Take out (and report) the rows that can't be loaded
+	scores = validate_scores(scores, "2017")
+	scores = scores.drop(["vt_avg"], axis=1)
+
+	return shrink_frame(scores)
+
+
+def fix_dates_2017():
+	''' Adds dates for some meets without dates'''
+	for meet_name in ["Elite Gym Massilia Masters (2017)", "Elite Gym Massilia Open (2017)", "Elite Gym Massila Espoir (2017)"]:
+		meet = Meet.objects.get(name = meet_name)
+		meet.start_date = datetime.date(2017, 11, 17)
+		meet.end_date = datetime.date(2017, 11, 19)
+		meet.save()
+	meet = Meet.objects.get(name = "Czech European Championships Test (2017)")
+	meet.start_date = datetime.date(2017, 3, 18)
+	meet.save()
+	meet = Meet.objects.get(name = "Brazilian Selection (2017)")
+	meet.start_date = datetime.date(2017, 7, 22)
+	meet.end_date = datetime.date(2017, 7, 24)
+	meet.save()
+	meet = Meet.objects.get(name = "Stuttgart World Cup (2017)")
+	meet.start_date = datetime.date(2017, 3, 18)
+	meet.end_date = datetime.date(2017, 3, 19)
+	meet.save()
+	meet = Meet.objects.get(name = "France Top 12 Championships (2017)")
+	meet.start_date = datetime.date(2017, 3, 11)
+	meet.end_date = datetime.date(2017, 3, 12)
+	meet.save()
+	meet = Meet.objects.get(name = "German Junior Friendly (2017)")
+	meet.start_date = datetime.date(2017, 7, 8)
+	meet.save()
+
+
+# ****************************************************
+# ****************************************************
+# 2018 scores
+# ****************************************************
+# ****************************************************
+
+def clean_2018(sources):
+	''' Reads the 2018 totals and D score sheets, cleans them and merges in the meet dates from the 2018 calendar'''
 
-		# **************************
-		# Load meets in 
-		# **************************
+	# **************************
+	# Read in The Gymternet's score spreadsheet
+	# **************************
 
-		meets_df = scores[["meet_name", "start_date", "end_date", "meet_loc"]].drop_duplicates()
-		meets_df["start_date_fmt"] = pd.to_datetime(meets_df.start_date, format="%b %d %Y")
-		meets_df["end_date_fmt"] = pd.to_datetime(meets_df.end_date, format="%b %d %Y")
-		for meet in meets_df.itertuples():
-			try:
-				meet_test = Meet.objects.get(name=meet.meet_name)
-			except Meet.DoesNotExist:
-				if pd.isnull(meet.start_date_fmt)==False:
-					meet_instance = Meet(name = meet.meet_name, start_date=meet.start_date_fmt, end_date = meet.end_date_fmt)
-				else:
-					meet_instance = Meet(name = meet.meet_name)
-				meet_instance.save()
-				print(meet_instance)
+	# Totals
+	totals = read_csv_chunks(sources, "https://docs.google.com/spreadsheets/d/1HI0tOSgjIS8rFjbTwCTlhG1LxP6sttzDMN3-4u0B0u4/export?gid=0&format=csv", columns=["gymnast", "country", "meet_name", "vt1", "ub", "bb", "fx", "aa", "vt_avg"], floats=[], categories=["country"])
 
-		# **************************
-		# Load gymnasts in 
-		# **************************
+	# D scores
+	dscore = read_csv_chunks(sources, "https://docs.google.com/spreadsheets/d/1HI0tOSgjIS8rFjbTwCTlhG1LxP6sttzDMN3-4u0B0u4/export?gid=1212101599&format=csv", columns=["gymnast", "country", "meet_name", "vt1_d", "ub_d", "bb_d", "fx_d", "vt_total_d"], floats=[], categories=["country"])
+	#dscore.drop(dscore.columns[len(dscore.columns)-1], axis=1, inplace=True)
 
-		gymnasts_df = scores[["gymnast", "country"]].drop_duplicates()
-		gymnasts_df.country.replace("Chinese Taipei", "Taiwan", inplace=True)
-		for person in gymnasts_df.itertuples():
-			try:
-				gymnast_test = Gymnast.objects.get(name=person.gymnast)
-			except Gymnast.DoesNotExist:
-				gymnast_instance = Gymnast(name = person.gymnast, country = Country.objects.get(name=person.country))
-				gymnast_instance.save()
-		
-		# **************************
-		# Load scores in 
-		# **************************
 
-		for row in scores.itertuples():
-			score_test = Score.objects.filter(gymnast=Gymnast.objects.get(name=row.gymnast), meet=Meet.objects.get(name=row.meet_name), meet_day=row.meet_day)
-			if score_test.count() == 0:
-				# Vault 1
-				if pd.isnull(row.vt1)==False:
-					score_instance = Score(gymnast = Gymnast.objects.get(name=row.gymnast), 
-						meet = Meet.objects.get(name=row.meet_name),
-						meet_day = row.meet_day, event=Event.objects.get(name="VT", junior=row.junior2017), score=row.vt1, d_score=row.vt1_d, score_num=1)
-					score_instance.save()
-				# Bars
-				if pd.isnull(row.ub)==False:
-					score_instance = Score(gymnast = Gymnast.objects.get(name=row.gymnast), 
-						meet = Meet.objects.get(name=row.meet_name),
-						meet_day = row.meet_day, event=Event.objects.get(name="UB", junior=row.junior2017), score=row.ub, d_score=row.ub_d, score_num=1)
-					score_instance.save()
-				# Balance beam
-				if pd.isnull(row.bb)==False:
-					score_instance = Score(gymnast = Gymnast.objects.get(name=row.gymnast), 
-						meet = Meet.objects.get(name=row.meet_name),
-						meet_day = row.meet_day, event=Event.objects.get(name="BB", junior=row.junior2017), score=row.bb, d_score=row.bb_d, score_num=1)
-					score_instance.save()
-				# Floor
-				if pd.isnull(row.fx)==False:
-					score_instance = Score(gymnast = Gymnast.objects.get(name=row.gymnast), 
-						meet = Meet.objects.get(name=row.meet_name),
-						meet_day = row.meet_day, event=Event.objects.get(name="FX", junior=row.junior2017), score=row.fx, d_score=row.fx_d, score_num=1)
-					score_instance.save()
-				# Vault 2
-				if pd.isnull(row.vt2)==False:
-					score_instance = Score(gymnast = Gymnast.objects.get(name=row.gymnast), 
-						meet = Meet.objects.get(name=row.meet_name),
-						meet_day = row.meet_day, event=Event.objects.get(name="VT", junior=row.junior2017), score=row.vt2, d_score=row.vt2_d, score_num=2)
-					score_instance.save()
+	# **************************
+	# Clean the scores data
+	# **************************
 
-		# **************************
-		# Add dates for some meets without dates
-		# **************************
-		for meet_name in ["Elite Gym Massilia Masters (2017)", "Elite Gym Massilia Open (2017)", "Elite Gym Massila Espoir (2017)"]:
-			meet = Meet.objects.get(name = meet_name)
-			meet.start_date = datetime.date(2017, 11, 17)
-			meet.end_date = datetime.date(2017, 11, 19)
-			meet.save()
-		meet = Meet.objects.get(name = "Czech European Championships Test (2017)")
-		meet.start_date = datetime.date(2017, 3, 18)
-		meet.save()
-		meet = Meet.objects.get(name = "Brazilian Selection (2017)")
-		meet.start_date = datetime.date(2017, 7, 22)
-		meet.end_date = datetime.date(2017, 7, 24)
-		meet.save()
-		meet = Meet.objects.get(name = "Stuttgart World Cup (2017)")
-		meet.start_date = datetime.date(2017, 3, 18)
-		meet.end_date = datetime.date(2017, 3, 19)
-		meet.save()
-		meet = Meet.objects.get(name = "France Top 12 Championships (2017)")
-		meet.start_date = datetime.date(2017, 3, 11)
-		meet.end_date = datetime.date(2017, 3, 12)
-		meet.save()
-		meet = Meet.objects.get(name = "German Junior Friendly (2017)")
-		meet.start_date = datetime.date(2017, 7, 8)
-		meet.save()
+	# Get Vault 2 scores from Vault 1 and Vault Average
+	# (validate_scores checks that the two vaults match the average)
+	totals["vt2"] = pd.to_numeric(totals.vt_avg, errors='coerce') * 2 - pd.to_numeric(totals.vt1, errors='coerce')
+
+	# Get Vault 2 d score from Vault 1 d score and total
+	dscore["vt2_d"] = pd.to_numeric(dscore.vt_total_d, errors='coerce') - pd.to_numeric(dscore.vt1_d, errors='coerce')
+
+	# Merge totals and d scores
+	scores = pd.merge(totals, dscore, how="outer", on=["gymnast", "meet_name"], indicator=True)
+	del totals, dscore
+	scores._merge.value_counts()
+	# Check cases that didn't merge - where we have d scores but no totals
+	scores.loc[scores._merge == "right_only", ["gymnast", "meet_name", "_merge"]]
+	scores.loc[scores._merge == "right_only", ].meet_name.value_counts()
+	# Delete these cases
+	scores = scores.loc[scores._merge != "right_only", scores.columns[:-1]]
+	# Drop country names from the D score sheet
+	scores["country_x"] = np.where(scores.country_x=="", scores.country_y, scores.country_x)
+	scores = scores.drop(["country_y"], axis=1)
+	scores=scores.rename(columns = {'country_x':'country'})
+	# Drop the vault D score totals and all around scores (the vault averages are dropped once they've been checked)
+	scores = scores.drop(["vt_total_d", "aa"], axis=1)
+
+	# Clean some typos
+	# One UB D score is typed ".4.3" (4.3). Only that exact cell is fixed; anything else that isn't a number is
+	# quarantined by validate_scores.
+	scores["ub_d"] = scores.ub_d.replace(".4.3", "4.3")
+	scores["gymnast"] = scores.gymnast.str.replace("De Jesus dos Santos", "de Jesus dos Santos")
+	scores["gymnast"] = scores.gymnast.str.replace("De Jesus Dos Santos", "de Jesus dos Santos")
+	scores["gymnast"] = scores.gymnast.str.replace("Laurie Denommee", "Laurie Dénommée")
 
-		# ****************************************************
-		# ****************************************************
-		# 2018 scores
-		# ****************************************************
-		# ****************************************************
+	# **************************
+	# Clean the meet type
+	# **************************
+	scores["meet_day"] = ""
+	day_types = ["QF", "TF", "AA", "EF"]
+	for day in day_types:
+		scores["meet_day"] = np.where(scores.meet_name.str.contains(day), day, scores.meet_day)
+	scores.meet_day.value_counts()
+	# Clean meet names to remove the type
+	for day in day_types:
+		scores["meet_name"] = scores.meet_name.str.replace(day, "")
 
-		# **************************
-		# Read in The Gymternet's score spreadsheet
-		# **************************
+	# **************************
+	# Mark juniors
+	# **************************
+	scores["junior2018"] = False
+	scores["junior2018"] = np.where(scores.gymnast.str.contains("\*"), True, scores.junior2018)
+	scores["gymnast"] = scores.gymnast.str.replace("\*", "")
 
-		# Totals
-		totals = pd.read_csv("https://docs.google.com/spreadsheets/d/1HI0tOSgjIS8rFjbTwCTlhG1LxP6sttzDMN3-4u0B0u4/export?gid=0&format=csv")
-		totals.head()
-		totals.columns = ["gymnast", "country", "meet_name", "vt1", "ub", "bb", "fx", "aa", "vt_avg"]
+	# **************************
+	# Get meet start and end dates
+	# **************************
 
-		# D scores
-		dscore = pd.read_csv("https://docs.google.com/spreadsheets/d/1HI0tOSgjIS8rFjbTwCTlhG1LxP6sttzDMN3-4u0B0u4/export?gid=1212101599&format=csv")
-		dscore.head()
-		#dscore.drop(dscore.columns[len(dscore.columns)-1], axis=1, inplace=True)
-		dscore.columns = ["gymnast", "country", "meet_name", "vt1_d", "ub_d", "bb_d", "fx_d", "vt_total_d"]
+	# Download the HTML from TheGymternet's list of meets
+	soup = BeautifulSoup(sources.get_text("https://thegymter.net/2018-gymnastics-calendar/"), 'html.parser')
+	meets = soup.find("table").findAll("tr")
 
+	# Set up arrays to store the meet data
+	start_date=[]
+	end_date=[]
+	meet_name=[]
+	meet_loc=[]
 
-		# **************************
-		# Clean the scores data
-		# **************************
+	# Definte a regular expression to get alphabetic characters from a string - we will use this to spearate months from days
+	regex = re.compile('[^a-zA-Z]')
 
-		# Get Vault 2 scores from Vault 1 and Vault Average
-		totals["vt2"] = totals.vt_avg * 2 - totals.vt1
-
-		# Get Vault 2 d score from Vault 1 d score and total
-		dscore["vt2_d"] = dscore.vt_total_d - dscore.vt1_d
-
-		# Merge totals and d scores
-		scores = pd.merge(totals, dscore, how="outer", on=["gymnast", "meet_name"], indicator=True)
-		scores._merge.value_counts()
-		# Check cases that didn't merge - where we have d scores but no totals
-		scores.loc[scores._merge == "right_only", ["gymnast", "meet_name", "_merge"]]
-		scores.loc[scores._merge == "right_only", ].meet_name.value_counts()
-		# Delete these cases
-		scores = scores.loc[scores._merge != "right_only", scores.columns[:-1]]
-		# Drop country names from the D score sheet
-		scores["country_x"] = np.where(scores.country_x=="", scores.country_y, scores.country_x)
-		scores.drop(["country_y"], axis=1)
-		scores=scores.rename(columns = {'country_x':'country'})
-		# Drop vault averages and totals
-		scores.drop(["vt_total_d", "vt_avg"], axis=1)
-
-		# Clean some typos
-		try:
-			scores["ub_d"] = scores.ub_d.str.replace(".4.3", "4.3")
-		except:
-			print("I guess the score typo was fixed...")
-		scores["gymnast"] = scores.gymnast.str.replace("De Jesus dos Santos", "de Jesus dos Santos")
-		scores["gymnast"] = scores.gymnast.str.replace("De Jesus Dos Santos", "de Jesus dos Santos")
-		scores["gymnast"] = scores.gymnast.str.replace("Laurie Denommee", "Laurie Dénommée")
+	# Loop through the meets (skipping the first row which has headings)
+	for meet in meets:
+		
+		# Clean start and end date 
+		date = meet.findAll("td")[0].text
+		date = date.split("-")
+		start_date.append(date[0] + " 2018")
+		# Cases where the meet is only one day
+		if len(date) == 1:
+			end_date.append(date[0] + " 2018")
+		# Cases where the meet is many days, but the dates are in the same month
+		elif regex.sub('', date[1]) == "":
+			month = regex.sub('', date[0])
+			end_date.append(month + " " + date[1] + " 2018")
+		# Cases where the meet is many days, but they dates are in different months
+		else:
+			end_date.append(date[1] + " 2018")
+			
+		# Pull meet name
+		meet_name.append(meet.findAll("td")[1].text)
+		
+		# Pull meet location
+		meet_loc.append(meet.findAll("td")[2].text)
+			
+	# Combine results in data frame
+	meets = pd.DataFrame({
+			'meet_name': meet_name,
+			'start_date': start_date, 
+			'end_date': end_date,
+			'meet_loc': meet_loc})
+
+	# Drop MAG meets
+	meets = meets.loc[~meets.meet_name.str.contains("MAG"), :]
+
+	# Merge in the meets
+	scores["meet_name"] = scores.meet_name.str.strip()
+	meets["meet_name"] = meets.meet_name.str.strip()
+	scores = pd.merge(scores, meets, how="outer", on=["meet_name"], indicator=True)
+	del meets, soup
+	scores._merge.value_counts()
+	# Check cases that didn't merge - not that many. Fine for now.
+	scores = scores.loc[scores._merge != "right_only", scores.columns[:-1]]
+
+	# Add the year to the meet name (because some meets occur every year)
+	scores['meet_name'] = scores['meet_name'].astype(str) + " (2018)"
+
+	# Take out (and report) the rows that can't be loaded
+	scores = validate_scores(scores, "2018")
+	scores = scores.drop(["vt_avg"], axis=1)
+
+	return shrink_frame(scores)
+
+
+def fix_dates_2018():
+	''' Adds dates for some meets without dates'''
+	meet = Meet.objects.get(name = "U.S. Verification (April) (2018)")
+	meet.start_date = datetime.date(2018, 4, 8)
+	meet.end_date = datetime.date(2018, 4, 8)		
+	meet.save()
+	meet = Meet.objects.get(name = "Top 12 Final (2018)")
+	meet.start_date = datetime.date(2018, 3, 17)
+	meet.end_date = datetime.date(2018, 3, 17)
+	meet.save()
+	meet = Meet.objects.get(name = "Brestyan's National Qualifier (2018)")
+	meet.start_date = datetime.date(2018, 6, 23)
+	meet.end_date = datetime.date(2018, 6, 24)
+	meet.save()
+	meet = Meet.objects.get(name = "Desert Lights Qualifier (2018)")
+	meet.start_date = datetime.date(2018, 1, 27)
+	meet.end_date = datetime.date(2018, 1, 28)
+	meet.save()
+	meet = Meet.objects.get(name = "Orlando Qualifier (2018)")
+	meet.start_date = datetime.date(2018, 2, 9)
+	meet.end_date = datetime.date(2018, 2, 11)
+	meet.save()
+	meet = Meet.objects.get(name = "President's Cup (2018)")
+	meet.start_date = datetime.date(2018, 2, 12)
+	meet.end_date = datetime.date(2018, 2, 16)
+	meet.save()
+	meet = Meet.objects.get(name = "Klaverblad Championships (2018)")
+	meet.start_date = datetime.date(2018, 6, 9)
+	meet.end_date = datetime.date(2018, 6, 10)
+	meet.save()
+	meet = Meet.objects.get(name = "Buckeye Qualifier (2018)")
+	meet.start_date = datetime.date(2018, 2, 1)
+	meet.end_date = datetime.date(2018, 2, 2)
+	meet.save()
+	meet = Meet.objects.get(name = "Swiss Duel (2018)")
+	meet.start_date = datetime.date(2018, 9, 23)
+	meet.end_date = datetime.date(2018, 9, 23)
+	meet.save()
+	meet = Meet.objects.get(name = "German Worlds Trial (2018)")
+	meet.start_date = datetime.date(2018, 9, 15)
+	meet.end_date = datetime.date(2018, 9, 15)
+	meet.save()
+
+
+# ****************************************************
+# ****************************************************
+# 2019 scores
+# ****************************************************
+# ****************************************************
+
+def clean_2019(sources):
+	''' Reads and cleans the 2019 score sheet, which already has the meet dates'''
 
-		# **************************
-		# Clean the meet type
-		# **************************
-		scores["meet_day"] = ""
-		day_types = ["QF", "TF", "AA", "EF"]
-		for day in day_types:
-			scores["meet_day"] = np.where(scores.meet_name.str.contains(day), day, scores.meet_day)
-		scores.meet_day.value_counts()
-		# Clean meet names to remove the type
-		for day in day_types:
-			scores["meet_name"] = scores.meet_name.str.replace(day, "")
+	# **************************
+	# Read in The Gymternet's score spreadsheet
+	# **************************
 
-		# **************************
-		# Mark juniors
-		# **************************
-		scores["junior2018"] = False
-		scores["junior2018"] = np.where(scores.gymnast.str.contains("\*"), True, scores.junior2018)
-		scores["gymnast"] = scores.gymnast.str.replace("\*", "")
+	# Totals
+	scores = read_csv_chunks(sources, "https://docs.google.com/spreadsheets/d/1213cgQJaKzzpwoO46m5ihT7F6poyhAzimpsu7VEgTWA/export?gid=1358682386&format=csv", columns=["gymnast", "country", "meet_name", "meet_day", "vt1", "vt2", "ub", "bb", "fx", "vt1_d", "vt2_d", "ub_d", "bb_d", "fx_d", "meet_loc", "start_date", "end_date", "junior2019"], floats=[], categories=SHEET_CATEGORY_COLUMNS)
 
-		# **************************
-		# Get meet start and end dates
-		# **************************
+	# **************************
+	# Clean the scores data
+	# **************************
 
-		# Download the HTML from TheGymternet's list of meets
-		response = get("https://thegymter.net/2018-gymnastics-calendar/")
-		soup = BeautifulSoup(response.text, 'html.parser')
-		meets = soup.find("table").findAll("tr")
+	# **************************
+	# Clean the meet type
+	# **************************
 
-		# Set up arrays to store the meet data
-		start_date=[]
-		end_date=[]
-		meet_name=[]
-		meet_loc=[]
+	# **************************
+	# Mark juniors
+	# **************************
+	scores["junior2019"] = (scores["junior2019"] == True)
 
-		# Definte a regular expression to get alphabetic characters from a string - we will use this to spearate months from days
-		regex = re.compile('[^a-zA-Z]')
+	# **************************
+	# Get meet start and end dates
+	# **************************
 
-		# Loop through the meets (skipping the first row which has headings)
-		for meet in meets:
-			
-			# Clean start and end date 
-			date = meet.findAll("td")[0].text
-			date = date.split("-")
-			start_date.append(date[0] + " 2018")
-			# Cases where the meet is only one day
-			if len(date) == 1:
-				end_date.append(date[0] + " 2018")
-			# Cases where the meet is many days, but the dates are in the same month
-			elif regex.sub('', date[1]) == "":
-				month = regex.sub('', date[0])
-				end_date.append(month + " " + date[1] + " 2018")
-			# Cases where the meet is many days, but they dates are in different months
-			else:
-				end_date.append(date[1] + " 2018")
-				
-			# Pull meet name
-			meet_name.append(meet.findAll("td")[1].text)
-			
-			# Pull meet location
-			meet_loc.append(meet.findAll("td")[2].text)
-				
-		# Combine results in data frame
-		meets = pd.DataFrame({
-				'meet_name': meet_name,
-				'start_date': start_date, 
-				'end_date': end_date,
-				'meet_loc': meet_loc})
-
-		# Drop MAG meets
-		meets = meets.loc[~meets.meet_name.str.contains("MAG"), :]
-
-		# Merge in the meets
-		scores["meet_name"] = scores.meet_name.str.strip()
-		meets["meet_name"] = meets.meet_name.str.strip()
-		scores = pd.merge(scores, meets, how="outer", on=["meet_name"], indicator=True)
-		scores._merge.value_counts()
-		# Check cases that didn't merge - not that many. Fine for now.
-		scores = scores.loc[scores._merge != "right_only", scores.columns[:-1]]
-
-		# Add the year to the meet name (because some meets occur every year)
-		scores['meet_name'] = scores['meet_name'].astype(str) + " (2018)"
-		# **************************
-		# Load countries in
-		# **************************
+	# Add the year to the meet name (because some meets occur every year)
+	scores['meet_name'] = scores['meet_name'].astype(str) + " (2019)"
 
-		countries_df = scores.country.drop_duplicates()
-		for country in countries_df:
-			try:
-				country_test = Country.objects.get(name=country)
-			except Country.DoesNotExist:
-				if country != "Chinese Taipei" and country != "Taiwan":
-					country_instance = Country(name = country, iso3c = countrynames.to_code_3(country))
-					country_instance.save()
-				else:
-					try:
-						country_test = Country.objects.get(name="Taiwan")
-					except Country.DoesNotExist:
-						country_instance = Country(name = "Taiwan", iso3c = "TWN")
-						country_instance.save()
+	# Take out (and report) the rows that can't be loaded
+	scores = validate_scores(scores, "2019")
 
-		# **************************
-		# Load meets in 
-		# **************************
+	return shrink_frame(scores)
 
-		meets_df = scores[["meet_name", "start_date", "end_date", "meet_loc"]].drop_duplicates()
-		meets_df["start_date_fmt"] = pd.to_datetime(meets_df.start_date, format="%b %d %Y")
-		meets_df["end_date_fmt"] = pd.to_datetime(meets_df.end_date, format="%b %d %Y")
-		for meet in meets_df.itertuples():
-			try:
-				meet_test = Meet.objects.get(name=meet.meet_name)
-			except Meet.DoesNotExist:
-				if pd.isnull(meet.start_date_fmt)==False:
-					meet_instance = Meet(name = meet.meet_name, start_date=meet.start_date_fmt, end_date = meet.end_date_fmt)
-				else:
-					meet_instance = Meet(name = meet.meet_name)
-				meet_instance.save()
-				print(meet_instance)
 
-		# **************************
-		# Load gymnasts in 
-		# **************************
+# ****************************************************
+# ****************************************************
+# 2020 scores
+# ****************************************************
+# ****************************************************
 
-		gymnasts_df = scores[["gymnast", "country"]].drop_duplicates()
-		gymnasts_df.country.replace("Chinese Taipei", "Taiwan", inplace=True)
-		for person in gymnasts_df.itertuples():
-			try:
-				gymnast_test = Gymnast.objects.get(name=person.gymnast)
-			except Gymnast.DoesNotExist:
-				gymnast_instance = Gymnast(name = person.gymnast, country = Country.objects.get(name=person.country))
-				gymnast_instance.save()
-		
-		# **************************
-		# Load scores in 
-		# **************************
+def clean_2020(sources):
+	''' Reads and cleans the 2020 score sheet, which already has the meet dates'''
 
-		for row in scores.itertuples():
-			score_test = Score.objects.filter(gymnast=Gymnast.objects.get(name=row.gymnast), meet=Meet.objects.get(name=row.meet_name), meet_day=row.meet_day)
-			if score_test.count() == 0:
-				# Vault 1
-				if pd.isnull(row.vt1)==False:
-					score_instance = Score(gymnast = Gymnast.objects.get(name=row.gymnast), 
-						meet = Meet.objects.get(name=row.meet_name),
-						meet_day = row.meet_day, event=Event.objects.get(name="VT", junior=row.junior2018), score=row.vt1, d_score=row.vt1_d, score_num=1)
-					score_instance.save()
-				# Bars
-				if pd.isnull(row.ub)==False:
-					score_instance = Score(gymnast = Gymnast.objects.get(name=row.gymnast), 
-						meet = Meet.objects.get(name=row.meet_name),
-						meet_day = row.meet_day, event=Event.objects.get(name="UB", junior=row.junior2018), score=row.ub, d_score=row.ub_d, score_num=1)
-					score_instance.save()
-				# Balance beam
-				if pd.isnull(row.bb)==False:
-					score_instance = Score(gymnast = Gymnast.objects.get(name=row.gymnast), 
-						meet = Meet.objects.get(name=row.meet_name),
-						meet_day = row.meet_day, event=Event.objects.get(name="BB", junior=row.junior2018), score=row.bb, d_score=row.bb_d, score_num=1)
-					score_instance.save()
-				# Floor
-				if pd.isnull(row.fx)==False:
-					score_instance = Score(gymnast = Gymnast.objects.get(name=row.gymnast), 
-						meet = Meet.objects.get(name=row.meet_name),
-						meet_day = row.meet_day, event=Event.objects.get(name="FX", junior=row.junior2018), score=row.fx, d_score=row.fx_d, score_num=1)
-					score_instance.save()
-				# Vault 2
-				if pd.isnull(row.vt2)==False:
-					score_instance = Score(gymnast = Gymnast.objects.get(name=row.gymnast), 
-						meet = Meet.objects.get(name=row.meet_name),
-						meet_day = row.meet_day, event=Event.objects.get(name="VT", junior=row.junior2018), score=row.vt2, d_score=row.vt2_d, score_num=2)
-					score_instance.save()
+	# **************************
+	# Read in The Gymternet's score spreadsheet
+	# **************************
 
-		# **************************
-		# Add dates for some meets without dates
-		# **************************
-		meet = Meet.objects.get(name = "U.S. Verification (April) (2018)")
-		meet.start_date = datetime.date(2018, 4, 8)
-		meet.end_date = datetime.date(2018, 4, 8)		
-		meet.save()
-		meet = Meet.objects.get(name = "Top 12 Final (2018)")
-		meet.start_date = datetime.date(2018, 3, 17)
-		meet.end_date = datetime.date(2018, 3, 17)
-		meet.save()
-		meet = Meet.objects.get(name = "Brestyan's National Qualifier (2018)")
-		meet.start_date = datetime.date(2018, 6, 23)
-		meet.end_date = datetime.date(2018, 6, 24)
-		meet.save()
-		meet = Meet.objects.get(name = "Desert Lights Qualifier (2018)")
-		meet.start_date = datetime.date(2018, 1, 27)
-		meet.end_date = datetime.date(2018, 1, 28)
-		meet.save()
-		meet = Meet.objects.get(name = "Orlando Qualifier (2018)")
-		meet.start_date = datetime.date(2018, 2, 9)
-		meet.end_date = datetime.date(2018, 2, 11)
-		meet.save()
-		meet = Meet.objects.get(name = "President's Cup (2018)")
-		meet.start_date = datetime.date(2018, 2, 12)
-		meet.end_date = datetime.date(2018, 2, 16)
-		meet.save()
-		meet = Meet.objects.get(name = "Klaverblad Championships (2018)")
-		meet.start_date = datetime.date(2018, 6, 9)
-		meet.end_date = datetime.date(2018, 6, 10)
-		meet.save()
-		meet = Meet.objects.get(name = "Buckeye Qualifier (2018)")
-		meet.start_date = datetime.date(2018, 2, 1)
-		meet.end_date = datetime.date(2018, 2, 2)
-		meet.save()
-		meet = Meet.objects.get(name = "Swiss Duel (2018)")
-		meet.start_date = datetime.date(2018, 9, 23)
-		meet.end_date = datetime.date(2018, 9, 23)
-		meet.save()
-		meet = Meet.objects.get(name = "German Worlds Trial (2018)")
-		meet.start_date = datetime.date(2018, 9, 15)
-		meet.end_date = datetime.date(2018, 9, 15)
-		meet.save()
+	# Totals
+	#scores = pd.read_csv("https://docs.google.com/spreadsheets/d/1mAZlBhTIPOSZND4Z90ZmHJgobSqU8jv5dGpl54DHWSw/export?gid=0&format=csv") # used to need gid=0, now it causes 400 error
+	scores = read_csv_chunks(sources, "https://docs.google.com/spreadsheets/d/1mAZlBhTIPOSZND4Z90ZmHJgobSqU8jv5dGpl54DHWSw/export?format=csv", columns=["gymnast", "country", "meet_name", "meet_day", "vt1", "vt2", "ub", "bb", "fx", "vt1_d", "vt2_d", "ub_d", "bb_d", "fx_d", "meet_loc", "start_date", "end_date", "junior2020"], floats=[], categories=SHEET_CATEGORY_COLUMNS)
 
-		# ****************************************************
-		# ****************************************************
-		# 2019 scores
-		# ****************************************************
-		# ****************************************************
+	# **************************
+	# Clean the scores data
+	# **************************
 
-		# **************************
-		# Read in The Gymternet's score spreadsheet
-		# **************************
+	# **************************
+	# Clean the meet type
+	# **************************
 
-		# Totals
-		scores = pd.read_csv("https://docs.google.com/spreadsheets/d/1213cgQJaKzzpwoO46m5ihT7F6poyhAzimpsu7VEgTWA/export?gid=1358682386&format=csv")
-		scores.head()
-		scores.columns = ["gymnast", "country", "meet_name", "meet_day", "vt1", "vt2", "ub", "bb", "fx", "vt1_d", "vt2_d", "ub_d", "bb_d", "fx_d", "meet_loc", "start_date", "end_date", "junior2019"]
+	# **************************
+	# Mark juniors
+	# **************************
+	scores["junior2020"] = (scores["junior2020"] == True)
 
-		# **************************
-		# Clean the scores data
-		# **************************
+	# **************************
+	# Get meet start and end dates
+	# **************************
 
-		# **************************
-		# Clean the meet type
-		# **************************
+	# Add the year to the meet name (because some meets occur every year)
+	scores['meet_name'] = scores['meet_name'].astype(str) + " (2020)"
 
-		# **************************
-		# Mark juniors
-		# **************************
-		scores["junior2019"] = (scores["junior2019"] == True)
+	# Take out (and report) the rows that can't be loaded
+	scores = validate_scores(scores, "2020")
 
-		# **************************
-		# Get meet start and end dates
-		# **************************
+	return shrink_frame(scores)
 
-		# Add the year to the meet name (because some meets occur every year)
-		scores['meet_name'] = scores['meet_name'].astype(str) + " (2019)"
+# The seasons, in the order they are written to the database: (season, cleaning function, meet date fixes)
+SEASONS = [
+	("2017", clean_2017, fix_dates_2017),
+	("2018", clean_2018, fix_dates_2018),
+	("2019", clean_2019, None),
+	("2020", clean_2020, None),
+]
 
-		# **************************
-		# Load countries in
-		# **************************
 
-		countries_df = scores.country.drop_duplicates()
-		for country in countries_df:
-			try:
-				country_test = Country.objects.get(name=country)
-			except Country.DoesNotExist:
-				if country != "Chinese Taipei" and country != "Taiwan":
-					country_instance = Country(name = country, iso3c = countrynames.to_code_3(country))
-					country_instance.save()
-				else:
-					try:
-						country_test = Country.objects.get(name="Taiwan")
-					except Country.DoesNotExist:
-						country_instance = Country(name = "Taiwan", iso3c = "TWN")
-						country_instance.save()
+class Command(BaseCommand):
 
-		# **************************
-		# Load meets in 
-		# **************************
+	help = 'This reads in the 2017, 2018, 2019 score data and loads it into the database. The seasons can be cleaned in parallel, in separate processes (see --workers), and are then written one at a time.'
 
-		meets_df = scores[["meet_name", "start_date", "end_date", "meet_loc"]].drop_duplicates()
-		meets_df["start_date_fmt"] = pd.to_datetime(meets_df.start_date, format="%b %d %Y")
-		meets_df["end_date_fmt"] = pd.to_datetime(meets_df.end_date, format="%b %d %Y")
-		for meet in meets_df.itertuples():
-			try:
-				meet_test = Meet.objects.get(name=meet.meet_name)
-			except Meet.DoesNotExist:
-				if pd.isnull(meet.start_date_fmt)==False:
-					meet_instance = Meet(name = meet.meet_name, start_date=meet.start_date_fmt, end_date = meet.end_date_fmt)
-				else:
-					meet_instance = Meet(name = meet.meet_name)
-				meet_instance.save()
-				print(meet_instance)
 
-		# **************************
-		# Load gymnasts in 
-		# **************************
+	# **************************
+	# Load this data into the database
+	# **************************
 
-		gymnasts_df = scores[["gymnast", "country"]].drop_duplicates()
-		gymnasts_df.country.replace("Chinese Taipei", "Taiwan", inplace=True)
-		for person in gymnasts_df.itertuples():
-			try:
-				gymnast_test = Gymnast.objects.get(name=person.gymnast)
-			except Gymnast.DoesNotExist:
-				gymnast_instance = Gymnast(name = person.gymnast, country = Country.objects.get(name=person.country))
-				gymnast_instance.save()
-		
-		# **************************
-		# Load scores in 
-		# **************************
 
-		for row in scores.itertuples():
-			score_test = Score.objects.filter(gymnast=Gymnast.objects.get(name=row.gymnast), meet=Meet.objects.get(name=row.meet_name), meet_day=row.meet_day)
-			if score_test.count() == 0:
-				# Vault 1
-				if pd.isnull(row.vt1)==False:
-					score_instance = Score(gymnast = Gymnast.objects.get(name=row.gymnast), 
-						meet = Meet.objects.get(name=row.meet_name),
-						meet_day = row.meet_day, event=Event.objects.get(name="VT", junior=row.junior2019), score=row.vt1, d_score=row.vt1_d, score_num=1)
-					score_instance.save()
-				# Bars
-				if pd.isnull(row.ub)==False:
-					score_instance = Score(gymnast = Gymnast.objects.get(name=row.gymnast), 
-						meet = Meet.objects.get(name=row.meet_name),
-						meet_day = row.meet_day, event=Event.objects.get(name="UB", junior=row.junior2019), score=row.ub, d_score=row.ub_d, score_num=1)
-					score_instance.save()
-				# Balance beam
-				if pd.isnull(row.bb)==False:
-					score_instance = Score(gymnast = Gymnast.objects.get(name=row.gymnast), 
-						meet = Meet.objects.get(name=row.meet_name),
-						meet_day = row.meet_day, event=Event.objects.get(name="BB", junior=row.junior2019), score=row.bb, d_score=row.bb_d, score_num=1)
-					score_instance.save()
-				# Floor
-				if pd.isnull(row.fx)==False:
-					score_instance = Score(gymnast = Gymnast.objects.get(name=row.gymnast), 
-						meet = Meet.objects.get(name=row.meet_name),
-						meet_day = row.meet_day, event=Event.objects.get(name="FX", junior=row.junior2019), score=row.fx, d_score=row.fx_d, score_num=1)
-					score_instance.save()
-				# Vault 2
-				if pd.isnull(row.vt2)==False:
-					score_instance = Score(gymnast = Gymnast.objects.get(name=row.gymnast), 
-						meet = Meet.objects.get(name=row.meet_name),
-						meet_day = row.meet_day, event=Event.objects.get(name="VT", junior=row.junior2019), score=row.vt2, d_score=row.vt2_d, score_num=2)
-					score_instance.save()
+	def add_arguments(self, parser):
+		parser.add_argument('--offline', action='store_true', help="Read the source files from the local cache instead of downloading them")
+		parser.add_argument('--cache-dir', help="Directory for the cached source files (defaults to SOURCE_CACHE_DIR)")
+		parser.add_argument('--incremental', action='store_true', help="Only load rows that are new or changed since the last incremental run, and apply corrections to existing scores")
+		parser.add_argument('--workers', type=int, default=1, help="Number of processes used to clean the seasons. The default, 1, cleans them one after another in this process. Each extra worker holds another season's data frames in memory, so only raise this where there is RAM to spare (e.g. not on a 512 MB dyno).")
+		parser.add_argument('--memory-report', action='store_true', help="Print the peak memory of each stage. The seasons are then cleaned one at a time in this process, so that they can be measured.")
+
+	def _cleaned_seasons(self, sources):
+		'''
+		Yields (season, cleaned scores, meet date fixes) for each season, in order. The cleaning runs in a pool of
+		processes, so later seasons are being cleaned while earlier ones are written.
+		'''
+		if self.workers <= 1:
+			for season, clean, fix_dates in SEASONS:
+				with self.memory.stage("{}: read and clean".format(season)):
+					scores = clean(sources)
+				yield season, scores, fix_dates
+				del scores
+			return
+		# Each worker only gets the downloaded files of the season it cleans (not the fetcher, or every file), and sets
+		# Django up in case it's spawned rather than forked
+		with ProcessPoolExecutor(max_workers=self.workers, initializer=django.setup) as executor:
+			futures = [executor.submit(clean, FetchedSources({url: sources.get(url) for url in SEASON_SOURCES[season]})) for season, clean, _ in SEASONS]
+			for (season, _, fix_dates), future in zip(SEASONS, futures):
+				yield season, future.result(), fix_dates
+
+	def _fix_dates(self, fix_dates):
+		''' Runs a season's meet date fixes, and returns the gymnasts with scores at the meets whose dates changed'''
+		dates = dict(Meet.objects.values_list('id', 'start_date'))
+		fix_dates()
+		fixed = [meet_id for meet_id, start_date in Meet.objects.values_list('id', 'start_date') if dates.get(meet_id) != start_date]
+		return set(Score.objects.filter(meet__in=fixed).values_list('gymnast_id', flat=True).distinct())
+
+	def _create_db(self, sources):
+
+		# **************************
+		# Download the source files, all at once
+		# **************************
+		with self.memory.stage("download"):
+			sources.fetch_all(HISTORIC_SOURCES)
 
 		# ****************************************************
 		# ****************************************************
-		# 2020 scores
+		# Create all event instances if they don't exist already
 		# ****************************************************
 		# ****************************************************
 
-				# **************************
-		# Read in The Gymternet's score spreadsheet
-		# **************************
-
-		# Totals
-		#scores = pd.read_csv("https://docs.google.com/spreadsheets/d/1mAZlBhTIPOSZND4Z90ZmHJgobSqU8jv5dGpl54DHWSw/export?gid=0&format=csv") # used to need gid=0, now it causes 400 error
-		scores = pd.read_csv("https://docs.google.com/spreadsheets/d/1mAZlBhTIPOSZND4Z90ZmHJgobSqU8jv5dGpl54DHWSw/export?format=csv")
-		scores.head()
-		scores.columns = ["gymnast", "country", "meet_name", "meet_day", "vt1", "vt2", "ub", "bb", "fx", "vt1_d", "vt2_d", "ub_d", "bb_d", "fx_d", "meet_loc", "start_date", "end_date", "junior2020"]
-
-		# **************************
-		# Clean the scores data
-		# **************************
-
-		# **************************
-		# Clean the meet type
-		# **************************
-
-		# **************************
-		# Mark juniors
-		# **************************
-		scores["junior2020"] = (scores["junior2020"] == True)
-
-		# **************************
-		# Get meet start and end dates
-		# **************************
-
-		# Add the year to the meet name (because some meets occur every year)
-		scores['meet_name'] = scores['meet_name'].astype(str) + " (2020)"
-
-		# **************************
-		# Load countries in
-		# **************************
+		for event in ["VT", "UB", "BB", "FX"]:
+			for junior in [True, False]:
+				try:
+					event_test = Event.objects.get(name=event, junior=junior)
+				except Event.DoesNotExist:
+					event_instance = Event(name=event, junior=junior)
+					event_instance.save()
 
-		countries_df = scores.country.drop_duplicates()
-		for country in countries_df:
-			try:
-				country_test = Country.objects.get(name=country)
-			except Country.DoesNotExist:
-				if country != "Chinese Taipei" and country != "Taiwan":
-					country_instance = Country(name = country, iso3c = countrynames.to_code_3(country))
-					country_instance.save()
-				else:
-					try:
-						country_test = Country.objects.get(name="Taiwan")
-					except Country.DoesNotExist:
-						country_instance = Country(name = "Taiwan", iso3c = "TWN")
-						country_instance.save()
+		# Reads the existing countries, meets, gymnasts and events once, and keeps track of every new score
+		loader = ScoreLoader(incremental=self.incremental)
+		self.dated_gymnasts = set()
 
 		# **************************
-		# Load meets in 
+		# Write each season as it comes out of the pool, in its own transaction
 		# **************************
+		# Seasons are written in order, since later seasons reuse the meets and gymnasts of earlier ones
 
-		meets_df = scores[["meet_name", "start_date", "end_date", "meet_loc"]].drop_duplicates()
-		meets_df["start_date_fmt"] = pd.to_datetime(meets_df.start_date, format="%b %d %Y")
-		meets_df["end_date_fmt"] = pd.to_datetime(meets_df.end_date, format="%b %d %Y")
-		for meet in meets_df.itertuples():
-			try:
-				meet_test = Meet.objects.get(name=meet.meet_name)
-			except Meet.DoesNotExist:
-				if pd.isnull(meet.start_date_fmt)==False:
-					meet_instance = Meet(name = meet.meet_name, start_date=meet.start_date_fmt, end_date = meet.end_date_fmt)
-				else:
-					meet_instance = Meet(name = meet.meet_name)
-				meet_instance.save()
-				print(meet_instance)
+		for season, scores, fix_dates in self._cleaned_seasons(sources):
+			print("Loading {} scores ({} rows, {:.1f} MB)".format(season, len(scores), frame_size(scores)))
+			with self.memory.stage("{}: load".format(season)), transaction.atomic():
+				loader.load(scores, junior="junior" + season, source=season)
+				if fix_dates is not None:
+					self.dated_gymnasts |= self._fix_dates(fix_dates)
+			# Let the season go before the next one is cleaned
+			del scores
 
 		# **************************
-		# Load gymnasts in 
+		# Update the precomputed stats with the new scores
 		# **************************
 
-		gymnasts_df = scores[["gymnast", "country"]].drop_duplicates()
-		gymnasts_df.country.replace("Chinese Taipei", "Taiwan", inplace=True)
-		for person in gymnasts_df.itertuples():
-			try:
-				gymnast_test = Gymnast.objects.get(name=person.gymnast)
-			except Gymnast.DoesNotExist:
-				gymnast_instance = Gymnast(name = person.gymnast, country = Country.objects.get(name=person.country))
-				gymnast_instance.save()
-		
-		# **************************
-		# Load scores in 
-		# **************************
+		with self.memory.stage("stats"):
+			update_stats(loader.new_scores)
+			# Scores that were corrected or removed can't be folded in, and scores loaded before their meet had a date
+			# were left out, so recompute those gymnasts' stats
+			rebuild_gymnast_stats(loader.changed_gymnasts | self.dated_gymnasts)
 
-		for row in scores.itertuples():
-			score_test = Score.objects.filter(gymnast=Gymnast.objects.get(name=row.gymnast), meet=Meet.objects.get(name=row.meet_name), meet_day=row.meet_day)
-			if score_test.count() == 0:
-				# Vault 1
-				if pd.isnull(row.vt1)==False:
-					score_instance = Score(gymnast = Gymnast.objects.get(name=row.gymnast), 
-						meet = Meet.objects.get(name=row.meet_name),
-						meet_day = row.meet_day, event=Event.objects.get(name="VT", junior=row.junior2020), score=row.vt1, d_score=row.vt1_d, score_num=1)
-					score_instance.save()
-				# Bars
-				if pd.isnull(row.ub)==False:
-					score_instance = Score(gymnast = Gymnast.objects.get(name=row.gymnast), 
-						meet = Meet.objects.get(name=row.meet_name),
-						meet_day = row.meet_day, event=Event.objects.get(name="UB", junior=row.junior2020), score=row.ub, d_score=row.ub_d, score_num=1)
-					score_instance.save()
-				# Balance beam
-				if pd.isnull(row.bb)==False:
-					score_instance = Score(gymnast = Gymnast.objects.get(name=row.gymnast), 
-						meet = Meet.objects.get(name=row.meet_name),
-						meet_day = row.meet_day, event=Event.objects.get(name="BB", junior=row.junior2020), score=row.bb, d_score=row.bb_d, score_num=1)
-					score_instance.save()
-				# Floor
-				if pd.isnull(row.fx)==False:
-					score_instance = Score(gymnast = Gymnast.objects.get(name=row.gymnast), 
-						meet = Meet.objects.get(name=row.meet_name),
-						meet_day = row.meet_day, event=Event.objects.get(name="FX", junior=row.junior2020), score=row.fx, d_score=row.fx_d, score_num=1)
-					score_instance.save()
-				# Vault 2
-				if pd.isnull(row.vt2)==False:
-					score_instance = Score(gymnast = Gymnast.objects.get(name=row.gymnast), 
-						meet = Meet.objects.get(name=row.meet_name),
-						meet_day = row.meet_day, event=Event.objects.get(name="VT", junior=row.junior2020), score=row.vt2, d_score=row.vt2_d, score_num=2)
-					score_instance.save()
+		print("Inserted {inserted} rows, updated {updated}, unchanged {unchanged}".format(**loader.counts))
 
 	def handle(self, *args, **options):
-		self._create_db()
+		sources = SourceFetcher(cache_dir=options['cache_dir'], offline=options['offline'])
+		self.incremental = options['incremental']
+		self.memory = MemoryReport(enabled=options['memory_report'])
+		# Memory can only be measured in this process
+		self.workers = 1 if self.memory.enabled else options['workers']
+		# Bump the data generation once when the load is done, rather than once per row
+		with deferred_bump():
+			self._create_db(sources)
+			bump_generation()
+		self.memory.print_report()
+		# Make sure the search index matches the new data
+		rebuild_search_index()
+		# Recount the scores, gymnasts and meets for the home page
+		refresh_counters()
+		# Write the score snapshot for the analytics pages
+		write_snapshot()
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from scoredata.snapshot import write_snapshot
+
+
+class Command(BaseCommand):
+
+	help = 'This writes the score snapshot that the score selector, team tester and consistency stats read from. The ingest commands write it themselves; run this after editing scores in the admin.'
+
+	def handle(self, *args, **options):
+		num_scores = write_snapshot()
+		print("Wrote a snapshot of {} scores".format(num_scores))
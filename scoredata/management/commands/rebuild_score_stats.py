@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from scoredata.score_stats import rebuild_stats
+from scoredata.generation import bump_generation
+from scoredata.snapshot import write_snapshot
+
+
+class Command(BaseCommand):
+
+	help = 'This regenerates the precomputed gymnast stats (averages, best scores and consistency) from the score data. Run it after a large data cleanup.'
+
+	def handle(self, *args, **options):
+		num_stats = rebuild_stats()
+		# The gymnast pages show these stats, so make sure cached pages are rebuilt
+		bump_generation()
+		# That also makes the score snapshot out of date, so write a new one
+		write_snapshot()
+		print("Rebuilt {} gymnast event stats".format(num_stats))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from scoredata.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+
+	help = 'This rebuilds the search index for gymnast names, meet names and blog post titles.'
+
+	def handle(self, *args, **options):
+		rebuild_search_index()
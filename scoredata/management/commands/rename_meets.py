@@ -0,0 +1,73 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from scoredata.models import Meet, Score
+from scoredata.generation import bump_generation, deferred_bump
+from scoredata.search import rebuild_search_index
+from scoredata.counters import refresh_counters
+from scoredata.snapshot import write_snapshot
+from scoredata.score_stats import rebuild_stats
+from scoredata.fetch import SourceFetcher
+from scoredata.meet_names import find_renamed_meets
+from scoredata.management.commands.populate_scores_historic import read_2017_meet_names
+
+
+class Command(BaseCommand):
+
+	help = 'This renames the 2017 meets that were loaded with doubled names by the old meet name cleaning (e.g. "Baku World Cup World Cup") to the names the alias table gives them now, so that loading 2017 again finds them instead of adding new meets with every score a second time. A meet whose new name is already in the database is merged into it. Run it before loading 2017 with the alias table. The meet names in the 2017 sheet decide names that could have come from more than one spreadsheet name; with --no-sheet, those are only listed.'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--dry-run', action='store_true', help="List the meets that would be renamed or merged, without changing anything")
+		parser.add_argument('--no-sheet', action='store_true', help="Work the names out from the meet names in the database alone, without reading the 2017 sheet")
+		parser.add_argument('--offline', action='store_true', help="Read the 2017 sheet from the local cache instead of downloading it")
+		parser.add_argument('--cache-dir', help="Directory for the cached source files (defaults to SOURCE_CACHE_DIR)")
+
+	def _merge(self, meet, into):
+		# Moves meet's scores to into, dropping any that into already has (same gymnast, day, event and score num),
+		# since they'd break the unique constraint on Score
+		already_loaded = Score.objects.filter(meet=into, gymnast=OuterRef('gymnast'), meet_day=OuterRef('meet_day'), event=OuterRef('event'), score_num=OuterRef('score_num'))
+		Score.objects.filter(meet=meet).annotate(already_loaded=Exists(already_loaded)).filter(already_loaded=True).delete()
+		Score.objects.filter(meet=meet).update(meet=into)
+		if into.start_date is None and meet.start_date is not None:
+			into.start_date, into.end_date = meet.start_date, meet.end_date
+			into.save()
+		meet.delete()
+
+	def handle(self, *args, **options):
+		suffix = " (2017)"
+		meets = {meet.name[:-len(suffix)]: meet for meet in Meet.objects.filter(name__endswith=suffix)}
+		sheet_names = None
+		if not options['no_sheet']:
+			sheet_names = read_2017_meet_names(SourceFetcher(cache_dir=options['cache_dir'], offline=options['offline']))
+		renamed, ambiguous = find_renamed_meets(meets, "2017", sheet_names=sheet_names)
+
+		for name in sorted(ambiguous):
+			print("Not renaming {}{}: it could have come from spreadsheet names that are now cleaned differently".format(name, suffix))
+		existing = {meet.name: meet for meet in Meet.objects.filter(name__in=[new_name + suffix for new_name in renamed.values()])}
+		for name, new_name in sorted(renamed.items()):
+			print("{} {}{} to {}{}".format("Merging" if new_name + suffix in existing else "Renaming", name, suffix, new_name, suffix))
+		print("{} meets to rename or merge".format(len(renamed)))
+		if options['dry_run'] or len(renamed) == 0:
+			return
+
+		# Bump the data generation once when the meets are renamed, rather than once per meet
+		with deferred_bump():
+			with transaction.atomic():
+				for name, new_name in sorted(renamed.items()):
+					meet = meets[name]
+					if new_name + suffix in existing:
+						self._merge(meet, existing[new_name + suffix])
+					else:
+						meet.name = new_name + suffix
+						meet.save()
+						# Two old names can have the same new name
+						existing[meet.name] = meet
+			bump_generation()
+		# Make sure the search index matches the new names
+		rebuild_search_index()
+		# Recount the scores, gymnasts and meets for the home page
+		refresh_counters()
+		# Merged meets may have dropped scores, so regenerate the precomputed stats
+		rebuild_stats()
+		# Write the score snapshot for the analytics pages
+		write_snapshot()
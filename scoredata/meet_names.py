@@ -0,0 +1,125 @@
+import os
+import re
+import json
+from functools import lru_cache
+
+# **************************
+# Meet name aliases
+# **************************
+# The score spreadsheets use short or informal meet names ("Euros", "Jesolo"). The aliases for each season are kept in
+# data/meet_aliases.json and applied in one pass, with a single regular expression that has every alias (and every
+# full name, which maps to itself) as an alternative. Because the full names are alternatives too, a name that is
+# already expanded ("City of Jesolo Trophy") is matched as a whole and left alone, and a replacement is never replaced
+# again by a later alias. The expression is run once per distinct meet name, not once per row.
+
+MEET_ALIASES_PATH = os.path.join(os.path.dirname(__file__), "data", "meet_aliases.json")
+MEET_ALIASES_VERSION = 1
+
+
+@lru_cache(maxsize=None)
+def read_meet_aliases(path=MEET_ALIASES_PATH):
+	''' Returns {season: ((alias, name, exact), ...)} from the alias file'''
+	with open(path, encoding="utf-8") as alias_file:
+		data = json.load(alias_file)
+	if data.get("version") != MEET_ALIASES_VERSION:
+		raise ValueError("{} has version {}, but version {} is expected".format(path, data.get("version"), MEET_ALIASES_VERSION))
+	return {season: tuple((entry["alias"], entry["name"], entry.get("exact", False)) for entry in entries) for season, entries in data["seasons"].items()}
+
+
+class MeetNameNormalizer:
+	'''
+	Replaces aliases in a meet name. Exact aliases only match the whole (stripped) name; the others match anywhere in
+	the name, as whole words.
+	'''
+
+	def __init__(self, aliases):
+		self.exact = {alias: name for alias, name, exact in aliases if exact}
+		# Full names map to themselves, so that they are protected from the shorter aliases inside them
+		self.replacements = {name: name for alias, name, exact in aliases if not exact}
+		self.replacements.update({alias: name for alias, name, exact in aliases if not exact})
+		self.pattern = None
+		if self.replacements:
+			# Python takes the first alternative that matches, so the longest ones go first
+			alternatives = sorted(self.replacements, key=len, reverse=True)
+			self.pattern = re.compile(r"(?<!\w)(?:{})(?!\w)".format("|".join(re.escape(alternative) for alternative in alternatives)))
+
+	def __call__(self, name):
+		if name.strip() in self.exact:
+			return self.exact[name.strip()]
+		if self.pattern is None:
+			return name
+		return self.pattern.sub(lambda match: self.replacements[match.group(0)], name)
+
+
+@lru_cache(maxsize=None)
+def get_meet_name_normalizer(season, path=MEET_ALIASES_PATH):
+	''' Returns the MeetNameNormalizer for a season, or None if the season has no aliases'''
+	aliases = read_meet_aliases(path).get(season, ())
+	if len(aliases) == 0:
+		return None
+	return MeetNameNormalizer(aliases)
+
+
+def normalize_meet_names(names, season, path=MEET_ALIASES_PATH):
+	''' Returns a copy of names (a Series of meet names) with the season's aliases replaced by the full names'''
+	normalizer = get_meet_name_normalizer(season, path)
+	if normalizer is None:
+		return names
+	mapping = {name: normalizer(name) if isinstance(name, str) else name for name in names.dropna().unique()}
+	return names.map(mapping)
+
+
+# **************************
+# Meet names from the chained cleaning
+# **************************
+# Before the alias table, each alias was replaced in turn with str.replace, over the output of the replacements
+# before it. A name that already had the full form came out doubled ("Baku World Cup" -> "Baku World Cup World Cup"),
+# and meets that are already in the database have those names. These find the names they should have now.
+
+def chain_meet_aliases(name, aliases):
+	''' Returns name cleaned the old way: one str.replace per alias, in order'''
+	for alias, full_name, exact in aliases:
+		if exact:
+			if name.strip() == alias:
+				name = full_name
+		else:
+			name = name.replace(alias, full_name)
+	return name
+
+
+def _unchain_meet_aliases(name, aliases):
+	# Every name that the chain could have turned into name, found by undoing each replacement (last first) or not.
+	# Some of them don't go back to name through the chain, so they're checked afterwards.
+	names = {name}
+	for alias, full_name, exact in reversed(aliases):
+		for candidate in list(names):
+			if exact:
+				if candidate.strip() == full_name:
+					names.add(alias)
+			elif full_name in candidate:
+				names.add(candidate.replace(full_name, alias))
+	return names
+
+
+def find_renamed_meets(names, season, sheet_names=None, path=MEET_ALIASES_PATH):
+	'''
+	Works out the new names of meets named by the chained cleaning. names are the meet names in the database, without
+	the season suffix; sheet_names, if given, are the meet names in the season's spreadsheet (with the meet days taken
+	out), and otherwise every name that the chain could have started from is tried. Returns ({old name: new name} for
+	the names that the alias table cleans differently, the names that could have come from spreadsheet names which now
+	clean to different names).
+	'''
+	aliases = read_meet_aliases(path).get(season, ())
+	normalizer = get_meet_name_normalizer(season, path)
+	renamed, ambiguous = {}, set()
+	if normalizer is None:
+		return renamed, ambiguous
+	for name in names:
+		candidates = _unchain_meet_aliases(name, aliases) if sheet_names is None else sheet_names
+		# Meet names are stripped once they're cleaned
+		new_names = {normalizer(candidate).strip() for candidate in candidates if chain_meet_aliases(candidate, aliases).strip() == name}
+		if len(new_names) > 1:
+			ambiguous.add(name)
+		elif len(new_names) == 1 and name not in new_names:
+			renamed[name] = new_names.pop()
+	return renamed, ambiguous
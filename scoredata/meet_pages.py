@@ -0,0 +1,111 @@
+import datetime
+from collections import namedtuple
+from django.db import connections
+from .models import Meet, Score
+
+# **************************
+# Keyset pagination for the list of meets
+# **************************
+# Meets are listed newest first, ordered by (start date, id), with undated meets at the end. Instead of a page
+# number, each page links to the next/previous page with a cursor holding the (start date, id) of the last/first meet
+# on the page. The next page is then a "seek" past that meet, which costs the same however deep into the list it is,
+# and doesn't shift when new meets are added.
+
+MEETS_PER_PAGE = 50
+
+MeetPage = namedtuple('MeetPage', ['meets', 'next_cursor', 'previous_cursor'])
+
+
+def make_cursor(meet):
+	''' Encodes the (start date, id) of a meet as a cursor string, e.g. "2021-02-27_412"'''
+	date = meet.start_date.isoformat() if meet.start_date is not None else "none"
+	return "{}_{}".format(date, meet.id)
+
+
+def parse_cursor(cursor):
+	''' Decodes a cursor into (start date, id). Returns None if the cursor isn't valid.'''
+	try:
+		date, meet_id = cursor.split("_")
+		meet_id = int(meet_id)
+		if date == "none":
+			return None, meet_id
+		return datetime.date.fromisoformat(date), meet_id
+	except (AttributeError, ValueError):
+		return None
+
+
+def filter_meets(queryset, year=None, country=None):
+	'''
+	Restricts meets to those that started in the given year, and/or had scores from a gymnast from the given country
+	(by ISO3c code)
+	'''
+	if year is not None:
+		queryset = queryset.filter(start_date__gte=datetime.date(year, 1, 1), start_date__lt=datetime.date(year+1, 1, 1))
+	if country is not None:
+		queryset = queryset.filter(id__in=Score.objects.filter(gymnast__country__iso3c=country).values('meet'))
+	return queryset
+
+
+def _seek(queryset, operator, start_date, meet_id):
+	# Meets whose (start date, id) is less/greater than the cursor's. This is one row-value comparison rather than
+	# "start_date < x OR (start_date = x AND id < y)", so the database can seek straight to the cursor on the
+	# (start_date, id) index instead of scanning from one end of it. (Django has no lookup for row values.)
+	connection = connections[queryset.db]
+	table = connection.ops.quote_name(queryset.model._meta.db_table)
+	where = "({0}.{1}, {0}.{2}) {3} (%s, %s)".format(table, connection.ops.quote_name('start_date'), connection.ops.quote_name('id'), operator)
+	return queryset.extra(where=[where], params=[connection.ops.adapt_datefield_value(start_date), meet_id])
+
+
+def meet_page_querysets(queryset, after=None, before=None):
+	'''
+	Returns the querysets that are read in turn (until a page is full) for the page after the "after" cursor or before
+	the "before" cursor (both already parsed), and whether they are in newest-first order. Dated and undated meets are
+	read separately, each in the order of the (start_date, id) index: a single "nulls last" ordering doesn't match it.
+	'''
+	dated = queryset.filter(start_date__isnull=False)
+	undated = queryset.filter(start_date__isnull=True)
+	if before is not None:
+		# Read backwards from the cursor: the undated meets after it (if it is undated), then the dated meets
+		start_date, meet_id = before
+		if start_date is None:
+			return [undated.filter(id__gt=meet_id).order_by('id'), dated.order_by('start_date', 'id')], False
+		return [_seek(dated, ">", start_date, meet_id).order_by('start_date', 'id')], False
+	if after is None:
+		return [dated.order_by('-start_date', '-id'), undated.order_by('-id')], True
+	start_date, meet_id = after
+	if start_date is None:
+		return [undated.filter(id__lt=meet_id).order_by('-id')], True
+	return [_seek(dated, "<", start_date, meet_id).order_by('-start_date', '-id'), undated.order_by('-id')], True
+
+
+def get_meet_page(queryset, after=None, before=None, per_page=MEETS_PER_PAGE):
+	'''
+	Returns a MeetPage with the meets that come after the "after" cursor (or before the "before" cursor), plus the
+	cursors for the neighbouring pages (None if there isn't one). With no cursor, returns the first page.
+	'''
+	queryset = queryset.only('id', 'name', 'start_date', 'end_date')
+	after = parse_cursor(after) if after else None
+	before = parse_cursor(before) if before else None
+
+	querysets, newest_first = meet_page_querysets(queryset, after=after, before=before)
+	meets = []
+	for part in querysets:
+		if len(meets) > per_page:
+			break
+		meets += list(part[:per_page+1-len(meets)])
+
+	if not newest_first:
+		# Put the meets back in newest-first order
+		has_previous = len(meets) > per_page
+		meets = meets[:per_page][::-1]
+		has_next = True
+	else:
+		has_next = len(meets) > per_page
+		meets = meets[:per_page]
+		has_previous = after is not None
+
+	if len(meets) == 0:
+		return MeetPage(meets, None, None)
+	next_cursor = make_cursor(meets[-1]) if has_next else None
+	previous_cursor = make_cursor(meets[0]) if has_previous else None
+	return MeetPage(meets, next_cursor, previous_cursor)
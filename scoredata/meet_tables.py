@@ -0,0 +1,129 @@
+from .models import Event, Score
+
+# **************************
+# Score tables for a single meet
+# **************************
+
+# Display names for each meet day and event
+MEET_DAY_DISPLAY = dict(Score.meet_day_opts)
+EVENT_DISPLAY = dict(Event.event_names)
+EVENT_DISPLAY["VT"] = "Vault"
+
+
+def _display_score(score):
+	''' Returns the score value, or "-" if there is no score'''
+	if score is None:
+		return "-"
+	return score.score
+
+
+def meet_score_tables(meet):
+	'''
+	Returns the list of tables shown on a meet's detail page.
+
+	All of the meet's scores are loaded in one query and grouped by (meet_day, junior, event, score_num).
+	All around tables are (title, rows) with rows of [gymnast, VT1, VT2, UB, BB, FX, AA], and event final
+	tables are (title, rows, event) with rows of [gymnast, VT1, VT2, VT avg] for vault and [gymnast, score]
+	for the other events.
+	'''
+
+	# Group every score for this meet, keeping track of the order in which days and gymnasts first appear
+	scores = Score.objects.filter(meet=meet).select_related('gymnast__country', 'event').order_by('id')
+	days = {}
+	day_gymnasts = {}
+	event_gymnasts = {}
+	grouped = {}
+	for score in scores:
+		junior = score.event.junior
+		days.setdefault(score.meet_day, {})[junior] = True
+		day_gymnasts.setdefault((score.meet_day, junior), {})[score.gymnast_id] = score.gymnast
+		event_gymnasts.setdefault((score.meet_day, junior, score.event.name), {})[score.gymnast_id] = score.gymnast
+		grouped[(score.meet_day, junior, score.event.name, score.score_num, score.gymnast_id)] = score
+
+	def get_score(day, junior, event, score_num, gymnast_id):
+		return _display_score(grouped.get((day, junior, event, score_num, gymnast_id)))
+
+	to_display = []
+	# Loop through the meet days - each one will be a separate table
+	for day, by_junior in days.items():
+		has_juniors = True in by_junior
+		# Seniors are listed before juniors
+		for jr_event in sorted(by_junior):
+			# If this is not event finals
+			if day != "EF":
+				# Update display name based on whether or not this is the table for juniors, and whether there were any juniors competing at all
+				day_display = MEET_DAY_DISPLAY.get(day, day)
+				if day_display == "" and has_juniors and not jr_event:
+					day_display = "Senior Competition"
+				elif day_display == "" and has_juniors and jr_event:
+					day_display = "Junior Competition"
+				elif jr_event:
+					day_display = "Junior " + day_display
+				# Get all gymnasts with scores at this meet on this day
+				gymnast_scores = []
+				for gymnast_id, gymnast in day_gymnasts[(day, jr_event)].items():
+					this_gymnast_scores = [gymnast]
+					# Add the VT1, VT2, UB, BB, FX scores to the list
+					for event, num in [("VT", 1), ("VT", 2), ("UB", 1), ("BB", 1), ("FX", 1)]:
+						this_gymnast_scores.append(get_score(day, jr_event, event, num, gymnast_id))
+					# Calculate the AA score where applicable
+					aa_scores = [this_gymnast_scores[1], this_gymnast_scores[3], this_gymnast_scores[4], this_gymnast_scores[5]]
+					if all(isinstance(score, float) for score in aa_scores):
+						this_gymnast_scores.append(sum(aa_scores))
+					else:
+						this_gymnast_scores.append("-")
+					gymnast_scores.append(this_gymnast_scores)
+				to_display.append((day_display, gymnast_scores))
+			# Else, for event finals
+			else:
+				for event in ["VT", "UB", "BB", "FX"]:
+					day_display = EVENT_DISPLAY[event] + " Event Final"
+					# Update display name based on whether or not this is the table for juniors, and whether there were any juniors competing at all
+					if jr_event:
+						day_display = "Junior " + day_display
+					elif has_juniors:
+						day_display = "Senior " + day_display
+					gymnast_scores = []
+					for gymnast_id, gymnast in event_gymnasts.get((day, jr_event, event), {}).items():
+						this_gymnast_scores = [gymnast]
+						if event == "VT":
+							# Add the VT1 and VT2 scores, and the vault average if both vaults were scored
+							this_gymnast_scores.append(get_score(day, jr_event, "VT", 1, gymnast_id))
+							this_gymnast_scores.append(get_score(day, jr_event, "VT", 2, gymnast_id))
+							if isinstance(this_gymnast_scores[1], float) and isinstance(this_gymnast_scores[2], float):
+								this_gymnast_scores.append((this_gymnast_scores[1] + this_gymnast_scores[2])/2)
+						else:
+							this_gymnast_scores.append(get_score(day, jr_event, event, 1, gymnast_id))
+						gymnast_scores.append(this_gymnast_scores)
+					to_display.append((day_display, gymnast_scores, event))
+
+	return to_display
+
+
+def meet_tables_json(meet, to_display):
+	''' Converts the output of meet_score_tables into JSON-serializable data'''
+	tables = []
+	for table in to_display:
+		rows = []
+		for row in table[1]:
+			gymnast = row[0]
+			rows.append({
+				'gymnast': gymnast.name,
+				'gymnast_id': str(gymnast.id),
+				'country': gymnast.country.iso3c if gymnast.country else None,
+				'scores': [score if isinstance(score, float) else None for score in row[1:]],
+			})
+		tables.append({
+			'title': table[0],
+			'event': table[2] if len(table) > 2 else "AA",
+			'rows': rows,
+		})
+	return {
+		'meet': {
+			'id': meet.id,
+			'name': meet.name,
+			'start_date': meet.start_date.isoformat() if meet.start_date else None,
+			'end_date': meet.end_date.isoformat() if meet.end_date else None,
+		},
+		'tables': tables,
+	}
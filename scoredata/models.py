@@ -7,6 +7,8 @@ from datetime import datetime
 import pandas as pd
 import os
 from django.template.defaultfilters import slugify
+from django.utils import timezone
+from math import sqrt
 
 # **************************
 # Score database models
@@ -69,6 +71,10 @@ class Meet(models.Model):
 
 	class Meta:
 		ordering = ["-start_date"]
+		indexes = [
+			# Meet list (keyset pagination on start date and id)
+			models.Index(fields=['start_date', 'id'], name='meet_start_date_id_idx'),
+		]
 
 
 # Model for which event (VT, UB, BB, FX)
@@ -103,9 +109,122 @@ class Score(models.Model):
 	# Add a score num field so that we can record first vault vs second vaults
 	score_num = models.PositiveIntegerField(default=1)
 
+	class Meta:
+		indexes = [
+			# Meet pages and meet exports, which read one meet's scores by day and event
+			models.Index(fields=['meet', 'meet_day', 'event'], name='score_meet_day_event_idx'),
+			# Per-event rankings (best/average scores on one apparatus)
+			models.Index(fields=['event', 'score_num', 'score'], name='score_event_num_score_idx'),
+		]
+		constraints = [
+			# A gymnast has at most one score per meet, day, event and vault number. This also serves as the index for
+			# gymnast pages and for the ingest commands' "is this already loaded?" checks.
+			models.UniqueConstraint(fields=['gymnast', 'meet', 'meet_day', 'event', 'score_num'], name='unique_score'),
+		]
+
 	def __str__(self):
 		return str(self.score)
 
+# Model for precomputed statistics on a gymnast's scores on one event over a time window
+# (kept up to date by the populate_scores commands, and regenerated by rebuild_score_stats). The past year isn't
+# stored, since it moves every day: those stats are worked out from the scores as they're read.
+class GymnastEventStats(models.Model):
+	window_opts = (
+		("season", "This season"),
+		("quad", "This quad"),
+	)
+	gymnast = models.ForeignKey(Gymnast, on_delete=models.CASCADE)
+	event = models.CharField(max_length=2, choices=Event.event_names)
+	score_num = models.PositiveIntegerField(default=1)
+	window = models.CharField(max_length=10, choices=window_opts)
+	# Total scores
+	count = models.PositiveIntegerField(default=0)
+	mean = models.FloatField(null=True)
+	max_score = models.FloatField(null=True)
+	# Execution scores (score - d_score), using Welford's algorithm so that the standard deviation can be updated one score at a time
+	e_count = models.PositiveIntegerField(default=0)
+	e_mean = models.FloatField(default=0)
+	e_m2 = models.FloatField(default=0)
+	last_updated = models.DateTimeField(default=timezone.now)
+
+	class Meta:
+		verbose_name_plural = "Gymnast event stats"
+		unique_together = ("gymnast", "event", "score_num", "window")
+
+	def __str__(self):
+		return "{} {}{} ({})".format(self.gymnast_id, self.event, self.score_num, self.window)
+
+	def add_score(self, score, d_score):
+		"""
+		Adds one score to the running statistics.
+		"""
+		if score is None or score != score:
+			return
+		self.count += 1
+		self.mean = score if self.mean is None else self.mean + (score - self.mean) / self.count
+		self.max_score = score if self.max_score is None else max(self.max_score, score)
+		if d_score is not None and d_score == d_score:
+			e_score = score - d_score
+			self.e_count += 1
+			delta = e_score - self.e_mean
+			self.e_mean += delta / self.e_count
+			self.e_m2 += delta * (e_score - self.e_mean)
+		self.last_updated = timezone.now()
+
+	def get_sumstat(self, sumstat):
+		"""
+		Returns the average ("avg") or best ("max") score.
+		"""
+		if sumstat == "max":
+			return self.max_score
+		return self.mean
+
+	@property
+	def e_std(self):
+		"""
+		Population standard deviation of the execution scores.
+		"""
+		if self.e_count == 0:
+			return None
+		return sqrt(self.e_m2 / self.e_count)
+
+# Single row recording the current "generation" of the score data. It is bumped whenever gymnasts, meets or scores
+# change, so that per-process caches (e.g. the autocomplete index) can tell when they are out of date.
+class DataGeneration(models.Model):
+	generation = models.PositiveIntegerField(default=0)
+	updated = models.DateTimeField(default=timezone.now)
+
+	def __str__(self):
+		return "Generation {} ({})".format(self.generation, self.updated)
+
+# Fingerprint of one row of a source spreadsheet (one gymnast on one meet day), as of the last incremental ingest.
+# Rows whose fingerprint hasn't changed are skipped on the next run.
+class SourceRow(models.Model):
+	source = models.CharField(max_length=50, help_text="Which spreadsheet the row came from, e.g. the season")
+	row_key = models.CharField(max_length=64, help_text="Hash of the row's gymnast, meet and meet day")
+	fingerprint = models.CharField(max_length=64, help_text="Hash of the row's contents")
+	last_updated = models.DateTimeField(default=timezone.now)
+
+	class Meta:
+		unique_together = ["source", "row_key"]
+
+	def __str__(self):
+		return "{} {}".format(self.source, self.row_key)
+
+# Single row with the number of scores, gymnasts and meets shown on the home page, so that the home page doesn't
+# have to count the whole scores table on every visit
+class SiteCounters(models.Model):
+	num_scores = models.PositiveIntegerField(default=0)
+	num_gymnasts = models.PositiveIntegerField(default=0)
+	num_meets = models.PositiveIntegerField(default=0)
+	updated = models.DateTimeField(default=timezone.now)
+
+	class Meta:
+		verbose_name_plural = "Site counters"
+
+	def __str__(self):
+		return "{} scores, {} gymnasts, {} meets".format(self.num_scores, self.num_gymnasts, self.num_meets)
+
 # **************************
 # Blog models
 # **************************
@@ -0,0 +1,75 @@
+import re
+import heapq
+import threading
+from bisect import bisect_left
+from .models import Gymnast, Meet
+from .generation import get_generation
+
+# **************************
+# In-memory prefix index for the autocomplete search bars
+# **************************
+
+# Maximum number of names returned for each kind of result
+AUTOCOMPLETE_LIMIT = 20
+
+
+def normalize_name(name):
+	''' Normalizes a name for case-insensitive prefix matching'''
+	return re.sub(r"\s+", " ", name).casefold()
+
+
+class PrefixIndex:
+	'''
+	Sorted array of normalized names that can be searched by prefix with bisect. Each name has a rank, and
+	matches are returned in rank order.
+	'''
+
+	def __init__(self, names):
+		entries = sorted((normalize_name(name.strip()), rank, name) for rank, name in enumerate(names))
+		self.keys = [entry[0] for entry in entries]
+		self.ranks = [entry[1] for entry in entries]
+		self.names = [entry[2] for entry in entries]
+		# Names that are ranked alphabetically are already in rank order within any prefix
+		self.in_rank_order = all(a < b for a, b in zip(self.ranks, self.ranks[1:]))
+
+	def search(self, prefix, limit=AUTOCOMPLETE_LIMIT):
+		prefix = normalize_name(prefix)
+		start = bisect_left(self.keys, prefix)
+		end = bisect_left(self.keys, prefix + "\U0010ffff", lo=start)
+		if self.in_rank_order:
+			matches = range(start, min(end, start + limit))
+		else:
+			# Short prefixes match a large part of the index, so only the best limit matches are kept
+			matches = heapq.nsmallest(limit, range(start, end), key=self.ranks.__getitem__)
+		return [self.names[i] for i in matches]
+
+
+_lock = threading.Lock()
+_index = {'generation': None, 'gymnasts': None, 'meets': None}
+
+
+def get_name_indexes():
+	'''
+	Returns (gymnast index, meet index) for this process. The indexes are built the first time they're needed, and
+	rebuilt when the data generation changes.
+	'''
+	generation = get_generation()
+	if _index['generation'] != generation:
+		with _lock:
+			if _index['generation'] != generation:
+				# Gymnasts are ranked alphabetically, and meets are ranked in their usual order (most recent first)
+				gymnast_names = sorted(Gymnast.objects.values_list('name', flat=True), key=normalize_name)
+				meet_names = list(Meet.objects.values_list('name', flat=True))
+				_index['gymnasts'] = PrefixIndex(gymnast_names)
+				_index['meets'] = PrefixIndex(meet_names)
+				_index['generation'] = generation
+	return _index['gymnasts'], _index['meets']
+
+
+def search_names(prefix, include_meets=True, limit=AUTOCOMPLETE_LIMIT):
+	''' Returns gymnast names (and then meet names) that start with prefix, ignoring case'''
+	gymnast_index, meet_index = get_name_indexes()
+	names = gymnast_index.search(prefix, limit)
+	if include_meets:
+		names = names + meet_index.search(prefix, limit)
+	return names
@@ -0,0 +1,88 @@
+from functools import wraps
+from hashlib import md5
+from django.core.cache import cache
+from django.views.decorators.http import condition
+from .generation import get_generation
+
+# **************************
+# Whole-page cache and conditional GETs for the score pages, keyed on the data generation
+# **************************
+# Rendered pages are stored under (URL, generation). When an ingest or cleanup command bumps the generation, every
+# page gets a new key, so nothing has to be purged by hand. Entries for old generations just expire.
+
+PAGE_CACHE_SECONDS = 60*60*24
+PAGE_CACHE_HITS_KEY = "scoredata:page_cache:hits"
+PAGE_CACHE_MISSES_KEY = "scoredata:page_cache:misses"
+
+
+def _page_key(request, generation):
+	url = md5(request.build_absolute_uri().encode('utf-8')).hexdigest()
+	return "scoredata:page:{}:{}".format(generation, url)
+
+
+def _count(key):
+	cache.add(key, 0, None)
+	try:
+		cache.incr(key)
+	except ValueError:
+		# The counter was evicted between add() and incr()
+		cache.set(key, 1, None)
+
+
+def get_page_cache_stats():
+	''' Returns {'hits': ..., 'misses': ...} for the page cache'''
+	return {'hits': cache.get(PAGE_CACHE_HITS_KEY, 0), 'misses': cache.get(PAGE_CACHE_MISSES_KEY, 0)}
+
+
+def cache_by_generation(view_func):
+	''' Decorator that caches a view's successful GET responses until the data generation changes'''
+
+	@wraps(view_func)
+	def wrapped_view(request, *args, **kwargs):
+		if request.method not in ('GET', 'HEAD'):
+			return view_func(request, *args, **kwargs)
+
+		generation, _ = get_generation()
+		key = _page_key(request, generation)
+		response = cache.get(key)
+		if response is not None:
+			_count(PAGE_CACHE_HITS_KEY)
+			response['X-Page-Cache'] = "hit"
+			return response
+
+		_count(PAGE_CACHE_MISSES_KEY)
+		response = view_func(request, *args, **kwargs)
+		if response.status_code == 200 and not response.streaming:
+			# Template responses can only be stored once they've been rendered
+			if hasattr(response, 'render') and callable(response.render):
+				response.add_post_render_callback(lambda rendered: cache.set(key, rendered, PAGE_CACHE_SECONDS))
+			else:
+				cache.set(key, response, PAGE_CACHE_SECONDS)
+		response['X-Page-Cache'] = "miss"
+		return response
+
+	return wrapped_view
+
+
+# **************************
+# ETag / Last-Modified headers
+# **************************
+
+def generation_etag(request, *args, **kwargs):
+	'''
+	Strong ETag built from the data generation, the time of the last ingest, the object id and the path (so that the
+	HTML and JSON versions of a meet, or different pages of the meet list, don't share a tag)
+	'''
+	generation, updated = get_generation()
+	stamp = updated.strftime("%Y%m%d%H%M%S%f") if updated is not None else "0"
+	path = md5(request.get_full_path().encode('utf-8')).hexdigest()[:8]
+	return "{}-{}-{}-{}".format(generation, stamp, kwargs.get('pk', ''), path)
+
+
+def generation_last_modified(request, *args, **kwargs):
+	_, updated = get_generation()
+	return updated
+
+
+# Answers If-None-Match / If-Modified-Since with a 304 before the view (or the page cache) does any work
+conditional_on_generation = condition(etag_func=generation_etag, last_modified_func=generation_last_modified)
@@ -0,0 +1,67 @@
+from .models import Score
+
+# **************************
+# Score matrix for a single gymnast
+# **************************
+
+# Columns of the score tables, in the order they are displayed: VT1, VT2, UB, BB, FX
+SCORE_COLUMNS = [("VT", 1), ("VT", 2), ("UB", 1), ("BB", 1), ("FX", 1)]
+
+
+def clean_d_score(d_score):
+	''' Returns None for d scores that are missing (stored as null or NaN)'''
+	if d_score is None or d_score != d_score:
+		return None
+	return d_score
+
+
+def gymnast_score_matrix(gymnast):
+	'''
+	Returns (scores_to_display, d_scores_to_display) for a gymnast.
+
+	Each row is [meet, meet_day, VT1, VT2, UB, BB, FX] (plus AA for the totals table), built from a
+	single query over all of the gymnast's scores rather than one query per table cell.
+	'''
+
+	# Pivot every score for this gymnast into {meet id: {meet day: {(event, score num): score}}}
+	scores = Score.objects.filter(gymnast=gymnast).select_related('meet', 'event').order_by('id')
+	meets = {}
+	cells = {}
+	for score in scores:
+		meets[score.meet_id] = score.meet
+		days = cells.setdefault(score.meet_id, {})
+		days.setdefault(score.meet_day, {})[(score.event.name, score.score_num)] = score
+
+	scores_to_display = []
+	d_scores_to_display = []
+	for meet_id, days in cells.items():
+		meet = meets[meet_id]
+		for day, day_scores in days.items():
+			this_meet_info = [meet, day]
+			this_meet_info_d = [meet, day]
+			# Add the VT1, VT2, UB, BB, FX scores to the list
+			any_d = False
+			for column in SCORE_COLUMNS:
+				score = day_scores.get(column)
+				if score is None:
+					this_meet_info.append("-")
+					this_meet_info_d.append(None)
+					continue
+				d_score = clean_d_score(score.d_score)
+				this_meet_info.append(score.score)
+				this_meet_info_d.append(d_score)
+				# Mark if there's any d scores for this meet
+				if d_score is not None:
+					any_d = True
+			# Calculate AA score if applicable
+			aa_scores = [this_meet_info[2], this_meet_info[4], this_meet_info[5], this_meet_info[6]]
+			if day != "EF" and all(isinstance(score, float) for score in aa_scores):
+				this_meet_info.append(sum(aa_scores))
+			else:
+				this_meet_info.append("-")
+			scores_to_display.append(this_meet_info)
+			# Only add this meet day to the d score table if there was any d score data
+			if any_d:
+				d_scores_to_display.append(this_meet_info_d)
+
+	return scores_to_display, d_scores_to_display
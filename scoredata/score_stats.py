@@ -0,0 +1,140 @@
+import datetime
+from django.db import transaction
+from .models import Meet, Score, GymnastEventStats
+from .score_summaries import get_date_range, get_year_stats
+from .snapshot import get_snapshot
+
+# **************************
+# Precomputed statistics for each gymnast, event and time window
+# **************************
+# Only the windows that start on a fixed date are precomputed. The "past year" moves every day, so stats folded in at
+# ingest would go stale; it's worked out from the scores when it's read (see get_year_stats).
+
+WINDOWS = [window for window, _ in GymnastEventStats.window_opts]
+STATS_FIELDS = ["count", "mean", "max_score", "e_count", "e_mean", "e_m2", "last_updated"]
+
+
+def _as_date(value):
+	if isinstance(value, datetime.datetime):
+		return value.date()
+	return value
+
+
+def get_window_ranges():
+	''' Returns {window: (start date, end date)} for each of the stats windows, as of today'''
+	ranges = {}
+	for window in WINDOWS:
+		start, end = get_date_range(window)
+		ranges[window] = (_as_date(start), _as_date(end))
+	return ranges
+
+
+def _windows_for_date(date, window_ranges):
+	if date is None:
+		return []
+	return [window for window, (start, end) in window_ranges.items() if start <= date <= end]
+
+
+def _chunks(items, size=500):
+	items = list(items)
+	for i in range(0, len(items), size):
+		yield items[i:i+size]
+
+
+def _fold_rows(rows, existing):
+	'''
+	Adds rows of (gymnast id, event, score num, meet start date, score, d score) to the stats in existing,
+	which is a dict keyed by (gymnast id, event, score num, window). Returns (new stats objects, existing stats
+	objects that were updated).
+	'''
+	window_ranges = get_window_ranges()
+	new_stats = []
+	updated_keys = set()
+	for gymnast_id, event, score_num, start_date, score, d_score in rows:
+		for window in _windows_for_date(start_date, window_ranges):
+			key = (gymnast_id, event, score_num, window)
+			stats = existing.get(key)
+			if stats is None:
+				stats = GymnastEventStats(gymnast_id=gymnast_id, event=event, score_num=score_num, window=window)
+				existing[key] = stats
+				new_stats.append(stats)
+			else:
+				updated_keys.add(key)
+			stats.add_score(score, d_score)
+	new_keys = set((stats.gymnast_id, stats.event, stats.score_num, stats.window) for stats in new_stats)
+	return new_stats, [existing[key] for key in updated_keys - new_keys]
+
+
+def update_stats(scores):
+	'''
+	Folds newly loaded scores into the precomputed statistics. scores is a list of saved Score objects with their
+	event already attached, as they are when the populate_scores commands create them.
+	'''
+	if len(scores) == 0:
+		return
+	# Look up the meet dates again, since some meets only get their dates after their scores are loaded
+	meet_dates = {}
+	for meet_ids in _chunks(set(score.meet_id for score in scores)):
+		meet_dates.update(Meet.objects.filter(id__in=meet_ids).values_list('id', 'start_date'))
+	rows = [(score.gymnast_id, score.event.name, score.score_num, meet_dates.get(score.meet_id), score.score, score.d_score) for score in scores]
+
+	# Load the existing stats for every gymnast with new scores
+	existing = {}
+	for gymnast_ids in _chunks(set(row[0] for row in rows)):
+		for stats in GymnastEventStats.objects.filter(gymnast__in=gymnast_ids):
+			existing[(stats.gymnast_id, stats.event, stats.score_num, stats.window)] = stats
+
+	new_stats, updated_stats = _fold_rows(rows, existing)
+	with transaction.atomic():
+		GymnastEventStats.objects.bulk_create(new_stats, batch_size=500)
+		GymnastEventStats.objects.bulk_update(updated_stats, STATS_FIELDS, batch_size=500)
+
+
+def rebuild_stats():
+	'''
+	Regenerates all of the precomputed statistics from the scores table. Run it after any large data cleanup.
+	'''
+	rows = Score.objects.values_list('gymnast_id', 'event__name', 'score_num', 'meet__start_date', 'score', 'd_score')
+	new_stats, _ = _fold_rows(rows.iterator(), {})
+	with transaction.atomic():
+		GymnastEventStats.objects.all().delete()
+		GymnastEventStats.objects.bulk_create(new_stats, batch_size=500)
+	return len(new_stats)
+
+
+def rebuild_gymnast_stats(gymnast_ids):
+	'''
+	Regenerates the precomputed statistics for some gymnasts from their scores. Used when scores have been corrected
+	or deleted, which update_stats can't fold in.
+	'''
+	for chunk in _chunks(gymnast_ids):
+		rows = Score.objects.filter(gymnast__in=chunk).values_list('gymnast_id', 'event__name', 'score_num', 'meet__start_date', 'score', 'd_score')
+		new_stats, _ = _fold_rows(rows, {})
+		with transaction.atomic():
+			GymnastEventStats.objects.filter(gymnast__in=chunk).delete()
+			GymnastEventStats.objects.bulk_create(new_stats, batch_size=500)
+
+
+def get_consistency(gymnast):
+	'''
+	Returns the consistency stats shown on a gymnast's page: the standard deviation of their execution scores on
+	each event over the past year, plus an overall average that leaves out the second vault.
+	'''
+	snapshot = get_snapshot()
+	if snapshot is not None:
+		start, end = get_date_range("year")
+		e_stds = snapshot.summarize(snapshot.select(gymnast_ids=[gymnast.id], start=start, end=end), "std", column="e_score", min_count=2)
+	else:
+		e_stds = {key: stats.e_std for key, stats in get_year_stats([gymnast]).items() if stats.e_count > 1}
+	consistency = {}
+	for (_, event, score_num), e_std in e_stds.items():
+		if event == "VT":
+			consistency["VT" + str(score_num)] = e_std
+		else:
+			consistency[event] = e_std
+	if consistency != {}:
+		if "VT2" in consistency:
+			consistency["total"] = float((sum(consistency.values()) - consistency["VT2"])/(len(consistency)-1))
+		else:
+			consistency["total"] = float(sum(consistency.values())) / len(consistency)
+	return consistency
@@ -0,0 +1,68 @@
+import datetime
+from dateutil.relativedelta import relativedelta
+from .models import Gymnast, Score, GymnastEventStats
+from .snapshot import get_snapshot
+
+# **************************
+# Summary statistics for groups of gymnasts
+# **************************
+
+
+def get_date_range(time):
+	''' Converts the "time" option from the score selector and team tester forms into a date range'''
+	now = datetime.datetime.now()
+	if time == "year":
+		return [now-relativedelta(years=1), now]
+	elif time == "season":
+		return [datetime.date(2019, 10, 13), now] # Since last world championships
+	else:
+		return [datetime.date(2016, 8, 21), now] # Since last olympics
+
+
+def get_gymnasts_by_name(names):
+	'''
+	Looks up a list of gymnast names in one query. Returns the gymnasts in the order of the names that
+	were given, skipping names that aren't in the database.
+	'''
+	gymnasts = {}
+	for gymnast in Gymnast.objects.filter(name__in=set(names)).select_related('country').order_by('name', 'id'):
+		gymnasts.setdefault(gymnast.name, gymnast)
+	return [gymnasts[name] for name in names if name in gymnasts]
+
+
+def get_year_stats(gymnasts, events=None):
+	'''
+	Works out the "past year" statistics from the scores, for when there is no snapshot. The year moves every day, so
+	unlike the other windows it isn't precomputed. Returns {(gymnast id, event, score num): unsaved GymnastEventStats}.
+	'''
+	start, end = get_date_range("year")
+	scores = Score.objects.filter(gymnast__in=gymnasts, meet__start_date__gte=start, meet__start_date__lte=end)
+	if events is not None:
+		scores = scores.filter(event__name__in=events)
+	stats = {}
+	for gymnast_id, event, score_num, score, d_score in scores.values_list('gymnast_id', 'event__name', 'score_num', 'score', 'd_score').iterator():
+		key = (gymnast_id, event, score_num)
+		if key not in stats:
+			stats[key] = GymnastEventStats(gymnast_id=gymnast_id, event=event, score_num=score_num, window="year")
+		stats[key].add_score(score, d_score)
+	return stats
+
+
+def summarize_scores(gymnasts, time, sumstat, events=None):
+	'''
+	Returns {(gymnast id, event, score num): summary statistic} for every group with scores in the time window.
+	sumstat is "avg" or "max". The statistics come from the score snapshot if it's up to date, and otherwise from the
+	precomputed GymnastEventStats table (or, for the past year, from the scores).
+	'''
+	snapshot = get_snapshot()
+	if snapshot is not None:
+		start, end = get_date_range(time)
+		rows = snapshot.select(gymnast_ids=[gymnast.id for gymnast in gymnasts], events=events, start=start, end=end)
+		return snapshot.summarize(rows, "max" if sumstat == "max" else "avg")
+	if time == "year":
+		stats = [group for group in get_year_stats(gymnasts, events).values() if group.count > 0]
+	else:
+		stats = GymnastEventStats.objects.filter(gymnast__in=gymnasts, window="season" if time == "season" else "quad", count__gt=0)
+		if events is not None:
+			stats = stats.filter(event__in=events)
+	return {(group.gymnast_id, group.event, group.score_num): group.get_sumstat(sumstat) for group in stats}
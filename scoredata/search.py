@@ -0,0 +1,190 @@
+import re
+from collections import namedtuple
+from django.db import connection, connections, transaction, DatabaseError, DEFAULT_DB_ALIAS
+from django.urls import reverse
+from .models import Gymnast, Meet, Post
+
+# **************************
+# Full-text search over gymnast names, meet names and blog post titles
+# **************************
+# On SQLite the names are copied into an FTS5 virtual table, which is kept in sync by the save/delete signals and
+# rebuilt at the end of each ingest. On Postgres the base tables are searched directly using pg_trgm indexes. Any
+# other database falls back to icontains queries. The table and indexes are created right after migrate runs, so
+# requests and signals only ever read or write rows.
+
+SEARCH_TABLE = "scoredata_search"
+SEARCH_LIMIT = 50
+
+SearchResult = namedtuple('SearchResult', ['kind', 'object_id', 'title', 'url'])
+
+# The models that are searched, and the field that holds each one's searchable name
+SEARCH_MODELS = {
+	'gymnast': (Gymnast, 'name', 'gymnast-detail'),
+	'meet': (Meet, 'name', 'meet-detail'),
+	'post': (Post, 'title', 'post-detail'),
+}
+
+_state = {'ready': False, 'fts': False, 'trigram': False}
+
+
+def _vendor(using=DEFAULT_DB_ALIAS):
+	return connections[using].vendor
+
+
+def _trigram_index_name(model, field):
+	return "{}_{}_trgm".format(model._meta.db_table, field)
+
+
+def create_search_index(using=DEFAULT_DB_ALIAS):
+	'''
+	Creates the FTS5 table (SQLite) or the trigram indexes (Postgres) if they don't exist yet, and fills a new FTS5
+	table. This is the only place the search index's schema is changed: it runs after migrate (see apps.py), never
+	from a request or a signal.
+	'''
+	connection = connections[using]
+	# post_migrate is sent for every app, even when the scoredata tables haven't been created (e.g. migrate on a new
+	# database before makemigrations has been run for scoredata)
+	tables = connection.introspection.table_names()
+	if any(model._meta.db_table not in tables for model, _, _ in SEARCH_MODELS.values()):
+		return
+	created = False
+	with connection.cursor() as cursor:
+		if _vendor(using) == "sqlite":
+			cursor.execute("SELECT count(*) FROM sqlite_master WHERE name = %s", [SEARCH_TABLE])
+			if cursor.fetchone()[0] == 0:
+				try:
+					with transaction.atomic(using=using):
+						cursor.execute("CREATE VIRTUAL TABLE {} USING fts5(kind UNINDEXED, object_id UNINDEXED, title, tokenize = 'unicode61 remove_diacritics 2')".format(SEARCH_TABLE))
+					created = True
+				except DatabaseError:
+					# This SQLite build doesn't include FTS5
+					pass
+		elif _vendor(using) == "postgresql":
+			try:
+				with transaction.atomic(using=using):
+					cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+					for kind, (model, field, _) in SEARCH_MODELS.items():
+						cursor.execute("CREATE INDEX IF NOT EXISTS {} ON {} USING gin ({} gin_trgm_ops)".format(_trigram_index_name(model, field), model._meta.db_table, field))
+			except DatabaseError:
+				# The database user isn't allowed to install pg_trgm
+				pass
+	# Look again, with the new table or indexes
+	_state['ready'] = False
+	if created and using == DEFAULT_DB_ALIAS:
+		rebuild_search_index()
+
+
+def _search_state():
+	'''
+	Finds out (once per process, with read-only catalog queries) whether the FTS5 table or the trigram indexes exist
+	'''
+	if _state['ready']:
+		return _state
+	with connection.cursor() as cursor:
+		if _vendor() == "sqlite":
+			cursor.execute("SELECT count(*) FROM sqlite_master WHERE name = %s", [SEARCH_TABLE])
+			_state['fts'] = cursor.fetchone()[0] > 0
+		elif _vendor() == "postgresql":
+			names = [_trigram_index_name(model, field) for model, field, _ in SEARCH_MODELS.values()]
+			cursor.execute("SELECT count(*) FROM pg_indexes WHERE indexname = ANY(%s)", [names])
+			_state['trigram'] = cursor.fetchone()[0] == len(names)
+	_state['ready'] = True
+	return _state
+
+
+def rebuild_search_index():
+	''' Refills the FTS5 table from the gymnast, meet and post tables (only needed on SQLite)'''
+	if not _search_state()['fts']:
+		return
+	with connection.cursor() as cursor:
+		cursor.execute("DELETE FROM {}".format(SEARCH_TABLE))
+		for kind, (model, field, _) in SEARCH_MODELS.items():
+			rows = [(kind, str(pk), title) for pk, title in model.objects.values_list('pk', field).iterator()]
+			cursor.executemany("INSERT INTO {} (kind, object_id, title) VALUES (%s, %s, %s)".format(SEARCH_TABLE), rows)
+
+
+def index_object(kind, instance):
+	''' Adds or updates one gymnast, meet or post in the FTS5 table'''
+	if not _search_state()['fts']:
+		return
+	_, field, _ = SEARCH_MODELS[kind]
+	with connection.cursor() as cursor:
+		cursor.execute("DELETE FROM {} WHERE kind = %s AND object_id = %s".format(SEARCH_TABLE), [kind, str(instance.pk)])
+		cursor.execute("INSERT INTO {} (kind, object_id, title) VALUES (%s, %s, %s)".format(SEARCH_TABLE), [kind, str(instance.pk), getattr(instance, field)])
+
+
+def remove_object(kind, instance):
+	''' Removes one gymnast, meet or post from the FTS5 table'''
+	if not _search_state()['fts']:
+		return
+	with connection.cursor() as cursor:
+		cursor.execute("DELETE FROM {} WHERE kind = %s AND object_id = %s".format(SEARCH_TABLE), [kind, str(instance.pk)])
+
+
+def _make_result(kind, object_id, title):
+	return SearchResult(kind, object_id, title, reverse(SEARCH_MODELS[kind][2], args=[object_id]))
+
+
+def _search_fts(query, limit):
+	# Match every word in the query as a prefix, e.g. "simo bil" finds "Simone Biles"
+	words = re.findall(r"\w+", query)
+	if len(words) == 0:
+		return []
+	match = " ".join('"{}"*'.format(word) for word in words)
+	with connection.cursor() as cursor:
+		cursor.execute(
+			"SELECT kind, object_id, title FROM {0} WHERE {0} MATCH %s ORDER BY lower(title) = lower(%s) DESC, rank LIMIT %s".format(SEARCH_TABLE),
+			[match, query.strip(), limit])
+		return [_make_result(*row) for row in cursor.fetchall()]
+
+
+def _contains_pattern(query):
+	# An ILIKE pattern for names containing query, with LIKE's wildcards (and the escape character) in it escaped
+	return "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+def _search_trigram(query, limit):
+	selects = []
+	params = []
+	for kind, (model, field, _) in SEARCH_MODELS.items():
+		selects.append("SELECT %s AS kind, {1}::text AS object_id, {2} AS title, similarity({2}, %s) AS score FROM {0} WHERE {2} %% %s OR {2} ILIKE %s".format(
+			model._meta.db_table, model._meta.pk.column, field))
+		params += [kind, query, query, _contains_pattern(query)]
+	sql = " UNION ALL ".join(selects) + " ORDER BY score DESC LIMIT %s"
+	with connection.cursor() as cursor:
+		cursor.execute(sql, params + [limit])
+		return [_make_result(kind, object_id, title) for kind, object_id, title, _ in cursor.fetchall()]
+
+
+def _search_basic(query, limit):
+	results = []
+	for kind, (model, field, _) in SEARCH_MODELS.items():
+		for pk, title in model.objects.filter(**{field + "__icontains": query}).values_list('pk', field)[:limit]:
+			results.append(_make_result(kind, str(pk), title))
+	# Exact matches first, then names that start with the query
+	query = query.lower()
+	results.sort(key=lambda result: (result.title.lower() != query, not result.title.lower().startswith(query)))
+	return results[:limit]
+
+
+def search(query, limit=SEARCH_LIMIT):
+	''' Returns a ranked list of SearchResults for gymnasts, meets and posts matching the query'''
+	query = query.strip()
+	if query == "":
+		return []
+	state = _search_state()
+	if state['fts']:
+		return _search_fts(query, limit)
+	elif state['trigram']:
+		return _search_trigram(query, limit)
+	return _search_basic(query, limit)
+
+
+def unambiguous_result(query, results):
+	''' Returns the result to redirect to, if the search found exactly one match or exactly one exact match'''
+	if len(results) == 1:
+		return results[0]
+	exact = [result for result in results if result.title.strip().lower() == query.strip().lower()]
+	if len(exact) == 1:
+		return exact[0]
+	return None
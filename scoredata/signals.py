@@ -0,0 +1,72 @@
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from .models import Gymnast, Meet, Score, Post, Tag
+from .generation import bump_generation, bumps_deferred
+from .counters import adjust_counter
+from .search import index_object, remove_object
+from .tag_cloud import clear_tag_cloud
+
+# **************************
+# Keep the data generation up to date when the score data changes
+# **************************
+
+@receiver(post_save, sender=Gymnast)
+@receiver(post_delete, sender=Gymnast)
+@receiver(post_save, sender=Meet)
+@receiver(post_delete, sender=Meet)
+@receiver(post_save, sender=Score)
+@receiver(post_delete, sender=Score)
+def score_data_changed(sender, **kwargs):
+	bump_generation()
+
+
+# **************************
+# Keep the home page counters up to date
+# **************************
+
+COUNTER_FIELDS = {Score: 'num_scores', Gymnast: 'num_gymnasts', Meet: 'num_meets'}
+
+@receiver(post_save, sender=Gymnast)
+@receiver(post_save, sender=Meet)
+@receiver(post_save, sender=Score)
+def count_new_object(sender, created, **kwargs):
+	# The management commands recount everything at the end instead
+	if created and not bumps_deferred():
+		adjust_counter(COUNTER_FIELDS[sender], 1)
+
+@receiver(post_delete, sender=Gymnast)
+@receiver(post_delete, sender=Meet)
+@receiver(post_delete, sender=Score)
+def count_deleted_object(sender, **kwargs):
+	if not bumps_deferred():
+		adjust_counter(COUNTER_FIELDS[sender], -1)
+
+# **************************
+# Keep the search index up to date
+# **************************
+
+SEARCH_KINDS = {Gymnast: 'gymnast', Meet: 'meet', Post: 'post'}
+
+@receiver(post_save, sender=Gymnast)
+@receiver(post_save, sender=Meet)
+@receiver(post_save, sender=Post)
+def update_search_index(sender, instance, **kwargs):
+	index_object(SEARCH_KINDS[sender], instance)
+
+@receiver(post_delete, sender=Gymnast)
+@receiver(post_delete, sender=Meet)
+@receiver(post_delete, sender=Post)
+def remove_from_search_index(sender, instance, **kwargs):
+	remove_object(SEARCH_KINDS[sender], instance)
+
+# **************************
+# Clear the cached blog tag list when posts or tags change
+# **************************
+
+@receiver(m2m_changed, sender=Post.tag.through)
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def blog_tags_changed(sender, **kwargs):
+	clear_tag_cloud()
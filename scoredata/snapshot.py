@@ -0,0 +1,298 @@
+import os
+import json
+import uuid
+import shutil
+import logging
+import datetime
+import threading
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.db import connection
+from .models import Score, DataGeneration
+from .generation import get_generation
+
+# **************************
+# Read-only columnar snapshot of the scores table for the analytics pages
+# **************************
+# After each ingest, every score is written out as a set of .npy column files (one value per score), joined with its
+# meet date, event and gymnast's country. The rows are sorted by gymnast, event, score number and date, so each
+# gymnast's scores are one contiguous slice (found from the offsets column) and each (gymnast, event, score num)
+# group is one run inside it. Every web worker memory-maps the files read-only, so they share one copy through the
+# page cache, and the score selector, team tester and consistency stats are answered with numpy instead of queries.
+#
+# A snapshot is written for one data generation, in a directory named after it. Once anything changes the generation
+# (e.g. an edit in the admin), the snapshot is out of date and the callers read the database until the next snapshot
+# is written.
+#
+# The ingest, dedup and stats commands write the snapshot when they finish (and rebuild_score_snapshot writes it after
+# an edit in the admin). The directory is SCORE_SNAPSHOT_DIR. Where that isn't shared with the web processes (on
+# Heroku every dyno has its own filesystem), SCORE_SNAPSHOT_ON_DEMAND makes a process that finds no snapshot for the
+# current generation write one itself, in a background thread, and read the database until it's done. That costs a
+# copy of the scores table in the process, so it's off by default. A lock file makes the processes on one machine
+# take turns, so only one of them does the work.
+
+SNAPSHOT_VERSION = 1
+SNAPSHOT_EVENTS = ["VT", "UB", "BB", "FX"]
+# Row columns, and the gymnast columns (the gymnast ids, and where each gymnast's rows start and end)
+SNAPSHOT_COLUMNS = ["event", "junior", "score_num", "date", "score", "d_score", "country"]
+SNAPSHOT_GYMNAST_COLUMNS = ["gymnast_ids", "offsets"]
+SNAPSHOT_LOCK_NAME = "write.lock"
+
+logger = logging.getLogger(__name__)
+
+try:
+	import fcntl
+except ImportError:
+	# (Windows) Processes don't take turns, but each one still writes to its own temporary directory
+	fcntl = None
+
+
+def get_snapshot_dir():
+	return getattr(settings, 'SCORE_SNAPSHOT_DIR', os.path.join(settings.BASE_DIR, 'score_snapshot'))
+
+
+def _snapshot_path(snapshot_dir, generation):
+	return os.path.join(snapshot_dir, str(generation))
+
+
+def _to_date64(value):
+	if value is None:
+		return None
+	if isinstance(value, datetime.datetime):
+		value = value.date()
+	return np.datetime64(value, 'D')
+
+
+class ScoreSnapshot:
+	'''
+	One snapshot of the scores table, memory-mapped from path. select() finds the rows that match some filters, and
+	summarize() reduces them to one statistic per gymnast, event and score number.
+	'''
+
+	def __init__(self, path):
+		with open(os.path.join(path, "meta.json")) as meta_file:
+			self.meta = json.load(meta_file)
+		if self.meta.get("version") != SNAPSHOT_VERSION:
+			raise ValueError("{} has version {}, but version {} is expected".format(path, self.meta.get("version"), SNAPSHOT_VERSION))
+		self.generation = self.meta["generation"]
+		self.events = self.meta["events"]
+		# Empty files can't be memory-mapped, but then there's nothing to share anyway
+		mmap_mode = 'r' if self.meta["rows"] > 0 else None
+		for column in SNAPSHOT_COLUMNS + SNAPSHOT_GYMNAST_COLUMNS:
+			setattr(self, column, np.load(os.path.join(path, column + ".npy"), mmap_mode=mmap_mode))
+
+	def __len__(self):
+		return len(self.score)
+
+	def _gymnast_codes(self, gymnast_ids):
+		# Positions of the gymnasts in gymnast_ids (gymnasts without scores are left out)
+		keys = np.array([gymnast_id.bytes for gymnast_id in gymnast_ids], dtype="S16")
+		codes = np.searchsorted(self.gymnast_ids, keys)
+		found = codes < len(self.gymnast_ids)
+		found[found] = self.gymnast_ids[codes[found]] == keys[found]
+		return np.unique(codes[found])
+
+	def gymnast_ids_at(self, positions):
+		''' The ids of the gymnasts at positions (as returned by reduce())'''
+		# numpy drops trailing zero bytes from fixed-length byte strings
+		return [uuid.UUID(bytes=key.ljust(16, b"\0")) for key in self.gymnast_ids[positions]]
+
+	def select(self, gymnast_ids=None, events=None, score_num=None, start=None, end=None, junior=None, countries=None):
+		'''
+		Returns the positions (in ascending order) of the scores that match every filter that is given: gymnasts (a
+		list of ids), events (a list of names), score num, meet dates from start to end (inclusive; scores from meets
+		without dates are left out when either is given), junior, and countries (a list of ids).
+		'''
+		if gymnast_ids is None:
+			rows = np.arange(len(self))
+		else:
+			codes = self._gymnast_codes(gymnast_ids)
+			starts, ends = self.offsets[codes], self.offsets[codes + 1]
+			rows = np.concatenate([np.arange(row_start, row_end) for row_start, row_end in zip(starts, ends)] + [np.zeros(0, dtype=np.int64)])
+		keep = np.ones(len(rows), dtype=bool)
+		if events is not None:
+			keep &= np.isin(self.event[rows], [self.events.index(event) for event in events if event in self.events])
+		if score_num is not None:
+			keep &= self.score_num[rows] == score_num
+		if start is not None or end is not None:
+			dates = self.date[rows]
+			keep &= ~np.isnat(dates)
+			if start is not None:
+				keep &= dates >= _to_date64(start)
+			if end is not None:
+				keep &= dates <= _to_date64(end)
+		if junior is not None:
+			keep &= self.junior[rows] == junior
+		if countries is not None:
+			keep &= np.isin(self.country[rows], list(countries))
+		return rows[keep]
+
+	def values(self, rows, column="score"):
+		''' The scores ("score"), d scores ("d_score") or execution scores ("e_score") at rows, with NaN where missing'''
+		if column == "e_score":
+			return self.score[rows] - self.d_score[rows]
+		return np.asarray(getattr(self, column)[rows])
+
+	def reduce(self, rows, sumstat, column="score", min_count=1):
+		'''
+		Reduces the values of column at rows (as returned by select()) to one statistic per gymnast, event and score
+		num, leaving out missing values. sumstat is "avg", "max" or "std" (the population standard deviation). Groups
+		with fewer than min_count values are left out. Returns arrays of (gymnast positions, event codes, score nums,
+		statistics); gymnast_ids_at() turns the positions into ids.
+		'''
+		values = self.values(rows, column)
+		present = ~np.isnan(values)
+		rows, values = rows[present], values[present]
+		if len(rows) == 0:
+			return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int8), np.zeros(0, dtype=np.int8), np.zeros(0)
+		gymnasts = np.searchsorted(self.offsets, rows, side='right') - 1
+		events, score_nums = self.event[rows], self.score_num[rows]
+		# The rows are sorted by gymnast, event and score num, so each group is one run of rows
+		new_group = (np.diff(gymnasts) != 0) | (np.diff(events) != 0) | (np.diff(score_nums) != 0)
+		starts = np.concatenate(([0], np.flatnonzero(new_group) + 1))
+		counts = np.diff(np.append(starts, len(rows)))
+		if sumstat == "max":
+			results = np.maximum.reduceat(values, starts)
+		else:
+			results = np.add.reduceat(values, starts) / counts
+			if sumstat == "std":
+				deviations = values - np.repeat(results, counts)
+				results = np.sqrt(np.add.reduceat(deviations * deviations, starts) / counts)
+		enough = counts >= min_count
+		starts = starts[enough]
+		return gymnasts[starts], events[starts], score_nums[starts], results[enough]
+
+	def summarize(self, rows, sumstat, column="score", min_count=1):
+		''' Returns {(gymnast id, event, score num): statistic}, from reduce()'''
+		gymnasts, events, score_nums, results = self.reduce(rows, sumstat, column, min_count)
+		gymnast_ids = self.gymnast_ids_at(gymnasts)
+		return {(gymnast_id, self.events[event], int(score_num)): float(result) for gymnast_id, event, score_num, result in zip(gymnast_ids, events, score_nums, results)}
+
+
+def _read_scores():
+	# One query for every score, joined with everything the snapshot keeps
+	scores = pd.DataFrame.from_records(
+		Score.objects.values_list('gymnast_id', 'gymnast__country_id', 'event__name', 'event__junior', 'score_num', 'meet__start_date', 'score', 'd_score').iterator(),
+		columns=["gymnast", "country", "event", "junior", "score_num", "date", "score", "d_score"])
+	gymnast_ids, gymnast_codes = np.unique(np.array([gymnast_id.bytes for gymnast_id in scores.gymnast], dtype="S16"), return_inverse=True)
+	columns = {
+		"event": pd.Categorical(scores.event, categories=SNAPSHOT_EVENTS).codes.astype(np.int8),
+		"junior": scores.junior.to_numpy(dtype=bool),
+		"score_num": scores.score_num.to_numpy(dtype=np.int8),
+		"date": np.array([_to_date64(date) for date in scores.date], dtype="datetime64[D]"),
+		"score": pd.to_numeric(scores.score).to_numpy(dtype=np.float64),
+		"d_score": pd.to_numeric(scores.d_score).to_numpy(dtype=np.float64),
+		"country": scores.country.fillna(-1).to_numpy(dtype=np.int32),
+	}
+	gymnast_codes = gymnast_codes.reshape(-1)
+	order = np.lexsort((columns["date"], columns["score_num"], columns["event"], gymnast_codes))
+	columns = {column: values[order] for column, values in columns.items()}
+	columns["gymnast_ids"] = gymnast_ids
+	columns["offsets"] = np.concatenate(([0], np.cumsum(np.bincount(gymnast_codes, minlength=len(gymnast_ids))))).astype(np.int64)
+	return columns
+
+
+@contextmanager
+def _writer_lock(snapshot_dir, wait=True):
+	# Yields True once this process is the only one on the machine writing to snapshot_dir, or False if wait is False
+	# and another process is writing
+	os.makedirs(snapshot_dir, exist_ok=True)
+	with open(os.path.join(snapshot_dir, SNAPSHOT_LOCK_NAME), "w") as lock_file:
+		if fcntl is not None:
+			try:
+				fcntl.flock(lock_file, fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+			except BlockingIOError:
+				yield False
+				return
+		yield True
+
+
+def write_snapshot(snapshot_dir=None, wait=True):
+	'''
+	Writes a snapshot of the scores table for the current data generation, and removes the snapshots of older
+	generations. Returns the number of scores in it, or None if wait is False and another process is writing one.
+	'''
+	snapshot_dir = snapshot_dir or get_snapshot_dir()
+	with _writer_lock(snapshot_dir, wait) as locked:
+		if not locked:
+			return None
+		return _write_snapshot(snapshot_dir)
+
+
+def _write_snapshot(snapshot_dir):
+	# The generation is read before the scores, so that a change made in between makes the snapshot out of date
+	# rather than leaving it out
+	generation = DataGeneration.objects.filter(pk=1).values_list('generation', flat=True).first() or 0
+	columns = _read_scores()
+
+	# Written to a temporary directory and moved into place, so that a worker never opens half a snapshot
+	path = _snapshot_path(snapshot_dir, generation)
+	temp_path = "{}.{}.tmp".format(path, uuid.uuid4().hex)
+	os.makedirs(temp_path)
+	for column, values in columns.items():
+		np.save(os.path.join(temp_path, column + ".npy"), values)
+	meta = {'version': SNAPSHOT_VERSION, 'generation': generation, 'rows': len(columns["score"]), 'gymnasts': len(columns["gymnast_ids"]), 'events': SNAPSHOT_EVENTS, 'created': datetime.datetime.now().isoformat()}
+	with open(os.path.join(temp_path, "meta.json"), "w") as meta_file:
+		json.dump(meta, meta_file, indent=1)
+	shutil.rmtree(path, ignore_errors=True)
+	os.replace(temp_path, path)
+
+	# Workers that still have an older snapshot open keep reading it until they notice the new generation. (This
+	# also clears out the temporary directories of writers that were killed, since no other writer is running.)
+	for name in os.listdir(snapshot_dir):
+		if name not in (str(generation), SNAPSHOT_LOCK_NAME):
+			shutil.rmtree(os.path.join(snapshot_dir, name), ignore_errors=True)
+	return meta['rows']
+
+
+def open_snapshot(generation, snapshot_dir=None):
+	''' Returns the ScoreSnapshot for generation, or None if it hasn't been written'''
+	path = _snapshot_path(snapshot_dir or get_snapshot_dir(), generation)
+	if not os.path.exists(os.path.join(path, "meta.json")):
+		return None
+	return ScoreSnapshot(path)
+
+
+_lock = threading.Lock()
+_snapshot = {'generation': None, 'snapshot': None, 'writing': None}
+
+
+def _write_missing_snapshot():
+	try:
+		write_snapshot(wait=False)
+	except Exception:
+		logger.exception("Couldn't write the score snapshot")
+	finally:
+		# The thread's database connection isn't closed by the request cycle
+		connection.close()
+
+
+def _start_writing(generation):
+	# Starts a background write of the snapshot, once per generation per process (so a failed write isn't retried
+	# until the data changes). Called with _lock held.
+	if _snapshot['writing'] == generation:
+		return
+	_snapshot['writing'] = generation
+	threading.Thread(target=_write_missing_snapshot, name="write-score-snapshot", daemon=True).start()
+
+
+def get_snapshot():
+	'''
+	Returns the ScoreSnapshot for the current data generation in this process, or None if there isn't one (in which
+	case the callers read the database). A missing snapshot is written in the background if SCORE_SNAPSHOT_ON_DEMAND
+	is set, and is looked for again on the next call.
+	'''
+	generation = get_generation()[0]
+	if _snapshot['generation'] != generation:
+		with _lock:
+			if _snapshot['generation'] != generation:
+				snapshot = open_snapshot(generation)
+				if snapshot is None:
+					if getattr(settings, 'SCORE_SNAPSHOT_ON_DEMAND', False):
+						_start_writing(generation)
+					return None
+				_snapshot['snapshot'] = snapshot
+				_snapshot['generation'] = generation
+	return _snapshot['snapshot']
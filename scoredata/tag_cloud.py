@@ -0,0 +1,27 @@
+from django.core.cache import cache
+from django.db.models import Count
+from .models import Tag
+
+# **************************
+# Tag list with post counts for the blog sidebar
+# **************************
+
+TAG_CLOUD_CACHE_KEY = "scoredata:tag_cloud"
+# Without a shared cache backend every worker has its own copy, and the signals only clear the copy in the worker that
+# made the change, so the others pick up changes when their copy expires
+TAG_CLOUD_CACHE_SECONDS = 60*5
+
+
+def get_tag_cloud():
+	''' Returns a list of [tag, # of posts with that tag], sorted by # of posts (most first)'''
+	tags = cache.get(TAG_CLOUD_CACHE_KEY)
+	if tags is None:
+		tags = [[tag, tag.num_posts] for tag in Tag.objects.annotate(num_posts=Count('post'))]
+		tags = sorted(tags, key=lambda tup: tup[1], reverse=True)
+		# Kept until a post or tag changes (see signals.py), or for TAG_CLOUD_CACHE_SECONDS at most
+		cache.set(TAG_CLOUD_CACHE_KEY, tags, TAG_CLOUD_CACHE_SECONDS)
+	return tags
+
+
+def clear_tag_cloud():
+	cache.delete(TAG_CLOUD_CACHE_KEY)
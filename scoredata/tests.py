@@ -1,3 +1,806 @@
-from django.test import TestCase
+import io
+import os
+import json
+import contextlib
+import datetime
+import tempfile
+from unittest import mock
+import numpy as np
+import pandas as pd
+from django.db.models import Avg, Max
+from django.contrib.admin import site
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from .models import Country, Gymnast, Meet, Event, Score, DataGeneration, GymnastEventStats, SiteCounters
+from .admin import ScoreDataAdmin
+from .dedup import GymnastRecord, normalize_gymnast_name, find_duplicates
+from .validation import find_problems, validate_scores
+from .fetch import SourceFetcher, SourceNotCached
+from .meet_names import MeetNameNormalizer, normalize_meet_names, read_meet_aliases, find_renamed_meets
+from .countries import country_name, country_code, read_country_aliases, CountryResolver
+from .lineups import best_lineups, unique_gymnasts
+from .snapshot import write_snapshot, open_snapshot, get_snapshot
+from .score_stats import rebuild_stats, get_consistency
+from .management.commands.populate_scores_historic import Command as PopulateHistoricCommand
+from .score_summaries import summarize_scores
+from .search import create_search_index, _contains_pattern
+from .score_matrix import gymnast_score_matrix
+from .meet_tables import meet_score_tables, meet_tables_json
+from .meet_pages import get_meet_page, filter_meets, parse_cursor
+from .export import export_lines
+from .ingest import ScoreLoader
+from .leaderboards import get_leaderboard
 
-# Create your tests here.
+
+def gymnast(gymnast_id, name, country="USA", num_scores=1):
+	return GymnastRecord(gymnast_id, name, country, num_scores, normalize_gymnast_name(name))
+
+
+class ScoreDataMixin:
+	''' A few gymnasts, meets and scores, including a meet without a date, a missing score and a second vault'''
+
+	@classmethod
+	def setUpTestData(cls):
+		cls.usa = Country.objects.create(name="United States", iso3c="USA")
+		cls.chn = Country.objects.create(name="China", iso3c="CHN")
+		cls.events = {name: Event.objects.create(name=name, junior=False) for name in ["VT", "UB", "BB", "FX"]}
+		cls.ana = Gymnast.objects.create(name="Ana Perez", country=cls.usa)
+		cls.jade = Gymnast.objects.create(name="Jade Carey", country=cls.usa)
+		cls.li = Gymnast.objects.create(name="Li Wei", country=cls.chn)
+		cls.jesolo = Meet.objects.create(name="City of Jesolo Trophy (2019)", start_date=datetime.date(2019, 3, 16), end_date=datetime.date(2019, 3, 17))
+		cls.worlds = Meet.objects.create(name="World Championships (2019)", start_date=datetime.date(2019, 10, 4), end_date=datetime.date(2019, 10, 13))
+		cls.cup = Meet.objects.create(name="American Cup (2020)", start_date=datetime.date(2020, 2, 29), end_date=datetime.date(2020, 2, 29))
+		cls.undated = Meet.objects.create(name="Friendly (2019)")
+		cls.old = Meet.objects.create(name="Olympic Games (2012)", start_date=datetime.date(2012, 7, 28), end_date=datetime.date(2012, 8, 12))
+		rows = [
+			(cls.ana, cls.jesolo, "QF", "VT", 1, 14.0, 5.0), (cls.ana, cls.jesolo, "QF", "VT", 2, 13.5, 4.6),
+			(cls.ana, cls.jesolo, "QF", "UB", 1, 12.0, 4.8), (cls.ana, cls.jesolo, "QF", "BB", 1, 12.5, 5.1),
+			(cls.ana, cls.jesolo, "QF", "FX", 1, 13.0, 5.0), (cls.ana, cls.worlds, "QF", "VT", 1, 15.0, 5.4),
+			(cls.ana, cls.worlds, "QF", "UB", 1, None, None), (cls.ana, cls.worlds, "EF", "VT", 1, 14.5, 5.4),
+			(cls.ana, cls.undated, "", "UB", 1, 11.0, 4.0), (cls.ana, cls.old, "QF", "FX", 1, 15.5, 6.0),
+			(cls.jade, cls.worlds, "QF", "VT", 1, 14.9, 5.4), (cls.jade, cls.worlds, "QF", "VT", 2, 14.6, 5.2),
+			(cls.jade, cls.worlds, "QF", "UB", 1, 13.1, 5.0), (cls.jade, cls.worlds, "QF", "BB", 1, 12.9, 5.2),
+			(cls.jade, cls.worlds, "QF", "FX", 1, 14.2, 5.8), (cls.jade, cls.cup, "AA", "FX", 1, 13.8, 5.8),
+			(cls.li, cls.cup, "AA", "VT", 1, 13.9, 5.0), (cls.li, cls.cup, "AA", "UB", 1, 14.6, 6.1),
+			(cls.li, cls.cup, "AA", "BB", 1, 13.2, 5.5), (cls.li, cls.cup, "AA", "FX", 1, 12.7, 5.0),
+		]
+		for gymnast, meet, meet_day, event, score_num, score, d_score in rows:
+			Score.objects.create(gymnast=gymnast, meet=meet, meet_day=meet_day, event=cls.events[event], score_num=score_num, score=score, d_score=d_score)
+
+
+def grouped(groups):
+	# The ids in each DuplicateGroup, kept record first
+	return [[group.keep.id] + [duplicate.id for duplicate in group.duplicates] for group in groups]
+
+
+# **************************
+# Gymnast dedup
+# **************************
+
+class NormalizeGymnastNameTests(SimpleTestCase):
+
+	def test_accents_case_and_spacing(self):
+		self.assertEqual(normalize_gymnast_name("  Ana  PÉREZ "), "ana perez")
+		self.assertEqual(normalize_gymnast_name("Anastasiia Iliankova"), normalize_gymnast_name("Anastasia Iliánkova"))
+
+	def test_punctuation(self):
+		self.assertEqual(normalize_gymnast_name("Jade-Carey"), "jade carey")
+		self.assertEqual(normalize_gymnast_name("D’Amato"), "damato")
+
+	def test_transliterations(self):
+		self.assertEqual(normalize_gymnast_name("Søren Łukasz"), "soren lukasz")
+
+
+class FindDuplicatesTests(SimpleTestCase):
+
+	def test_same_normalized_name(self):
+		groups = find_duplicates([gymnast(1, "Ana Perez", num_scores=2), gymnast(2, "Ana Pérez", num_scores=5)])
+		self.assertEqual(grouped(groups), [[2, 1]])
+
+	def test_same_name_different_countries(self):
+		groups = find_duplicates([gymnast(1, "Ana Perez", "ESP"), gymnast(2, "Ana Pérez", "MEX")])
+		self.assertEqual(groups, [])
+
+	def test_same_name_same_meet(self):
+		# A typo on one day of a meet, e.g. in qualification but not in the event final
+		groups = find_duplicates([gymnast(1, "Ana Perez", "ESP", num_scores=2), gymnast(2, "Ana Pérez", "ESP")], scores={1: {(10, "QF", 1, 1)}, 2: {(10, "EF", 1, 1)}})
+		self.assertEqual(grouped(groups), [[1, 2]])
+
+	def test_same_name_same_day_and_event(self):
+		groups = find_duplicates([gymnast(1, "Ana Perez", "ESP"), gymnast(2, "Ana Pérez", "ESP")], scores={1: {(10, "QF", 1, 1)}, 2: {(10, "QF", 1, 1)}})
+		self.assertEqual(groups, [])
+
+	def test_same_name_guard_doesnt_block_other_records(self):
+		# The ESP record stays on its own, but the two MEX records are still combined
+		groups = find_duplicates([gymnast(1, "Ana Perez", "ESP"), gymnast(2, "Ana Pérez", "MEX", num_scores=2), gymnast(3, "ANA PEREZ", "MEX")])
+		self.assertEqual(grouped(groups), [[2, 3]])
+
+	def test_close_names(self):
+		groups = find_duplicates([gymnast(1, "Jordan Chiles", num_scores=3), gymnast(2, "Jordyn Chiles")], scores={1: {(10, "QF", 1, 1)}, 2: {(11, "QF", 1, 1)}})
+		self.assertEqual(grouped(groups), [[1, 2]])
+
+	def test_close_names_at_the_same_meet(self):
+		groups = find_duplicates([gymnast(1, "Jordan Chiles"), gymnast(2, "Jordyn Chiles")], scores={1: {(10, "QF", 1, 1)}, 2: {(10, "QF", 1, 1), (11, "QF", 1, 1)}})
+		self.assertEqual(groups, [])
+
+	def test_close_names_different_countries(self):
+		groups = find_duplicates([gymnast(1, "Jordan Chiles", "USA"), gymnast(2, "Jordyn Chiles", "CAN")])
+		self.assertEqual(groups, [])
+
+	def test_short_names_need_the_same_name(self):
+		groups = find_duplicates([gymnast(1, "Li Wei"), gymnast(2, "Li Wen")])
+		self.assertEqual(groups, [])
+
+	def test_no_merge_through_a_third_record(self):
+		# 1 and 3 both scored on the same day and event of a meet, so they can't both be combined with 2
+		records = [gymnast(1, "Jordan Chiles", num_scores=3), gymnast(2, "Jordyn Chiles", num_scores=2), gymnast(3, "Jordyn Chilés")]
+		groups = find_duplicates(records, scores={1: {(10, "QF", 1, 1)}, 2: {(11, "QF", 1, 1)}, 3: {(10, "QF", 1, 1)}})
+		self.assertEqual(len(groups), 1)
+		group_ids = set(grouped(groups)[0])
+		self.assertEqual(len(group_ids), 2)
+		self.assertFalse({1, 3} <= group_ids)
+
+	def test_kept_record_has_the_most_scores(self):
+		groups = find_duplicates([gymnast(1, "Simone Biles", num_scores=1), gymnast(2, "Simone Bilés", num_scores=9), gymnast(3, "SIMONE BILES", num_scores=4)])
+		self.assertEqual(grouped(groups), [[2, 3, 1]])
+
+
+# **************************
+# Score sheet validation
+# **************************
+
+def score_row(**values):
+	# One row of a cleaned score sheet that passes every check, with values changed
+	row = {"gymnast": "Ana Perez", "country": "Chinese Taipei", "meet_name": "City of Jesolo Trophy (2018)", "meet_day": "QF",
+		"start_date": "Mar 17 2018", "end_date": "Mar 18 2018", "vt1": "14.5", "vt1_d": "5.4", "vt2": "14.1", "vt2_d": "5.0",
+		"ub": "13.9", "ub_d": "5.8", "bb": "13.2", "bb_d": "5.6", "fx": "12.8", "fx_d": "5.2"}
+	row.update(values)
+	return row
+
+
+class ValidationTests(SimpleTestCase):
+
+	def problems(self, *rows):
+		return list(find_problems(pd.DataFrame(rows)))
+
+	def test_valid_row(self):
+		self.assertEqual(self.problems(score_row()), [""])
+
+	def test_missing_scores_are_allowed(self):
+		self.assertEqual(self.problems(score_row(vt2=None, vt2_d="", country="")), [""])
+
+	def test_bad_values(self):
+		problems = self.problems(score_row(ub_d=".4.3"), score_row(bb="25"), score_row(fx_d="13.5"), score_row(meet_day="XX"), score_row(gymnast=" "), score_row(country="Atlantis"), score_row(start_date="2018-03-17"))
+		self.assertEqual(problems, ["ub_d is not a number", "bb is not between 0 and 20", "fx_d is more than fx", "unknown meet day", "no gymnast", "unknown country", "start_date is not a date"])
+
+	def test_several_reasons(self):
+		self.assertEqual(self.problems(score_row(vt1="abc", meet_name="nan (2018)")), ["vt1 is not a number; no meet name"])
+
+	def test_vault_average(self):
+		# The 2017 and 2018 seasons work out vt2 from vt1 and vt_avg
+		problems = self.problems(score_row(vt_avg="14.3"), score_row(vt_avg="14.35"), score_row(vt1=None, vt2=None, vt_avg="14.3"), score_row(vt1="14.5", vt2="-0.5", vt2_d=None, vt_avg="7"), score_row(vt_avg="n/a"), score_row(vt2=None, vt2_d=None, vt_avg=None))
+		self.assertEqual(problems, ["", "vt_avg doesn't match vt1 and vt2", "vt_avg doesn't match vt1 and vt2", "vt2 is not between 0 and 20; vt_avg doesn't match vt1 and vt2", "vt_avg is not a number", ""])
+
+	def test_quarantine(self):
+		with tempfile.TemporaryDirectory() as quarantine_dir:
+			scores = pd.DataFrame([score_row(), score_row(gymnast="Jade Carey", ub="abc")])
+			valid = validate_scores(scores, "2018", quarantine_dir=quarantine_dir)
+			self.assertEqual(list(valid.gymnast), ["Ana Perez"])
+			quarantined = pd.read_csv(os.path.join(quarantine_dir, "2018.csv"), dtype=str)
+			self.assertEqual(list(quarantined.gymnast), ["Jade Carey"])
+			# The row is written as it was read
+			self.assertEqual(list(quarantined.ub), ["abc"])
+			self.assertEqual(list(quarantined.reasons), ["ub is not a number"])
+			# Once every row passes, the file is removed
+			validate_scores(valid, "2018", quarantine_dir=quarantine_dir)
+			self.assertFalse(os.path.exists(os.path.join(quarantine_dir, "2018.csv")))
+
+
+# **************************
+# Source file cache
+# **************************
+
+SHEET_URL = "https://docs.google.com/spreadsheets/d/example/export?format=csv"
+CALENDAR_URL = "https://thegymter.net/example-calendar/"
+
+
+def fake_download(url, timeout=None):
+	response = mock.Mock()
+	response.content = {SHEET_URL: b"gymnast,vt1\nAna Perez,14.5\n", CALENDAR_URL: "<p>Jesolo – Mar 17</p>".encode("utf-8")}[url]
+	return response
+
+
+class SourceFetcherTests(SimpleTestCase):
+
+	def setUp(self):
+		cache_dir = tempfile.TemporaryDirectory()
+		self.addCleanup(cache_dir.cleanup)
+		self.cache_dir = cache_dir.name
+
+	def download(self, urls):
+		with mock.patch("scoredata.fetch.requests.get", side_effect=fake_download):
+			SourceFetcher(cache_dir=self.cache_dir).fetch_all(urls)
+
+	def test_offline_reads_the_cache(self):
+		self.download([SHEET_URL, CALENDAR_URL])
+		with mock.patch("scoredata.fetch.requests.get", side_effect=AssertionError("downloaded while offline")):
+			sources = SourceFetcher(cache_dir=self.cache_dir, offline=True)
+			sources.fetch_all([SHEET_URL, CALENDAR_URL])
+			self.assertEqual(sources.get_text(CALENDAR_URL), "<p>Jesolo – Mar 17</p>")
+			self.assertEqual(list(sources.read_csv(SHEET_URL).vt1), [14.5])
+
+	def test_offline_without_a_download(self):
+		self.download([SHEET_URL])
+		sources = SourceFetcher(cache_dir=self.cache_dir, offline=True)
+		with self.assertRaises(SourceNotCached):
+			sources.get(CALENDAR_URL)
+
+	def test_cache_is_content_addressed(self):
+		self.download([SHEET_URL, CALENDAR_URL])
+		self.download([SHEET_URL])
+		with open(os.path.join(self.cache_dir, "index.json")) as index_file:
+			self.assertEqual(sorted(json.load(index_file)), [SHEET_URL, CALENDAR_URL])
+		# Downloading the same file again doesn't store a second copy
+		self.assertEqual(len(os.listdir(os.path.join(self.cache_dir, "objects"))), 2)
+
+
+# **************************
+# Meet name aliases
+# **************************
+
+class MeetNameTests(SimpleTestCase):
+
+	def test_aliases(self):
+		normalize = MeetNameNormalizer([("Euros", "European Championships", False), ("Champs", "Championships", False), ("Worlds", "World Championships", True)])
+		self.assertEqual(normalize("Euros QF"), "European Championships QF")
+		self.assertEqual(normalize("U.S. Champs"), "U.S. Championships")
+		# Full names are left alone, and aliases only match whole words
+		self.assertEqual(normalize("European Championships"), "European Championships")
+		self.assertEqual(normalize("Eurosport Cup"), "Eurosport Cup")
+		# Exact aliases only match the whole name
+		self.assertEqual(normalize(" Worlds "), "World Championships")
+		self.assertEqual(normalize("Worlds Trials"), "Worlds Trials")
+
+	def test_season_aliases(self):
+		names = pd.Series(["Jesolo", "City of Jesolo Trophy", None, "Jesolo"])
+		self.assertEqual(list(normalize_meet_names(names, "2017").fillna("")), ["City of Jesolo Trophy", "City of Jesolo Trophy", "", "City of Jesolo Trophy"])
+		# Seasons without aliases are unchanged
+		self.assertEqual(list(normalize_meet_names(names, "1999").fillna("")), ["Jesolo", "City of Jesolo Trophy", "", "Jesolo"])
+
+	def test_alias_file_version(self):
+		with tempfile.TemporaryDirectory() as directory:
+			path = os.path.join(directory, "meet_aliases.json")
+			with open(path, "w") as alias_file:
+				json.dump({"version": 0, "seasons": {}}, alias_file)
+			with self.assertRaises(ValueError):
+				read_meet_aliases(path)
+
+	def test_renamed_meets(self):
+		renamed, ambiguous = find_renamed_meets(["Baku World Cup World Cup", "City of City of Jesolo Trophy Trophy", "City of Jesolo Trophy", "France Top 12 Championships Championships"], "2017")
+		self.assertEqual(renamed, {"Baku World Cup World Cup": "Baku World Cup", "City of City of Jesolo Trophy Trophy": "City of Jesolo Trophy"})
+		# "France Top 12" and "France Top 12 Champs" both came out like this, and are now cleaned differently
+		self.assertEqual(ambiguous, {"France Top 12 Championships Championships"})
+		# The spreadsheet names decide
+		renamed, ambiguous = find_renamed_meets(["France Top 12 Championships Championships"], "2017", sheet_names={"France Top 12 Championships ", "Jesolo"})
+		self.assertEqual(renamed, {"France Top 12 Championships Championships": "France Top 12 Championships"})
+		self.assertEqual(ambiguous, set())
+
+
+class RenameMeetsTests(TestCase):
+
+	def test_rename_and_merge(self):
+		usa = Country.objects.create(name="United States", iso3c="USA")
+		vault = Event.objects.create(name="VT", junior=False)
+		ana = Gymnast.objects.create(name="Ana Perez", country=usa)
+		baku = Meet.objects.create(name="Baku World Cup World Cup (2017)", start_date=datetime.date(2017, 3, 16))
+		doubled = Meet.objects.create(name="City of City of Jesolo Trophy Trophy (2017)", start_date=datetime.date(2017, 4, 8))
+		jesolo = Meet.objects.create(name="City of Jesolo Trophy (2017)")
+		Score.objects.create(gymnast=ana, meet=baku, meet_day="EF", event=vault, score_num=1, score=14.0)
+		Score.objects.create(gymnast=ana, meet=doubled, meet_day="QF", event=vault, score_num=1, score=13.5)
+		Score.objects.create(gymnast=ana, meet=doubled, meet_day="EF", event=vault, score_num=1, score=13.8)
+		Score.objects.create(gymnast=ana, meet=jesolo, meet_day="QF", event=vault, score_num=1, score=13.5)
+		with mock.patch("scoredata.management.commands.rename_meets.write_snapshot"), contextlib.redirect_stdout(io.StringIO()):
+			call_command("rename_meets", "--no-sheet")
+		self.assertEqual(Meet.objects.get(id=baku.id).name, "Baku World Cup (2017)")
+		# The doubled meet is merged into the one that already has the new name, without the score both have
+		self.assertFalse(Meet.objects.filter(id=doubled.id).exists())
+		self.assertEqual(sorted(Score.objects.filter(meet=jesolo).values_list('meet_day', flat=True)), ["EF", "QF"])
+		self.assertEqual(Meet.objects.get(id=jesolo.id).start_date, datetime.date(2017, 4, 8))
+
+
+# **************************
+# Country names
+# **************************
+
+class CountryTests(TestCase):
+
+	def test_country_names(self):
+		self.assertEqual(country_name(" Chinese Taipei "), "Taiwan")
+		self.assertEqual(country_name("Japan"), "Japan")
+		self.assertEqual(country_code("Chinese Taipei"), "TWN")
+		self.assertIsNone(country_code("Atlantis"))
+
+	def test_alias_file_version(self):
+		with tempfile.TemporaryDirectory() as directory:
+			path = os.path.join(directory, "country_aliases.json")
+			with open(path, "w") as alias_file:
+				json.dump({"version": 0, "aliases": {}, "codes": {}}, alias_file)
+			with self.assertRaises(ValueError):
+				read_country_aliases(path)
+
+	def test_resolver(self):
+		existing = Country.objects.create(name="Taiwan", iso3c="TWN")
+		resolver = CountryResolver()
+		resolver.add(["Chinese Taipei", "Taiwan", None, "Atlantis", "Japan"])
+		# Only Japan is new, and names that aren't countries are skipped
+		self.assertEqual(sorted(Country.objects.values_list('name', 'iso3c')), [("Japan", "JPN"), ("Taiwan", "TWN")])
+		self.assertEqual(resolver.get_id("Chinese Taipei"), existing.id)
+		self.assertEqual(resolver.get_id("Japan"), Country.objects.get(name="Japan").id)
+		self.assertIsNone(resolver.get_id("Atlantis"))
+		self.assertIsNone(resolver.get_id(None))
+
+
+# **************************
+# Team tester
+# **************************
+
+class LineupTests(SimpleTestCase):
+
+	# VT, UB, BB, FX for four gymnasts (the last one has no vault)
+	scores = np.array([
+		[15, 14, 13, 12],
+		[14, 15, 12, 13],
+		[13, 13, 15, 14],
+		[np.nan, 10, 10, 10],
+	])
+
+	def test_best_lineups(self):
+		# 3 up, 2 count: the best two scores of each line-up count on each apparatus, and a missing score is zero
+		lineups = best_lineups(self.scores, 3, 2, top_n=4)
+		self.assertEqual(lineups[0], ([0, 1, 2], [29, 29, 28, 27], 113))
+		self.assertEqual([total for _, _, total in lineups], [113, 109, 109, 108])
+		self.assertEqual(sorted(sorted(members) for members, _, _ in lineups[1:3]), [[0, 2, 3], [1, 2, 3]])
+
+	def test_top_n(self):
+		self.assertEqual([members for members, _, _ in best_lineups(self.scores, 3, 3, top_n=1)], [[0, 1, 2]])
+
+	def test_team_bigger_than_the_pool(self):
+		self.assertEqual(best_lineups(self.scores, 5, 3), [])
+
+	def test_too_many_lineups(self):
+		with self.assertRaises(ValueError):
+			best_lineups(np.zeros((40, 4)), 5, 3)
+
+	def test_unique_gymnasts(self):
+		ana, jade = GymnastRecord(1, "Ana Perez", "ESP", 1, ""), GymnastRecord(2, "Jade Carey", "USA", 1, "")
+		self.assertEqual(unique_gymnasts([ana, jade, ana]), [ana, jade])
+
+
+class TeamTesterTests(TestCase):
+
+	def test_invalid_options(self):
+		for options in [{}, {'team_size': "abc"}, {'team_size': "0"}, {'team_size': "5", 'scores_up': "x", 'scores_count': ""},
+				{'team_size': "5"}, {'team_size': "3", 'scores_up': "9", 'scores_count': "9", 'sumstat': "median", 'time': "decade"}]:
+			response = self.client.get(reverse('team_tester'), options)
+			self.assertEqual(response.status_code, 200, options)
+		# Scores counting and going up are kept between 1 and the team size
+		self.assertEqual((response.context['team_size'], response.context['scores_up'], response.context['scores_count']), (3, 3, 3))
+		self.assertEqual((response.context['sumstat'], response.context['time']), ("avg", "year"))
+
+	def test_pool_with_a_repeated_name(self):
+		for name in ["Ana Perez", "Jade Carey", "Simone Biles"]:
+			Gymnast.objects.create(name=name)
+		pool_list = "Ana Perez\r\nJade Carey\r\nAna Perez\r\nSimone Biles"
+		response = self.client.get(reverse('team_tester'), {'team_size': "2", 'scores_up': "2", 'scores_count': "2", 'pool_list': pool_list})
+		lineups = response.context['lineups']
+		# C(3, 2) line-ups, none of them with the same gymnast twice
+		self.assertEqual(len(lineups), 3)
+		for lineup in lineups:
+			self.assertEqual(len(set(gymnast.id for gymnast in lineup['gymnasts'])), 2)
+
+
+# **************************
+# Score snapshot
+# **************************
+
+class SnapshotTests(ScoreDataMixin, TestCase):
+
+	def setUp(self):
+		snapshot_dir = tempfile.TemporaryDirectory()
+		self.addCleanup(snapshot_dir.cleanup)
+		self.snapshot_dir = snapshot_dir.name
+		self.assertEqual(write_snapshot(self.snapshot_dir), Score.objects.count())
+		self.snapshot = open_snapshot(DataGeneration.objects.get(pk=1).generation, self.snapshot_dir)
+
+	def database_summary(self, scores, sumstat):
+		statistic = Max('score') if sumstat == "max" else Avg('score')
+		groups = scores.filter(score__isnull=False).values('gymnast_id', 'event__name', 'score_num').annotate(value=statistic)
+		return {(group['gymnast_id'], group['event__name'], group['score_num']): group['value'] for group in groups}
+
+	def assertSummariesEqual(self, first, second):
+		self.assertEqual(sorted(first), sorted(second))
+		for key in first:
+			self.assertAlmostEqual(first[key], second[key], places=6)
+
+	def test_select(self):
+		# Without a date filter, undated meets are included
+		self.assertEqual(len(self.snapshot.select()), Score.objects.count())
+		rows = self.snapshot.select(gymnast_ids=[self.ana.id], events=["VT"], score_num=1, start=datetime.date(2019, 1, 1), end=datetime.date(2019, 12, 31))
+		self.assertEqual(sorted(self.snapshot.values(rows)), [14.0, 14.5, 15.0])
+		self.assertEqual(len(self.snapshot.select(countries=[self.chn.id])), Score.objects.filter(gymnast__country=self.chn).count())
+
+	def test_summarize_matches_the_database(self):
+		start, end = datetime.date(2016, 8, 21), datetime.date(2020, 12, 31)
+		for sumstat in ["avg", "max"]:
+			self.assertSummariesEqual(
+				self.snapshot.summarize(self.snapshot.select(start=start, end=end), sumstat),
+				self.database_summary(Score.objects.filter(meet__start_date__gte=start, meet__start_date__lte=end), sumstat))
+			self.assertSummariesEqual(
+				self.snapshot.summarize(self.snapshot.select(gymnast_ids=[self.ana.id, self.li.id], events=["UB", "FX"]), sumstat),
+				self.database_summary(Score.objects.filter(gymnast__in=[self.ana, self.li], event__name__in=["UB", "FX"]), sumstat))
+
+	def test_summarize_scores_matches_the_stats_table(self):
+		# The score selector and team tester read the snapshot, or the precomputed stats when there isn't one
+		rebuild_stats()
+		gymnasts = [self.ana, self.jade, self.li]
+		for sumstat in ["avg", "max"]:
+			with mock.patch("scoredata.score_summaries.get_snapshot", return_value=self.snapshot):
+				from_snapshot = summarize_scores(gymnasts, "quad", sumstat)
+			with mock.patch("scoredata.score_summaries.get_snapshot", return_value=None):
+				from_stats = summarize_scores(gymnasts, "quad", sumstat)
+			self.assertSummariesEqual(from_snapshot, from_stats)
+
+	def test_past_year_is_worked_out_when_read(self):
+		# Without a snapshot, the past year comes from the scores as of the request, not from stats stored at ingest
+		rebuild_stats()
+		self.assertFalse(GymnastEventStats.objects.filter(window="year").exists())
+		year = [datetime.datetime(2019, 3, 1), datetime.datetime(2020, 3, 1)]
+		gymnasts = [self.ana, self.jade, self.li]
+		with mock.patch("scoredata.score_summaries.get_date_range", return_value=year), mock.patch("scoredata.score_stats.get_date_range", return_value=year):
+			for sumstat in ["avg", "max"]:
+				with mock.patch("scoredata.score_summaries.get_snapshot", return_value=self.snapshot):
+					from_snapshot = summarize_scores(gymnasts, "year", sumstat)
+				with mock.patch("scoredata.score_summaries.get_snapshot", return_value=None):
+					from_scores = summarize_scores(gymnasts, "year", sumstat)
+				self.assertSummariesEqual(from_snapshot, from_scores)
+			with mock.patch("scoredata.score_stats.get_snapshot", return_value=self.snapshot):
+				from_snapshot = get_consistency(self.ana)
+			with mock.patch("scoredata.score_stats.get_snapshot", return_value=None):
+				from_scores = get_consistency(self.ana)
+			self.assertSummariesEqual(from_snapshot, from_scores)
+
+	def test_snapshot_on_demand_is_opt_in(self):
+		empty_dir = os.path.join(self.snapshot_dir, "empty")
+		for on_demand in [False, True]:
+			with override_settings(SCORE_SNAPSHOT_DIR=empty_dir, SCORE_SNAPSHOT_ON_DEMAND=on_demand), mock.patch("scoredata.snapshot.threading.Thread") as thread, \
+					mock.patch.dict("scoredata.snapshot._snapshot", {'generation': None, 'snapshot': None, 'writing': None}):
+				self.assertIsNone(get_snapshot())
+			self.assertEqual(thread.called, on_demand)
+
+
+class FixDatesTests(ScoreDataMixin, TestCase):
+
+	def test_gymnasts_at_redated_meets(self):
+		# Scores loaded before their meet had a date aren't in the stats, so those gymnasts' stats are worked out again
+		def fix_dates():
+			Meet.objects.filter(id=self.undated.id).update(start_date=datetime.date(2019, 11, 1))
+			Meet.objects.filter(id=self.cup.id).update(start_date=datetime.date(2020, 2, 29))
+		self.assertEqual(PopulateHistoricCommand()._fix_dates(fix_dates), {self.ana.id})
+
+
+class MeetPageTests(ScoreDataMixin, TestCase):
+
+	def walk(self, per_page):
+		# Returns the pages from the first to the last, following the next cursors
+		pages = [get_meet_page(Meet.objects.all(), per_page=per_page)]
+		while pages[-1].next_cursor is not None:
+			pages.append(get_meet_page(Meet.objects.all(), after=pages[-1].next_cursor, per_page=per_page))
+		return pages
+
+	def test_next_and_previous_across_equal_dates(self):
+		# Three more meets on the same day as the Cup, and another undated one
+		same_day = [Meet.objects.create(name="Meet {} (2020)".format(i), start_date=self.cup.start_date) for i in range(3)]
+		undated = Meet.objects.create(name="Friendly 2 (2020)")
+		# Newest first, with ties broken by id, and undated meets at the end
+		expected = [meet.id for meet in sorted(same_day + [self.cup], key=lambda meet: meet.id, reverse=True)]
+		expected += [self.worlds.id, self.jesolo.id, self.old.id, undated.id, self.undated.id]
+		for per_page in [1, 2, 3, 20]:
+			pages = self.walk(per_page)
+			self.assertEqual([meet.id for page in pages for meet in page.meets], expected)
+			self.assertIsNone(pages[0].previous_cursor)
+			# Going back from each page gives the page before it, cursors and all
+			for previous, page in zip(pages, pages[1:]):
+				self.assertEqual(get_meet_page(Meet.objects.all(), before=page.previous_cursor, per_page=per_page), previous)
+
+	def test_bad_cursor(self):
+		self.assertIsNone(parse_cursor("2020-02-30_1"))
+		self.assertIsNone(parse_cursor("yesterday"))
+		self.assertEqual(get_meet_page(Meet.objects.all(), after="yesterday", per_page=2), get_meet_page(Meet.objects.all(), per_page=2))
+
+	def test_filters(self):
+		self.assertEqual(set(filter_meets(Meet.objects.all(), year=2019)), {self.jesolo, self.worlds})
+		self.assertEqual(set(filter_meets(Meet.objects.all(), country="CHN")), {self.cup})
+		self.assertEqual(set(filter_meets(Meet.objects.all(), year=2019, country="CHN")), set())
+
+	def test_list_view(self):
+		response = self.client.get(reverse('meets'), {'year': "2019"})
+		self.assertEqual(list(response.context['meet_list']), [self.worlds, self.jesolo])
+		# Years the date can't hold are ignored rather than an error
+		self.assertEqual(self.client.get(reverse('meets'), {'year': "99999"}).status_code, 200)
+
+
+# **************************
+# Score selector
+# **************************
+
+class ScoreSelectorTests(ScoreDataMixin, TestCase):
+
+	def setUp(self):
+		rebuild_stats()
+		patcher = mock.patch("scoredata.score_summaries.get_snapshot", return_value=None)
+		patcher.start()
+		self.addCleanup(patcher.stop)
+
+	def get_table(self, event, sumstat="avg", gymnasts="Ana Perez\r\nNobody\r\nLi Wei\r\nJade Carey"):
+		response = self.client.get(reverse('score_selector'), {'gymnast_list': gymnasts, 'event': event, 'sumstat': sumstat, 'time': "quad"})
+		self.assertEqual(response.status_code, 200)
+		return [[row[0]] + [round(value, 6) if isinstance(value, float) else value for value in row[1:]] for row in response.context['table_data']]
+
+	def test_all_around(self):
+		# Undated meets and meets before the quad are left out, and a gymnast without every event has no total
+		self.assertEqual(self.get_table("AA"), [
+			[self.ana, 14.5, 12.0, 12.5, 13.0, 52.0],
+			[self.li, 13.9, 14.6, 13.2, 12.7, 54.4],
+			[self.jade, 14.9, 13.1, 12.9, 14.0, 54.9],
+		])
+		self.assertEqual(self.get_table("AA", "max", "Jade Carey"), [[self.jade, 14.9, 13.1, 12.9, 14.2, 55.1]])
+
+	def test_vault(self):
+		self.assertEqual(self.get_table("VT"), [[self.ana, 14.5, 13.5, 14.0], [self.li, 13.9, "", ""], [self.jade, 14.9, 14.6, 14.75]])
+
+	def test_one_event(self):
+		self.assertEqual(self.get_table("UB", "max"), [[self.ana, 12.0], [self.li, 14.6], [self.jade, 13.1]])
+
+
+# **************************
+# Leaderboards
+# **************************
+
+class LeaderboardTests(ScoreDataMixin, TestCase):
+
+	def setUp(self):
+		snapshot_dir = tempfile.TemporaryDirectory()
+		self.addCleanup(snapshot_dir.cleanup)
+		write_snapshot(snapshot_dir.name)
+		self.snapshot = open_snapshot(DataGeneration.objects.get(pk=1).generation, snapshot_dir.name)
+
+	def leaderboards(self, *args, **kwargs):
+		# The leaderboard from the snapshot and from the database, as (rank, gymnast, score, parts)
+		leaderboards = []
+		for snapshot in [self.snapshot, None]:
+			with mock.patch("scoredata.leaderboards.get_snapshot", return_value=snapshot):
+				entries = get_leaderboard(*args, **kwargs)
+			leaderboards.append([(entry.rank, entry.gymnast, round(entry.score, 6), [round(part, 6) for part in entry.parts]) for entry in entries])
+		return leaderboards
+
+	def test_top_gymnasts(self):
+		from_snapshot, from_database = self.leaderboards("AA", "quad", "avg")
+		self.assertEqual(from_snapshot, from_database)
+		self.assertEqual(from_snapshot, [
+			(1, self.jade, 54.9, [14.9, 13.1, 12.9, 14.0]),
+			(2, self.li, 54.4, [13.9, 14.6, 13.2, 12.7]),
+			(3, self.ana, 52.0, [14.5, 12.0, 12.5, 13.0]),
+		])
+		from_snapshot, from_database = self.leaderboards("AA", "quad", "max", size=2)
+		self.assertEqual(from_snapshot, from_database)
+		self.assertEqual([(rank, gymnast) for rank, gymnast, _, _ in from_snapshot], [(1, self.jade), (2, self.li)])
+
+	def test_vault_needs_both_vaults(self):
+		from_snapshot, from_database = self.leaderboards("VT", "quad", "avg")
+		self.assertEqual(from_snapshot, from_database)
+		self.assertEqual(from_snapshot, [(1, self.jade, 14.75, [14.9, 14.6]), (2, self.ana, 14.0, [14.5, 13.5])])
+
+	def test_filters(self):
+		self.assertEqual(self.leaderboards("UB", "quad", "max", country="chn"), [[(1, self.li, 14.6, [14.6])]] * 2)
+		self.assertEqual(self.leaderboards("UB", "quad", "max", level="junior"), [[], []])
+
+	def test_shared_ranks(self):
+		Score.objects.filter(gymnast=self.li, event__name="BB").update(score=12.9)
+		with mock.patch("scoredata.leaderboards.get_snapshot", return_value=None):
+			entries = get_leaderboard("BB", "quad", "max")
+		self.assertEqual([(entry.rank, entry.score) for entry in entries], [(1, 12.9), (1, 12.9), (3, 12.5)])
+
+	def test_ranks_skip_deleted_gymnasts(self):
+		# Jade is still in the snapshot, but not in the database
+		Gymnast.objects.filter(id=self.jade.id).delete()
+		with mock.patch("scoredata.leaderboards.get_snapshot", return_value=self.snapshot):
+			entries = get_leaderboard("AA", "quad", "avg")
+		self.assertEqual([(entry.rank, entry.gymnast) for entry in entries], [(1, self.li), (2, self.ana)])
+
+
+# **************************
+# Score export
+# **************************
+
+class ExportTests(ScoreDataMixin, TestCase):
+
+	def test_filters(self):
+		rows = [json.loads(line) for line in export_lines("ndjson", season=2019, country="usa")]
+		expected = Score.objects.filter(gymnast__country=self.usa, meet__in=[self.jesolo, self.worlds]).order_by('id')
+		self.assertEqual([row['score'] for row in rows], [score.score for score in expected])
+		self.assertEqual(set(row['meet'] for row in rows), {"City of Jesolo Trophy (2019)", "World Championships (2019)"})
+		self.assertEqual(set(row['country_code'] for row in rows), {"USA"})
+		# Undated meets aren't in any season
+		self.assertEqual(list(export_lines("ndjson", season=2019, country="CHN")), [])
+		self.assertEqual(len(list(export_lines("ndjson", meet=self.undated.id))), 1)
+
+	def test_csv(self):
+		lines = list(export_lines("csv", season=2020, country="CHN"))
+		self.assertEqual(lines[0], "gymnast,gymnast_id,country,country_code,meet,meet_id,start_date,end_date,meet_day,event,score_num,score,d_score\r\n")
+		self.assertEqual(len(lines), 5)
+		self.assertEqual(lines[1], "Li Wei,{},China,CHN,American Cup (2020),{},2020-02-29,2020-02-29,AA,VT,1,13.9,5.0\r\n".format(self.li.id, self.cup.id))
+
+	def test_view(self):
+		response = self.client.get(reverse('export-scores'), {'format': "ndjson", 'season': "2020", 'country': "USA"})
+		self.assertEqual(response['Content-Type'], "application/x-ndjson")
+		rows = [json.loads(line) for line in b"".join(response.streaming_content).decode().splitlines()]
+		self.assertEqual([(row['gymnast'], row['event'], row['score']) for row in rows], [("Jade Carey", "FX", 13.8)])
+		for options in [{'format': "xml"}, {'season': "2020s"}, {'meet': "-1"}]:
+			with self.assertLogs("django.request", "WARNING"):
+				self.assertEqual(self.client.get(reverse('export-scores'), options).status_code, 400)
+
+
+# **************************
+# Loading scores
+# **************************
+
+def cleaned_row(gymnast, meet_day, **scores):
+	# One row of a cleaned season, as the populate_scores commands hand it to ScoreLoader
+	row = {"gymnast": gymnast, "country": "Japan", "meet_name": "NHK Trophy (2019)", "meet_day": meet_day, "start_date": "Apr 27 2019",
+		"end_date": "Apr 28 2019", "meet_loc": "Tokyo", "junior": False}
+	for column in ["vt1", "vt1_d", "vt2", "vt2_d", "ub", "ub_d", "bb", "bb_d", "fx", "fx_d"]:
+		row[column] = scores.get(column, np.nan)
+	return row
+
+
+class IncrementalIngestTests(TestCase):
+
+	def setUp(self):
+		for name in ["VT", "UB", "BB", "FX"]:
+			Event.objects.create(name=name, junior=False)
+
+	def load(self, rows):
+		loader = ScoreLoader(incremental=True)
+		with contextlib.redirect_stdout(io.StringIO()):
+			loader.load(pd.DataFrame(rows), junior="junior", source="2019")
+		return loader
+
+	def scores(self, gymnast, meet_day):
+		return dict(Score.objects.filter(gymnast__name=gymnast, meet_day=meet_day).values_list('event__name', 'score'))
+
+	def test_changed_new_and_unchanged_rows(self):
+		first = [cleaned_row("Mai Murakami", "QF", ub=13.5, ub_d=5.4, bb=13.2, bb_d=5.5), cleaned_row("Asuka Teramoto", "QF", fx=12.9, fx_d=5.0)]
+		self.assertEqual(self.load(first).counts, {'inserted': 2, 'updated': 0, 'unchanged': 0})
+
+		# Murakami's bars score is corrected and her beam score taken out, Teramoto's row is the same, and there's a
+		# new row for the event final
+		second = [cleaned_row("Mai Murakami", "QF", ub=13.6, ub_d=5.4), first[1], cleaned_row("Mai Murakami", "EF", fx=14.0, fx_d=5.6)]
+		loader = self.load(second)
+		self.assertEqual(loader.counts, {'inserted': 1, 'updated': 1, 'unchanged': 1})
+		self.assertEqual(self.scores("Mai Murakami", "QF"), {"UB": 13.6})
+		self.assertEqual(self.scores("Mai Murakami", "EF"), {"FX": 14.0})
+		self.assertEqual(self.scores("Asuka Teramoto", "QF"), {"FX": 12.9})
+		# Only the gymnast whose existing scores changed needs her stats rebuilt, and only the new score is folded in
+		self.assertEqual(loader.changed_gymnasts, {Gymnast.objects.get(name="Mai Murakami").id})
+		self.assertEqual([(score.meet_day, score.score) for score in loader.new_scores], [("EF", 14.0)])
+
+		# Nothing has changed the third time
+		self.assertEqual(self.load(second).counts, {'inserted': 0, 'updated': 0, 'unchanged': 3})
+		self.assertEqual(Score.objects.count(), 3)
+
+
+# **************************
+# Admin site
+# **************************
+
+class AdminDeleteTests(ScoreDataMixin, TestCase):
+
+	def test_cascade_delete_bumps_and_counts_once(self):
+		# Ana's scores go with her, without a counter update and a generation bump for each of them
+		generation = DataGeneration.objects.get(pk=1).generation
+		with mock.patch("scoredata.signals.adjust_counter") as adjust_counter:
+			ScoreDataAdmin(Gymnast, site).delete_model(None, self.ana)
+			ScoreDataAdmin(Meet, site).delete_queryset(None, Meet.objects.filter(id__in=[self.cup.id, self.old.id]))
+		self.assertFalse(adjust_counter.called)
+		self.assertEqual(DataGeneration.objects.get(pk=1).generation, generation + 2)
+		counters = SiteCounters.objects.get(pk=1)
+		self.assertEqual((counters.num_scores, counters.num_gymnasts, counters.num_meets), (5, 2, 3))
+
+
+# **************************
+# Search index
+# **************************
+
+class SearchIndexTests(TestCase):
+
+	def test_skipped_before_the_tables_exist(self):
+		# e.g. migrate on a new database, before the scoredata tables have been created
+		with mock.patch("django.db.backends.base.introspection.BaseDatabaseIntrospection.table_names", return_value=["django_migrations"]), self.assertNumQueries(0):
+			create_search_index()
+
+	def test_contains_pattern_escapes_wildcards(self):
+		self.assertEqual(_contains_pattern("Ana"), "%Ana%")
+		self.assertEqual(_contains_pattern("100%_a\\b"), "%100\\%\\_a\\\\b%")
+
+
+# **************************
+# Gymnast pages
+# **************************
+
+class GymnastScoreMatrixTests(ScoreDataMixin, TestCase):
+
+	def test_rows_match_the_per_score_tables(self):
+		# The rows the page built with one query per cell: a missing score is "-", a null one None, and the all around
+		# is only added up when VT1, UB, BB and FX are all there (and not in event finals)
+		with self.assertNumQueries(1):
+			scores, d_scores = gymnast_score_matrix(self.ana)
+		by_day = lambda rows: sorted(rows, key=lambda row: (row[0].id, row[1]))
+		self.assertEqual(by_day(scores), by_day([
+			[self.jesolo, "QF", 14.0, 13.5, 12.0, 12.5, 13.0, 14.0 + 12.0 + 12.5 + 13.0],
+			[self.worlds, "QF", 15.0, "-", None, "-", "-", "-"],
+			[self.worlds, "EF", 14.5, "-", "-", "-", "-", "-"],
+			[self.undated, "", "-", "-", 11.0, "-", "-", "-"],
+			[self.old, "QF", "-", "-", "-", "-", 15.5, "-"],
+		]))
+		self.assertEqual(by_day(d_scores), by_day([
+			[self.jesolo, "QF", 5.0, 4.6, 4.8, 5.1, 5.0],
+			[self.worlds, "QF", 5.4, None, None, None, None],
+			[self.worlds, "EF", 5.4, None, None, None, None],
+			[self.undated, "", None, None, 4.0, None, None],
+			[self.old, "QF", None, None, None, None, 6.0],
+		]))
+
+	def test_meet_days_without_d_scores_are_left_out(self):
+		Score.objects.filter(gymnast=self.jade, meet=self.cup).update(d_score=None)
+		scores, d_scores = gymnast_score_matrix(self.jade)
+		self.assertEqual(sorted(row[0].id for row in scores), sorted([self.worlds.id, self.cup.id]))
+		self.assertEqual([row[0] for row in d_scores], [self.worlds])
+
+
+# **************************
+# Meet pages
+# **************************
+
+class MeetTablesTests(ScoreDataMixin, TestCase):
+
+	def test_tables_match_the_per_score_tables(self):
+		# The tables the page built with one query per cell: one per day, with a table per event in event finals
+		with self.assertNumQueries(1):
+			tables = meet_score_tables(self.worlds)
+		tables = {table[0]: table for table in tables}
+		self.assertEqual(sorted(tables), ["Balance Beam Event Final", "Floor Exercise Event Final", "Qualifying", "Uneven Bars Event Final", "Vault Event Final"])
+		self.assertEqual(sorted(tables["Qualifying"][1], key=lambda row: row[0].name), [
+			[self.ana, 15.0, "-", None, "-", "-", "-"],
+			[self.jade, 14.9, 14.6, 13.1, 12.9, 14.2, 14.9 + 13.1 + 12.9 + 14.2],
+		])
+		self.assertEqual(tables["Vault Event Final"], ("Vault Event Final", [[self.ana, 14.5, "-"]], "VT"))
+		self.assertEqual(tables["Uneven Bars Event Final"], ("Uneven Bars Event Final", [], "UB"))
+
+	def test_junior_tables(self):
+		junior_floor = Event.objects.create(name="FX", junior=True)
+		Score.objects.create(gymnast=self.li, meet=self.jesolo, meet_day="", event=junior_floor, score_num=1, score=12.1, d_score=4.9)
+		Score.objects.create(gymnast=self.jade, meet=self.jesolo, meet_day="", event=self.events["FX"], score_num=1, score=13.4, d_score=5.6)
+		tables = [table for table in meet_score_tables(self.jesolo) if table[0] != "Qualifying"]
+		# Seniors come first, and days without a name are labelled by level
+		self.assertEqual(tables, [
+			("Senior Competition", [[self.jade, "-", "-", "-", "-", 13.4, "-"]]),
+			("Junior Competition", [[self.li, "-", "-", "-", "-", 12.1, "-"]]),
+		])
+
+	def test_json(self):
+		data = meet_tables_json(self.worlds, meet_score_tables(self.worlds))
+		self.assertEqual(data['meet'], {'id': self.worlds.id, 'name': "World Championships (2019)", 'start_date': "2019-10-04", 'end_date': "2019-10-13"})
+		vault_final = [table for table in data['tables'] if table['title'] == "Vault Event Final"][0]
+		self.assertEqual(vault_final['rows'], [{'gymnast': "Ana Perez", 'gymnast_id': str(self.ana.id), 'country': "USA", 'scores': [14.5, None]}])
+		self.assertEqual(data['tables'][0]['event'], "AA")
@@ -8,9 +8,13 @@ urlpatterns = [
     path('about_us', views.about_us, name='about_us'),
     path('meets/', views.MeetListView.as_view(), name='meets'),
     path('meet/<int:pk>', views.MeetDetailView.as_view(), name='meet-detail'),
+    path('meet/<int:pk>/json', views.meet_detail_json, name='meet-detail-json'),
     path('gymnast/<uuid:pk>', views.GymnastDetailView.as_view(), name='gymnast-detail'),
     path('score_selector', views.score_selector, name='score_selector'),
+    path('export', views.export_scores, name='export-scores'),
     path('team_tester', views.team_tester, name='team_tester'),
+    path('leaderboards', views.leaderboards, name='leaderboards'),
+    path('leaderboards/json', views.leaderboards_json, name='leaderboards-json'),
     path('posts/', views.PostListView.as_view(), name='posts'),
     path('post/<int:pk>', views.PostDetailView.as_view(), name='post-detail'),
     path('author/<slug>', views.AuthorDetailView.as_view(), name='author-detail'),
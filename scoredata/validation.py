@@ -0,0 +1,95 @@
+import os
+import pandas as pd
+from django.conf import settings
+from .models import Score
+from .ingest import SCORE_COLUMNS
+from .countries import country_code
+
+# **************************
+# Checking cleaned score sheets before they're loaded
+# **************************
+# Every check runs over whole columns at once, and adds its reason to the rows that fail it. Rows with any reason are
+# taken out of the season and written to the quarantine directory (one csv per source, with a "reasons" column), so
+# that a bad cell costs one row rather than crashing the load halfway through, and can be fixed in the sheet.
+
+MAX_SCORE = 20
+MEET_DAYS = [day for day, _ in Score.meet_day_opts] + [""]
+DATE_FORMAT = "%b %d %Y"
+# How far apart the vault average can be from the average of the two vaults (the sheets have 3 decimals)
+VAULT_AVERAGE_TOLERANCE = 0.0005
+
+
+def get_quarantine_dir():
+	return getattr(settings, 'INGEST_QUARANTINE_DIR', os.path.join(settings.BASE_DIR, 'quarantine'))
+
+
+def _present(column):
+	# Cells that have something in them (blank strings count as missing)
+	return column.notnull() & (column.astype(str).str.strip() != "")
+
+
+def _per_value(column, check):
+	# Runs check once per distinct value rather than once per row
+	column = column.astype(object)
+	values = column.dropna().unique()
+	results = {value: check(value) for value in values}
+	return column.map(results).fillna(True).astype(bool)
+
+
+def find_problems(scores):
+	'''
+	Returns a Series with the reasons (separated by "; ") that each row of scores can't be loaded, or "" if it can.
+	'''
+	checks = []
+	numbers = {}
+	for column in [column for spec in SCORE_COLUMNS for column in spec[:2]]:
+		numbers[column] = pd.to_numeric(scores[column], errors='coerce')
+		checks.append((_present(scores[column]) & numbers[column].isnull(), "{} is not a number".format(column)))
+
+	for column, d_column, _, _ in SCORE_COLUMNS:
+		score, d_score = numbers[column], numbers[d_column]
+		checks.append(((score < 0) | (score > MAX_SCORE), "{} is not between 0 and {}".format(column, MAX_SCORE)))
+		checks.append((d_score < 0, "{} is negative".format(d_column)))
+		checks.append((d_score > score, "{} is more than {}".format(d_column, column)))
+
+	# The 2017 and 2018 sheets only have the first vault and the vault average, so the second vault is worked out as
+	# 2 * average - first vault. That only works if the first vault is there, and it has to give a valid score.
+	if "vt_avg" in scores.columns:
+		vt_avg = pd.to_numeric(scores.vt_avg, errors='coerce')
+		vt1, vt2 = numbers["vt1"], numbers["vt2"]
+		checks.append((_present(scores.vt_avg) & vt_avg.isnull(), "vt_avg is not a number"))
+		inconsistent = vt1.isnull() | vt2.isnull() | (vt2 < 0) | (vt2 > MAX_SCORE) | (((vt1 + vt2) / 2 - vt_avg).abs() > VAULT_AVERAGE_TOLERANCE)
+		checks.append((vt_avg.notnull() & inconsistent, "vt_avg doesn't match vt1 and vt2"))
+
+	checks.append((~_present(scores.gymnast), "no gymnast"))
+	checks.append((~_present(scores.meet_name) | scores.meet_name.astype(str).str.match(r"^(nan)? \(\d{4}\)$"), "no meet name"))
+	checks.append((~scores.meet_day.astype(object).fillna("").isin(MEET_DAYS), "unknown meet day"))
+	checks.append((_present(scores.country) & ~_per_value(scores.country, lambda country: country_code(country) is not None), "unknown country"))
+	for column in ["start_date", "end_date"]:
+		dates = pd.to_datetime(scores[column], format=DATE_FORMAT, errors='coerce')
+		checks.append((_present(scores[column]) & dates.isnull(), "{} is not a date".format(column)))
+
+	reasons = pd.Series("", index=scores.index)
+	for failed, reason in checks:
+		reasons = reasons.where(~failed.to_numpy(), reasons + reason + "; ")
+	return reasons.str.rstrip("; ")
+
+
+def validate_scores(scores, source, quarantine_dir=None):
+	'''
+	Takes the rows that can't be loaded out of scores, writes them to <quarantine dir>/<source>.csv as they were read
+	(with their reasons), and returns the rest. The file is removed when every row passes.
+	'''
+	reasons = find_problems(scores)
+	rejected = reasons != ""
+	quarantine_dir = quarantine_dir or get_quarantine_dir()
+	path = os.path.join(quarantine_dir, "{}.csv".format(source))
+	if rejected.any():
+		os.makedirs(quarantine_dir, exist_ok=True)
+		scores.loc[rejected].assign(reasons=reasons[rejected]).to_csv(path, index=False)
+		print("{}: {} of {} rows rejected, see {}".format(source, rejected.sum(), len(scores), path))
+		for reason, count in reasons[rejected].str.split("; ").explode().value_counts().items():
+			print("  {}: {}".format(reason, count))
+	elif os.path.exists(path):
+		os.remove(path)
+	return scores.loc[~rejected]
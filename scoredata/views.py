@@ -1,14 +1,28 @@
-from django.shortcuts import render
+from django.shortcuts import render, get_object_or_404
 from django.views import generic
-from django.http import HttpResponseRedirect, HttpResponse
+from django.http import HttpResponseRedirect, HttpResponse, HttpResponseBadRequest, StreamingHttpResponse
 import datetime
 from dateutil.relativedelta import relativedelta
 from django.db.models import Avg, Max
 from django.core import paginator
 from django.views.generic.detail import SingleObjectMixin
 from django.views.generic import ListView
+from django.utils.decorators import method_decorator
 import numpy as np
 from .models import Gymnast, Country, Meet, Event, Score, Post, Author, Tag
+from .score_matrix import gymnast_score_matrix
+from .meet_tables import meet_score_tables, meet_tables_json
+from .score_summaries import get_gymnasts_by_name, summarize_scores
+from .score_stats import get_consistency
+from .lineups import APPARATUS, MAX_TOP_LINEUPS, MAX_TEAM_SIZE, best_lineups, pool_score_matrix, unique_gymnasts
+from .name_index import search_names
+from .search import search, unambiguous_result
+from .counters import get_counters
+from .tag_cloud import get_tag_cloud
+from .page_cache import cache_by_generation, conditional_on_generation
+from .meet_pages import filter_meets, get_meet_page
+from .export import EXPORT_FORMATS, export_lines
+from .leaderboards import LEADERBOARDS, LEADERBOARD_SIZE, MAX_LEADERBOARD_SIZE, LEVELS, get_leaderboard, get_part_names
 from django.template import Template, Context
 from math import sqrt, isnan
 
@@ -20,27 +34,31 @@ from math import sqrt, isnan
 def index(request):
 	"""View function for home page of site."""
 
-	# Generate counts of some of the main objects
-	num_scores = Score.objects.all().count()
-	num_gymnasts = Gymnast.objects.all().count()
-	num_meets = Meet.objects.all().count()
+	# Get the (cached) counts of some of the main objects
+	counters = get_counters()
+	num_scores = counters.num_scores
+	num_gymnasts = counters.num_gymnasts
+	num_meets = counters.num_meets
 	
 	# If the form has been sumitted
 	result = ""
 	to_search = request.GET.get('to_search', False)
-	# Search for a gymnast with this name
+	# Search gymnast names, meet names and blog post titles
 	if to_search != False:
-		try:
-			result = Gymnast.objects.get(name__icontains=to_search)
-			return HttpResponseRedirect(result.get_absolute_url())
-		except Gymnast.DoesNotExist:
-			# If no gymnast, search for a meet with this name
-			try:
-				result = Meet.objects.get(name__icontains=to_search)
-				return HttpResponseRedirect(result.get_absolute_url())
-			except:
-				# Otherwise, return a "not found" message
-				result = "Not found. Search again?"
+		results = search(to_search)
+		# Go straight to the page if there's only one match
+		match = unambiguous_result(to_search, results)
+		if match is not None:
+			return HttpResponseRedirect(match.url)
+		elif len(results) > 0:
+			context = {
+				'to_search': to_search,
+				'results': results,
+			}
+			return render(request, 'search_results.html', context=context)
+		else:
+			# Otherwise, return a "not found" message
+			result = "Not found. Search again?"
 
 	context={
 		'num_scores': num_scores,
@@ -58,12 +76,44 @@ def about_us(request):
 	return render(request, 'about_us.html')
 
 # List of all meets
+@method_decorator([conditional_on_generation, cache_by_generation], name='dispatch')
 class MeetListView(generic.ListView):
 
 	model = Meet
-	paginate_by = 50
+	context_object_name = "meet_list"
+	template_name = "scoredata/meet_list.html"
+
+	def get_filters(self):
+		# Optional ?year=2021 and ?country=USA filters. Invalid values are ignored.
+		year = self.request.GET.get('year', "")
+		# (datetime.date only takes years 1 to 9999, and the filter also needs the next year)
+		year = int(year) if year.isdigit() and 1 <= int(year) < 9999 else None
+		country = self.request.GET.get('country', "").upper() or None
+		return year, country
+
+	def get_queryset(self):
+		year, country = self.get_filters()
+		meets = filter_meets(Meet.objects.all(), year=year, country=country)
+		self.page = get_meet_page(meets, after=self.request.GET.get('after'), before=self.request.GET.get('before'))
+		return self.page.meets
+
+	def get_context_data(self, **kwargs):
+
+		context = super(MeetListView, self).get_context_data(**kwargs)
 
+		year, country = self.get_filters()
+		context['year'] = year
+		context['country'] = country
+		context['next_cursor'] = self.page.next_cursor
+		context['previous_cursor'] = self.page.previous_cursor
 
+		# Options for the filter form
+		context['years'] = [date.year for date in Meet.objects.dates('start_date', 'year', order='DESC')]
+		context['countries'] = Country.objects.only('name', 'iso3c')
+		return context
+
+
+@method_decorator([conditional_on_generation, cache_by_generation], name='dispatch')
 class GymnastDetailView(generic.DetailView):
 
 	model = Gymnast
@@ -72,90 +122,22 @@ class GymnastDetailView(generic.DetailView):
 
 		context = super(GymnastDetailView, self).get_context_data(**kwargs)
 
-		def get_scores(meet, meet_day, gymnast, event, score_num):
-			''' Tries to query a score and returns missing if score does not exist'''
-			try:
-				score = Score.objects.get(meet=Meet.objects.get(name=meet), meet_day=meet_day, 
-					gymnast=Gymnast.objects.get(id=gymnast), 
-					event__in=Event.objects.filter(name=event), score_num=score_num)
-					# Save just the score value for this score instance
-				total_score = score.score
-				d_score = score.d_score
-				if d_score != d_score: # d_score must be NaN
-					d_score = None
-				score = [total_score, d_score]
-			except Score.DoesNotExist:
-				score = ["-", None]
-			return score
-
-		# Get a unique list of meets that have scores for this gymnast
-		meets = Score.objects.filter(gymnast=self.object).values_list('meet').distinct()
-		scores_to_display = []
-		d_scores_to_display = []
-		for meet in meets:
-			# Get a unique list of meet days when this gymnast competed for each meet 
-			meet_days = Score.objects.filter(gymnast=self.object).filter(meet=meet).values_list('meet_day').distinct()
-			for day in meet_days:
-				# Store the meet instance and meet day
-				this_meet_info = [Meet.objects.get(pk=meet[0]), day[0]]
-				this_meet_info_d = [Meet.objects.get(pk=meet[0]), day[0]]
-				# Add the VT1, VT2, UB, BB, FX, AA scores to the list
-				any_d = 0
-				for event, num in [("VT", 1), ("VT", 2), ("UB", 1), ("BB", 1), ("FX", 1)]:
-					scores = get_scores(Meet.objects.get(pk=meet[0]).name, day[0], self.object.id, event, num)
-					this_meet_info.append(scores[0])
-					this_meet_info_d.append(scores[1])
-					# Mark if there's any d scores for this meet
-					if scores[1] != None and scores[1]==scores[1]:
-						any_d = 1
-				# Calculate AA score if applicable
-				if day[0] != "EF" and isinstance(this_meet_info[2], float) and isinstance(this_meet_info[4], float) and isinstance(this_meet_info[5], float) and isinstance(this_meet_info[6], float):
-					aa_total = float(this_meet_info[2]) + float(this_meet_info[4]) + float(this_meet_info[5]) + float(this_meet_info[6])
-					this_meet_info.append(aa_total)
-				else:
-					this_meet_info.append("-")
-				# Add info for this meet day to the list of data to display in the table
-				scores_to_display.append(this_meet_info)
-				# If there was any d score data, then add the info for this meet day to the list of data to display in the d score table oto
-				if any_d == 1:
-					d_scores_to_display.append(this_meet_info_d)
+		# Build the score and d score tables from a single query over this gymnast's scores
+		scores_to_display, d_scores_to_display = gymnast_score_matrix(self.object)
+
 		# Add an extra field to the context with the information for the table
 		context['scores_to_display'] = scores_to_display
 		context['d_scores_to_display'] = d_scores_to_display
 
-		# Calculate consistency score for the past year
-		now = datetime.datetime.now()
-		scores = Score.objects.filter(gymnast=self.object, meet__in=Meet.objects.filter(start_date__range=[now-relativedelta(years=1), now]))
-		# Sort scores by event
-		e_scores = {'VT1': [], 'VT2': [], 'VT':[], 'UB': [], 'BB': [], 'FX': [], 'total':[]}
-		for score in scores:
-			if (score.d_score is not None) and (score.d_score == score.d_score):
-				if score.event.name=="VT":
-					if score.score_num == 1:
-						e_scores["VT1"].append(score.score-score.d_score)
-					else:
-						e_scores["VT2"].append(score.score-score.d_score)
-				else:
-					e_scores[score.event.name].append(score.score-score.d_score)
-				e_scores['total'].append(score.score-score.d_score)
-		# Calculate consistency score
-		consistency = {}
-		for key, value in e_scores.items():
-			if len(value) > 1 and key !="total":
-				mean = sum(value)/len(value)
-				ssd = sum([(item-mean)**2 for item in value])
-				consistency[key] = sqrt(ssd/len(value))
-		if consistency != {}:
-			if "VT2" in consistency:
-				consistency["total"] = float((sum(consistency.values()) - consistency["VT2"])/(len(consistency)-1))
-			else:
-				consistency["total"] = float(sum(consistency.values())) / len(consistency)
+		# Get the precomputed consistency scores for the past year
+		consistency = get_consistency(self.object)
 		context['consistency'] = consistency
 
 		return context
 
 
 # Detail view for a single meet
+@method_decorator([conditional_on_generation, cache_by_generation], name='dispatch')
 class MeetDetailView(generic.DetailView):
 
 	model = Meet
@@ -164,118 +146,8 @@ class MeetDetailView(generic.DetailView):
 
 		context = super(MeetDetailView, self).get_context_data(**kwargs)
 
-		# Get a list of unique meet day types for the scores linked to this meet
-		days = Score.objects.filter(meet=self.object).values_list('meet_day').distinct()
-
-		# Create a list (gymnast_querysets) where each item is a queryset for all the gymnasts competing on a given day
-		# The first item will the the gymnasts with scores for the first day of  context['days'], etc.
-		to_display = []
-		gymnast_names=[]
-
-		def get_scores(meet, meet_day, gymnast, event, junior, score_num):
-			''' Tries to query a score and returns missing if score does not exist'''
-			try:
-				score = Score.objects.get(meet=Meet.objects.get(name=meet), meet_day=meet_day, 
-					gymnast=Gymnast.objects.get(id=gymnast), 
-					event=Event.objects.get(name=event, junior=junior), score_num=score_num)
-				# Save 1) the score for this istance, and 2) whether the gymnast was a junior
-				score = score.score
-			except Score.DoesNotExist:
-				score = "-"
-			return score
-
-		# Loop through the meet days - each one will be a separate table
-		for day in days:
-			# Test if there was a version of this meet day for juniors and seniors
-			has_juniors = (Score.objects.filter(meet=Meet.objects.get(name=self.object), meet_day=day[0], event__in=Event.objects.filter(junior=True)).count() > 0)
-			has_seniors = (Score.objects.filter(meet=Meet.objects.get(name=self.object), meet_day=day[0], event__in=Event.objects.filter(junior=False)).count() > 0)
-			if has_juniors and has_seniors:
-				to_loop = [False, True]
-			elif has_juniors and ~has_seniors:
-				to_loop = [True]
-			elif ~has_juniors and has_seniors:
-				to_loop = [False]
-			for jr_event in to_loop:
-				# If this is not event finals
-				if day[0] != "EF":
-					# Pull display name for this day
-					day_display = Score.objects.filter(meet_day=day[0])[0].get_meet_day_display()
-					# Update display name based on whether or not this is the table for juniors, and whether there were any juniors competing at all
-					if day_display == "" and has_juniors == True and jr_event == False:
-						day_display = "Senior Competition"
-					elif day_display == "" and has_juniors == True and jr_event == True:
-						day_display = "Junior Competition"
-					elif jr_event == True:
-						day_display = "Junior " + day_display
-					# Get all gymnasts with scores at this meet on this day
-					gymnast_queryset=Score.objects.filter(meet=self.object, meet_day=day[0], event__in=Event.objects.filter(junior=jr_event)).values_list('gymnast').distinct()
-					gymnast_scores=[]
-					for gymnast in gymnast_queryset:
-						this_gymnast_scores = []
-						this_gymnast_scores.append(Gymnast.objects.get(id=gymnast[0]))
-						# Add the VT1, VT2, UB, BB, FX, AA scores to the list
-						this_gymnast_scores.append(get_scores(self.object, day[0], gymnast[0], "VT", jr_event, 1))
-						this_gymnast_scores.append(get_scores(self.object, day[0], gymnast[0], "VT", jr_event, 2))
-						this_gymnast_scores.append(get_scores(self.object, day[0], gymnast[0], "UB", jr_event, 1))
-						this_gymnast_scores.append(get_scores(self.object, day[0], gymnast[0], "BB", jr_event, 1))
-						this_gymnast_scores.append(get_scores(self.object, day[0], gymnast[0], "FX", jr_event, 1))
-						# Calculate the AA score where applicable 
-						if isinstance(this_gymnast_scores[1], float) and isinstance(this_gymnast_scores[3], float) and isinstance(this_gymnast_scores[4], float) and isinstance(this_gymnast_scores[5], float):
-							 aa_total = float(this_gymnast_scores[1]) + float(this_gymnast_scores[3]) + float(this_gymnast_scores[4]) + float(this_gymnast_scores[5])
-							 this_gymnast_scores.append(aa_total)
-						else:
-							this_gymnast_scores.append("-")
-						# Add this list of scores to a list of lists
-						gymnast_scores.append(this_gymnast_scores)
-					to_display.append((day_display, gymnast_scores))
-				# Else, for event finals		
-				else:
-					# Vault final
-					day_display = "Vault Event Final"
-					# Update display name based on whether or not this is the table for juniors, and whether there were any juniors competing at all
-					if jr_event == True:
-						day_display = "Junior " + day_display
-					elif has_juniors == True and jr_event == False:
-						day_display = "Senior " + day_display
-					# Get all gymnasts with vault final at this meet on this day
-					gymnast_queryset=Score.objects.filter(meet=self.object).filter(meet_day=day[0]).filter(event=Event.objects.get(name="VT", junior=jr_event)).values_list('gymnast').distinct()
-					gymnast_scores=[]
-					for gymnast in gymnast_queryset:
-						this_gymnast_scores = []
-						this_gymnast_scores.append(Gymnast.objects.get(id=gymnast[0]))
-						# Add the VT1 and VT2 scores to the list
-						this_gymnast_scores.append(get_scores(self.object, day[0], gymnast[0], "VT", jr_event, 1))
-						this_gymnast_scores.append(get_scores(self.object, day[0], gymnast[0], "VT", jr_event, 2))
-						# Add the vault average score
-						if isinstance(this_gymnast_scores[1], float) and isinstance(this_gymnast_scores[2], float):
-							 vt_avg = (float(this_gymnast_scores[1]) + float(this_gymnast_scores[2]))/2
-							 this_gymnast_scores.append(vt_avg)
-						# Add this list of scores to a list of lists
-						gymnast_scores.append(this_gymnast_scores)
-					to_display.append((day_display, gymnast_scores, "VT"))
-					# All other events
-					events_list = ["UB", "BB", "FX"]
-					for event in events_list:
-						event_display = Event.objects.filter(name=event)[0].get_name_display()
-						day_display = event_display + " Event Final"
-						# Update display name based on whether or not this is the table for juniors, and whether there were any juniors competing at all
-						if jr_event == True:
-							day_display = "Junior " + day_display
-						elif has_juniors == True and jr_event == False:
-							day_display = "Senior " + day_display
-						# Get all gymnasts in this event final at this meet on this day
-						gymnast_queryset=Score.objects.filter(meet=self.object).filter(meet_day=day[0]).filter(event=Event.objects.get(name=event, junior=jr_event)).values_list('gymnast').distinct()
-						gymnast_scores=[]
-						for gymnast in gymnast_queryset:
-							this_gymnast_scores = []
-							this_gymnast_scores.append(Gymnast.objects.get(id=gymnast[0]))
-							# Add the scores to the list
-							this_gymnast_scores.append(get_scores(self.object, day[0], gymnast[0], event, jr_event, 1))
-							# Add this list of scores to a list of lists
-							gymnast_scores.append(this_gymnast_scores)
-						to_display.append((day_display, gymnast_scores, event))
-
-					# Get all gymnasts with scores at this meet 
+		# Build the all around and event final tables from a single query over this meet's scores
+		to_display = meet_score_tables(self.object)
 
 		# Add an extra field to the context with the list of gymnast querysets
 		context['to_display'] = to_display
@@ -296,33 +168,22 @@ def score_selector(request):
 		sumstat = request.GET.get('sumstat', False)
 		time = request.GET.get('time', False)
 
-		# Set the date range 
-		now = datetime.datetime.now()
-		if time=="year":
-			date_range = [now-relativedelta(years=1), now]
-		elif time == "season":
-			date_range = [datetime.date(2019, 10, 13), now] # Since last world championships
-		else:
-			date_range = [datetime.date(2016, 8, 21), now] # Since last olympics
+		# Look up all of the gymnasts, and the precomputed summary statistic for every gymnast, event and score number
+		gymnast_objects = get_gymnasts_by_name(gymnasts)
+		events = ["VT", "UB", "BB", "FX"] if event == "AA" else [event]
+		sumstats = summarize_scores(gymnast_objects, time, sumstat, events=events)
+
+		def get_sumstat(gymnast, event, score_num):
+			return sumstats.get((gymnast.id, event, score_num), "")
 
 		# Get the score data for the results table
 		table_data = []
-		for gymnast in gymnasts:
-			gymnast = Gymnast.objects.get(name=gymnast)
+		for gymnast in gymnast_objects:
 			this_gymnast_scores = []
 			this_gymnast_scores.append(gymnast)
 			if event == "AA":
 				for sub_event in ["VT", "UB", "BB", "FX"]:
-					scores = Score.objects.filter(gymnast=gymnast, 
-						meet__in=Meet.objects.filter(start_date__range=date_range), event__in=Event.objects.filter(name=sub_event), score_num=1)
-					if scores.count() > 0:
-						if sumstat == "avg":
-							scores_sumstat = scores.aggregate(Avg('score'))['score__avg']
-						elif sumstat == "max":
-							scores_sumstat = scores.aggregate(Max('score'))['score__max']
-					else:
-						scores_sumstat = ""
-					this_gymnast_scores.append(scores_sumstat)
+					this_gymnast_scores.append(get_sumstat(gymnast, sub_event, 1))
 				# Add up AA average
 				if isinstance(this_gymnast_scores[1], float) and isinstance(this_gymnast_scores[2], float) and isinstance(this_gymnast_scores[3], float) and isinstance(this_gymnast_scores[4], float):
 					aa_total = float(this_gymnast_scores[1]) + float(this_gymnast_scores[2]) + float(this_gymnast_scores[3]) + float(this_gymnast_scores[4])
@@ -331,16 +192,7 @@ def score_selector(request):
 					this_gymnast_scores.append("")
 			elif event == "VT":
 				for vt_num in [1, 2]:
-					scores = Score.objects.filter(gymnast=gymnast, 
-						meet__in=Meet.objects.filter(start_date__range=date_range), event__in=Event.objects.filter(name="VT"), score_num=vt_num)
-					if scores.count() > 0:
-						if sumstat == "avg":
-							scores_sumstat = scores.aggregate(Avg('score'))['score__avg']
-						elif sumstat == "max":
-							scores_sumstat = scores.aggregate(Max('score'))['score__max']
-					else:
-						scores_sumstat = ""
-					this_gymnast_scores.append(scores_sumstat)
+					this_gymnast_scores.append(get_sumstat(gymnast, "VT", vt_num))
 				# Get two-vault average
 				if isinstance(this_gymnast_scores[1], float) and isinstance(this_gymnast_scores[2], float):
 					vt_avg = (float(this_gymnast_scores[1]) + float(this_gymnast_scores[2]))/2
@@ -348,16 +200,7 @@ def score_selector(request):
 				else:
 					this_gymnast_scores.append("")
 			else:
-				scores = Score.objects.filter(gymnast=gymnast, 
-					meet__in=Meet.objects.filter(start_date__range=date_range), event__in=Event.objects.filter(name=event))
-				if scores.count() > 0:
-					if sumstat == "avg":
-						scores_sumstat = scores.aggregate(Avg('score'))['score__avg']
-					elif sumstat == "max":
-						scores_sumstat = scores.aggregate(Max('score'))['score__max']
-				else:
-					scores_sumstat = ""
-				this_gymnast_scores.append(scores_sumstat)
+				this_gymnast_scores.append(get_sumstat(gymnast, event, 1))
 			table_data.append(this_gymnast_scores)
 	else: 
 		gymnast_list = ""
@@ -381,78 +224,101 @@ def score_selector(request):
 
 # Team Tester
 def team_tester(request):
-	"""View function for score selector page of site."""
-
-	# Look for the team size entered by the user
-	team_size = int(request.GET.get('team_size', False))
+	"""View function for team tester page of site."""
+
+	# Look for the team size entered by the user (a missing or invalid size shows the empty form)
+	team_size = request.GET.get('team_size', "")
+	team_size = min(int(team_size), MAX_TEAM_SIZE) if team_size.isdigit() and int(team_size) > 0 else None
+	# Look for a pool of candidate gymnasts, if the user wants to search for the best line-ups
+	pool_list = request.GET.get('pool_list', "")
+	top_n = 10
+	pool_not_found = []
+	lineups = []
+	lineup_error = ""
 
 	# If user has entered information...
 	if team_size:
 
-		# Get the rest of the information from the form
-		scores_up = int(request.GET.get('scores_up', False))
-		scores_count = int(request.GET.get('scores_count', False))
-		sumstat = request.GET.get('sumstat', False)
-		time = request.GET.get('time', False)
-		gymnast_list = []
-		for i in range(1, team_size+1):
-			gymnast_search_id = "gymnast_search" + str(i)
-			gymnast_list.append(request.GET.get(gymnast_search_id, False))
-
-		# Set the date range 
-		now = datetime.datetime.now()
-		if time=="year":
-			date_range = [now-relativedelta(years=1), now]
-		elif time == "season":
-			date_range = [datetime.date(2019, 10, 13), now] # Since last world championships
+		# Get the rest of the information from the form. Invalid values fall back to the defaults (4 up, 3 count),
+		# and between 1 and team_size scores count, with at least as many going up.
+		scores_up = request.GET.get('scores_up', "")
+		scores_count = request.GET.get('scores_count', "")
+		scores_count = min(max(int(scores_count) if scores_count.isdigit() else 3, 1), team_size)
+		scores_up = min(max(int(scores_up) if scores_up.isdigit() else 4, scores_count), team_size)
+		sumstat = request.GET.get('sumstat', "avg")
+		sumstat = sumstat if sumstat in ("avg", "max") else "avg"
+		time = request.GET.get('time', "year")
+		time = time if time in ("year", "season", "quad") else "year"
+
+		# If the user gave a pool of candidates, search every line-up from the pool for the best teams
+		if pool_list:
+			# Invalid numbers of line-ups fall back to 10
+			top_n = request.GET.get('top_n', "")
+			top_n = min(int(top_n), MAX_TOP_LINEUPS) if top_n.isdigit() and int(top_n) > 0 else 10
+			pool_names = [name for name in pool_list.split("\r\n") if name.strip() != ""]
+			# (A name given twice would otherwise put the same gymnast in a line-up twice)
+			pool = unique_gymnasts(get_gymnasts_by_name(pool_names))
+			found_names = set(gymnast.name for gymnast in pool)
+			pool_not_found = [name for name in pool_names if name not in found_names]
+			# Load the pool's per-apparatus scores in one query, then score every line-up at once
+			sumstats = summarize_scores(pool, time, sumstat, events=APPARATUS)
+			try:
+				for members, event_totals, total in best_lineups(pool_score_matrix(pool, sumstats), team_size, scores_count, top_n):
+					lineups.append({
+						'gymnasts': [pool[i] for i in members],
+						'event_totals': event_totals,
+						'total': total,
+					})
+			except ValueError as error:
+				lineup_error = str(error)
+			gymnast_list = []
+			table_data = []
+			team_total = ""
+
+		# Otherwise, score the line-up that the user entered
 		else:
-			date_range = [datetime.date(2016, 8, 21), now] # Since last olympics
-
-		# Loop through the list of gymnasts and get scores
-		table_data = []
-		for gymnast in gymnast_list:
-			gymnast = Gymnast.objects.get(name=gymnast)
-			this_gymnast_scores = []
-			this_gymnast_scores.append(gymnast)
-			for sub_event in ["VT", "UB", "BB", "FX"]:
-				scores = Score.objects.filter(gymnast=gymnast, 
-					meet__in=Meet.objects.filter(start_date__range=date_range), event__in=Event.objects.filter(name=sub_event), score_num=1)
-				if scores.count() > 0:
-					if sumstat == "avg":
-						scores_sumstat = scores.aggregate(Avg('score'))['score__avg']
-					elif sumstat == "max":
-						scores_sumstat = scores.aggregate(Max('score'))['score__max']
-				else:
-					scores_sumstat = ""
-				this_gymnast_scores.append(scores_sumstat)
-			table_data.append(this_gymnast_scores)
-
-		# Select the scores that go up and the scores that count
-		for i in range(1, 5):
-			# Get the list of all scores on this event
-			event_scores = [col[i] for col in table_data]
-			# Get the sort order of these scores
-			sort_order = np.argsort(np.argsort(event_scores)) # See https://github.com/numpy/numpy/issues/8757
-			sort_order = team_size - 1 - sort_order
-			# Replace each score with a tuple of the score and the class that we'll use for the td of each score
-			for j, row in enumerate(table_data):
-				# For scores that count
-				if sort_order[j] < scores_count:
-					table_data[j][i] = [table_data[j][i], "counts"]
-				elif sort_order[j] < scores_up:
-					table_data[j][i] = [table_data[j][i], "up"]
-				else:
-					table_data[j][i] = [table_data[j][i], "not_used"]
-
-		# Calculate total row
-		total_row = ["Team Total", 0, 0, 0, 0]
-		for row in table_data:
+			gymnast_list = []
+			for i in range(1, team_size+1):
+				gymnast_search_id = "gymnast_search" + str(i)
+				gymnast_list.append(request.GET.get(gymnast_search_id, False))
+
+			# Loop through the list of gymnasts and get scores, looking up all of the scores in one query
+			gymnast_objects = get_gymnasts_by_name(gymnast_list)
+			sumstats = summarize_scores(gymnast_objects, time, sumstat, events=APPARATUS)
+			table_data = []
+			for gymnast in gymnast_objects:
+				this_gymnast_scores = []
+				this_gymnast_scores.append(gymnast)
+				for sub_event in APPARATUS:
+					this_gymnast_scores.append(sumstats.get((gymnast.id, sub_event, 1), ""))
+				table_data.append(this_gymnast_scores)
+
+			# Select the scores that go up and the scores that count
 			for i in range(1, 5):
-				if row[i][1] == "counts" and (not isinstance(row[i][0], str)):
-					total_row[i] = total_row[i] + row[i][0]
-		table_data.append(total_row)
-		team_total = sum(total_row[1:5])
-		print(table_data)
+				# Get the list of all scores on this event
+				event_scores = [col[i] for col in table_data]
+				# Get the sort order of these scores
+				sort_order = np.argsort(np.argsort(event_scores)) # See https://github.com/numpy/numpy/issues/8757
+				# (Names that weren't found are left out, so the table can have fewer rows than the team size)
+				sort_order = len(table_data) - 1 - sort_order
+				# Replace each score with a tuple of the score and the class that we'll use for the td of each score
+				for j, row in enumerate(table_data):
+					# For scores that count
+					if sort_order[j] < scores_count:
+						table_data[j][i] = [table_data[j][i], "counts"]
+					elif sort_order[j] < scores_up:
+						table_data[j][i] = [table_data[j][i], "up"]
+					else:
+						table_data[j][i] = [table_data[j][i], "not_used"]
+
+			# Calculate total row
+			total_row = ["Team Total", 0, 0, 0, 0]
+			for row in table_data:
+				for i in range(1, 5):
+					if row[i][1] == "counts" and (not isinstance(row[i][0], str)):
+						total_row[i] = total_row[i] + row[i][0]
+			table_data.append(total_row)
+			team_total = sum(total_row[1:5])
 	else:
 		team_size=5
 		scores_up=4
@@ -474,10 +340,46 @@ def team_tester(request):
 		'gymnast_list': gymnast_list,
 		'table_data': table_data,
 		'team_total': team_total,
+		'pool_list': pool_list,
+		'pool_not_found': pool_not_found,
+		'top_n': top_n,
+		'lineups': lineups,
+		'lineup_error': lineup_error,
 	}
 
 	return render(request, 'team_tester.html', context=context)
 
+# Leaderboards
+def get_leaderboard_options(request):
+	# ?apparatus=BB&time=season&sumstat=max&level=junior&country=USA&size=100. Invalid values fall back to the defaults.
+	apparatus = request.GET.get('apparatus', "AA").upper()
+	time = request.GET.get('time', "year")
+	sumstat = request.GET.get('sumstat', "avg")
+	level = request.GET.get('level', "senior")
+	size = request.GET.get('size', "")
+	return {
+		'apparatus': apparatus if apparatus in LEADERBOARDS else "AA",
+		'time': time if time in ("year", "season", "quad") else "year",
+		'sumstat': sumstat if sumstat in ("avg", "max") else "avg",
+		'level': level if level in LEVELS else "senior",
+		'country': request.GET.get('country', "").upper() or None,
+		'size': min(int(size), MAX_LEADERBOARD_SIZE) if size.isdigit() and int(size) > 0 else LEADERBOARD_SIZE,
+	}
+
+@conditional_on_generation
+@cache_by_generation
+def leaderboards(request):
+	"""View function for the leaderboards page of site."""
+	options = get_leaderboard_options(request)
+	context = dict(options)
+	context['leaders'] = get_leaderboard(**options)
+	context['part_names'] = get_part_names(options['apparatus'])
+	# Options for the filter form
+	context['countries'] = Country.objects.only('name', 'iso3c')
+	return render(request, 'leaderboards.html', context=context)
+
+
+
 # *******************************
 # Pages related to the blog
 # *******************************
@@ -492,13 +394,7 @@ class PostListView(generic.ListView):
 		context = super(PostListView, self).get_context_data(**kwargs)
 
 		# Get list of tags and # of posts in each tag
-		tags = []
-		for tag in Tag.objects.all():
-			to_display = [tag, Post.objects.filter(tag=tag).count()]
-			tags.append(to_display)
-
-		tags = sorted(tags, key=lambda tup: tup[1], reverse=True)
-		context['tags'] = tags
+		context['tags'] = get_tag_cloud()
 
 		return context
 
@@ -520,13 +416,7 @@ class PostDetailView(generic.DetailView):
 		#context['post_text'] = post_text
 
 		# Get list of tags and # of posts in each tag
-		tags = []
-		for tag in Tag.objects.all():
-			to_display = [tag, Post.objects.filter(tag=tag).count()]
-			tags.append(to_display)
-
-		tags = sorted(tags, key=lambda tup: tup[1], reverse=True)
-		context['tags'] = tags
+		context['tags'] = get_tag_cloud()
 
 		return context
 
@@ -545,13 +435,7 @@ class AuthorDetailView(SingleObjectMixin, ListView):
 		context['author'] = self.object
 
 		# Get list of tags and # of posts in each tag
-		tags = []
-		for tag in Tag.objects.all():
-			to_display = [tag, Post.objects.filter(tag=tag).count()]
-			tags.append(to_display)
-
-		tags = sorted(tags, key=lambda tup: tup[1], reverse=True)
-		context['tags'] = tags
+		context['tags'] = get_tag_cloud()
 
 		return context
 
@@ -573,13 +457,7 @@ class TagDetailView(SingleObjectMixin, ListView):
 		context['author'] = self.object
 
 		# Get list of tags and # of posts in each tag
-		tags = []
-		for tag in Tag.objects.all():
-			to_display = [tag, Post.objects.filter(tag=tag).count()]
-			tags.append(to_display)
-
-		tags = sorted(tags, key=lambda tup: tup[1], reverse=True)
-		context['tags'] = tags
+		context['tags'] = get_tag_cloud()
 
 
 		return context
@@ -594,21 +472,13 @@ from django.http import JsonResponse
 import json
 
 # For the autocomplete on the homepage, searching BOTH gymnast and meet names
+@conditional_on_generation
 def get_search_names(request):
 
 	if request.is_ajax():
 		q = request.GET.get('term', '')
-		# Find all gymnast names that start with the inputted letters, and add them to a json
-		gymnasts = Gymnast.objects.filter(name__istartswith = q )
-		results = []
-		for gymnast in gymnasts:
-			name_json = {'value': gymnast.name}
-			results.append(name_json)
-		# FInd all meet names that start with the inputted letters, and add them to the same json
-		meets = Meet.objects.filter(name__istartswith = q)
-		for meet in meets:
-			name_json = {'value': meet.name}
-			results.append(name_json)
+		# Find gymnast names and then meet names that start with the inputted letters, using the in-memory name index
+		results = [{'value': name} for name in search_names(q)]
 		data = json.dumps(results)
 	else:
 		data = 'fail'
@@ -616,22 +486,43 @@ def get_search_names(request):
 	return HttpResponse(data, mimetype)
 
 # For the autocomplete on the score selector page, which searches just gymnast names
+@conditional_on_generation
 def get_gymnast_names(request):
 
 	if request.is_ajax():
 		q = request.GET.get('term', '')
-		# Find all gymnast names that start with the inputted letters, and add them to a json
-		gymnasts = Gymnast.objects.filter(name__istartswith = q )
-		results = []
-		for gymnast in gymnasts:
-			name_json = {'value': gymnast.name}
-			results.append(name_json)
+		# Find all gymnast names that start with the inputted letters, using the in-memory name index
+		results = [{'value': name} for name in search_names(q, include_meets=False)]
 		data = json.dumps(results)
 	else:
 		data = 'fail'
 	mimetype = 'application/json'
 	return HttpResponse(data, mimetype)
 
+# Score tables for a single meet, in the same structure as the meet detail page
+@conditional_on_generation
+def meet_detail_json(request, pk):
+	meet = get_object_or_404(Meet, pk=pk)
+	data = meet_tables_json(meet, meet_score_tables(meet))
+	return JsonResponse(data)
+
+# The same leaderboard as the leaderboards page, with the same options
+@conditional_on_generation
+@cache_by_generation
+def leaderboards_json(request):
+	options = get_leaderboard_options(request)
+	part_names = get_part_names(options['apparatus'])
+	data = dict(options)
+	data['leaders'] = [{
+		'rank': entry.rank,
+		'gymnast': entry.gymnast.name,
+		'id': str(entry.gymnast.id),
+		'country': entry.gymnast.country.iso3c if entry.gymnast.country is not None else None,
+		'score': round(entry.score, 3),
+		'parts': {name: round(score, 3) for name, score in zip(part_names, entry.parts)},
+	} for entry in get_leaderboard(**options)]
+	return JsonResponse(data)
+
 # For the list of gymnasts on the score selector page, check if the gymnast that the user tried to add exists
 def gymnast_validator(request):
 	to_search = request.GET.get('to_search', None)
@@ -643,3 +534,23 @@ def gymnast_validator(request):
 		'gymnast_exists': gymnast_exists
 	}
 	return JsonResponse(data)
+
+# Download the scores (optionally filtered by ?season=2021, ?meet=<id> and ?country=USA) as CSV or NDJSON
+@conditional_on_generation
+def export_scores(request):
+	export_format = request.GET.get('format', "csv")
+	season = request.GET.get('season', "")
+	meet = request.GET.get('meet', "")
+	if export_format not in EXPORT_FORMATS or (season and not season.isdigit()) or (meet and not meet.isdigit()):
+		return HttpResponseBadRequest("Invalid export options")
+
+	lines = export_lines(export_format,
+		season=int(season) if season else None,
+		meet=int(meet) if meet else None,
+		country=request.GET.get('country') or None)
+	if export_format == "ndjson":
+		response = StreamingHttpResponse(lines, content_type="application/x-ndjson")
+	else:
+		response = StreamingHttpResponse(lines, content_type="text/csv")
+	response['Content-Disposition'] = 'attachment; filename="scores.{}"'.format(export_format)
+	return response
@@ -140,3 +140,13 @@ DATABASES['default'].update(db_from_env)
 # Allowed hosts
 ALLOWED_HOSTS = ['scoreforscore.herokuapp.com', '127.0.0.1', ".scoreforscore.com"]
 
+
+# Files written by the management commands. On Heroku, one-off dynos (where the commands run) have their own
+# ephemeral filesystem, so point these at a persistent location if the web dynos need to see them.
+SCORE_SNAPSHOT_DIR = os.environ.get('SCORE_SNAPSHOT_DIR', os.path.join(BASE_DIR, 'score_snapshot'))
+# Whether a web process that finds no snapshot for the current data writes one itself, in a background thread. This
+# reads the whole scores table into memory in that process, so it's off unless SCORE_SNAPSHOT_ON_DEMAND=1 is set (e.g.
+# where the web processes can't see the directory the commands write to).
+SCORE_SNAPSHOT_ON_DEMAND = os.environ.get('SCORE_SNAPSHOT_ON_DEMAND', "") == "1"
+SOURCE_CACHE_DIR = os.environ.get('SOURCE_CACHE_DIR', os.path.join(BASE_DIR, 'source_cache'))
+INGEST_QUARANTINE_DIR = os.environ.get('INGEST_QUARANTINE_DIR', os.path.join(BASE_DIR, 'quarantine'))